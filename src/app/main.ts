@@ -184,34 +184,25 @@ async function onImportMesh() {
                 logger.debug(`Projects: ${parent_ids}, path: ${path}`);
 
                 AppState.server.ImportMesh({ project: parent_ids[0], path: path }, (error: any, response: any) => {
-                    const { ids } = response;
-
                     if (error)
                         handleError(error);
                     else {
-                        logger.info(`Mesh created, id=${ids}`);
-
-                        onUpdateExplorer(parent_ids, ids);
-
                         //
-                        // Fetch mesh data via streaming. This is necessary because the chunk size in gRPC
-                        // is limited to 4MB. For large meshes, we need to stream the data in chunks.
+                        // The import runs in the background on the server. Watch the import job
+                        // until it is finished and fetch the mesh data afterwards.
                         //
-                        const call = AppState.server.GetMeshData({ id: response.ids[0] });
+                        const job = AppState.server.WatchJob({ id: response.ids[0] });
 
-                        let buffer: Buffer = Buffer.alloc(0);
+                        job.on('data', (status: any) => {
+                            logger.info(`Import job ${status.id}: ${status.state} (${Math.round(status.progress * 100)}%)`);
 
-                        call.on('data', (response: any) => {
-                            logger.info(`Received mesh data: #${response.index} ${response.data.length} bytes in ${response.format} format`);
-                            buffer = Buffer.concat([buffer, response.data]);
+                            if (status.state === 'failed')
+                                handleError(status.message);
+                            else if (status.state === 'done')
+                                onMeshImported(parent_ids, status.ids);
                         });
 
-                        call.on('end', () => {
-                            logger.info('Mesh data stream ended, received ' + buffer.length + ' bytes');
-                            AppState.mainWindow!.webContents.send('renderer::mesh-changed', buffer);
-                        });
-
-                        call.on('error', (error: any) => {
+                        job.on('error', (error: any) => {
                             handleError(error);
                         });
                     }
@@ -221,6 +212,37 @@ async function onImportMesh() {
     }
 }
 
+/**
+ * Handle a finished mesh import
+ */
+function onMeshImported(parent_ids: string[], ids: string[]) {
+    logger.info(`Mesh created, id=${ids}`);
+
+    onUpdateExplorer(parent_ids, ids);
+
+    //
+    // Fetch mesh data via streaming. This is necessary because the chunk size in gRPC
+    // is limited to 4MB. For large meshes, we need to stream the data in chunks.
+    //
+    const call = AppState.server.GetMeshData({ id: ids[0] });
+
+    let buffer: Buffer = Buffer.alloc(0);
+
+    call.on('data', (response: any) => {
+        logger.info(`Received mesh data: #${response.index} ${response.data.length} bytes in ${response.format} format`);
+        buffer = Buffer.concat([buffer, response.data]);
+    });
+
+    call.on('end', () => {
+        logger.info('Mesh data stream ended, received ' + buffer.length + ' bytes');
+        AppState.mainWindow!.webContents.send('renderer::mesh-changed', buffer);
+    });
+
+    call.on('error', (error: any) => {
+        handleError(error);
+    });
+}
+
 /*
  * Fit mesh into view
  */
@@ -0,0 +1,5 @@
+#
+# __init__.py: Module initialization
+#
+# This file is empty, but it is required to make Python treat the server/benchmarks directory as a package.
+#
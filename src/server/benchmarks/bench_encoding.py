@@ -0,0 +1,63 @@
+#
+# bench_encoding.py - Mesh transport encoding benchmark
+#
+# Compares the encodings of GetMeshData by encode time, payload size and decode time on
+# synthetic meshes. glTF payloads are decoded with trimesh, the buffer formats with the
+# reference decoder. Run from the server directory:
+#
+#   python -m benchmarks.bench_encoding --sizes 100k 1M
+#
+
+import argparse
+import io
+import time
+import trimesh
+
+from benchmarks.synthetic import create_surface, parse_size
+from encoding import ENCODINGS, decode_buffers, encode_mesh
+
+
+def measure(function, repeat: int):
+    '''
+    Return the result and the best wall clock time of several runs of a function.
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+
+    return result, min(times)
+
+
+def decode(payload: bytes, encoding: str):
+    if encoding == 'glb':
+        return trimesh.load(io.BytesIO(payload), file_type='glb', force='mesh')
+
+    return decode_buffers(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mesh transport encoding benchmark")
+    parser.add_argument("--sizes", nargs='+', default=['100k', '1M'], help="Face counts of the test meshes")
+    parser.add_argument("--encodings", nargs='+', default=list(ENCODINGS), choices=ENCODINGS, help="Encodings to compare")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs per measurement")
+
+    args = parser.parse_args()
+
+    print(f'{"faces":>12} {"encoding":>11} {"encode [s]":>11} {"bytes":>12} {"bytes/face":>11} {"decode [s]":>11}')
+
+    for size in args.sizes:
+        mesh = create_surface(parse_size(size))
+        faces = len(mesh.faces)
+
+        for encoding in args.encodings:
+            payload, encode_time = measure(lambda: encode_mesh(mesh, encoding), args.repeat)
+            _, decode_time = measure(lambda: decode(payload, encoding), args.repeat)
+
+            print(f'{faces:>12} {encoding:>11} {encode_time:>11.3f} {len(payload):>12} '
+                  f'{len(payload) / faces:>11.2f} {decode_time:>11.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#
+# bench_memory.py - Object model memory benchmark
+#
+# Measures the memory used per object for projects with many small meshes and per
+# triangle for large meshes, with and without keeping the trimesh objects alive. Run
+# from the server directory:
+#
+#   python -m benchmarks.bench_memory --objects 10000 --sizes 1M
+#
+
+import argparse
+import gc
+import numpy as np
+import trimesh
+import tracemalloc
+
+from benchmarks.synthetic import create_surface, parse_size
+from elements.mesh import Mesh
+from elements.project import Project
+
+
+def measure(function):
+    '''
+    Return the result of a function and the number of bytes it allocated which are still
+    in use after it returned.
+    '''
+    gc.collect()
+    tracemalloc.start()
+
+    try:
+        result = function()
+        gc.collect()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return result, size
+
+
+def use(mesh: Mesh):
+    '''
+    Access the mesh like the server does when answering requests.
+    '''
+    mesh.get_info()
+    mesh.data.face_normals
+
+
+def create_project(count: int) -> Project:
+    part = trimesh.creation.box()
+    vertices, faces = np.asarray(part.vertices), np.asarray(part.faces)
+    project = Project('Benchmark')
+
+    for index in range(count):
+        mesh = Mesh(f'Part {index}', None)
+        mesh.set_arrays(vertices + index, faces.copy())
+        project.add_mesh(mesh)
+        use(mesh)
+
+    return project
+
+
+def create_mesh(data: trimesh.Trimesh) -> Mesh:
+    mesh = Mesh('Benchmark', None)
+    mesh.set_arrays(np.array(data.vertices), np.array(data.faces))
+    use(mesh)
+    return mesh
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Object model memory benchmark")
+    parser.add_argument("--objects", type=int, default=10000, help="Number of small meshes in the project")
+    parser.add_argument("--sizes", nargs='+', default=['1M'], help="Face counts of the large test meshes")
+
+    args = parser.parse_args()
+
+    part = trimesh.creation.box()
+    geometry = part.vertices.nbytes + part.faces.astype('int64').nbytes
+
+    print(f'{"test":>16} {"keep trimesh":>13} {"bytes/object":>13} {"bytes/triangle":>15}')
+
+    for keep in (True, False):
+        Mesh.KEEP_TRIMESH = keep
+
+        project, size = measure(lambda: create_project(args.objects))
+        del project
+
+        # The geometry arrays themselves are not part of the object overhead
+        print(f'{args.objects:>10} parts {str(keep):>13} {size / args.objects - geometry:>13.0f} {"":>15}')
+
+        for text in args.sizes:
+            data = create_surface(parse_size(text))
+            faces = len(data.faces)
+
+            mesh, size = measure(lambda: create_mesh(data))
+            del mesh, data
+
+            print(f'{faces:>10} faces {str(keep):>13} {"":>13} {size / faces:>15.1f}')
+
+
+if __name__ == '__main__':
+    main()
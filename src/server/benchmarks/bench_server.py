@@ -0,0 +1,444 @@
+#
+# bench_server.py - End-to-end server benchmark
+#
+# Measures the startup of the server process until its port is bound and until it is
+# ready. Then runs the gRPC service in process and measures the import of synthetic
+# meshes, saving and loading projects, GetObjectTree and GetObjectInfo on large trees,
+# the GetMeshData throughput and latency with concurrent clients, each using its own
+# channel, GetSlices with a dense stack of planes and the GetMeshData latency of a
+# project while another project keeps all compute workers busy, with the project
+# sharing the workers or isolated. Run from the server directory with the generated
+# gRPC modules on the path:
+#
+#   python -m benchmarks.bench_server --sizes 10k 1M --output results.json
+#   python -m benchmarks.bench_server --sizes 10k 1M --baseline results.json
+#
+# The results are written as JSON. Each result is identified by the benchmark name and
+# its parameters, so the results of two runs can be compared with --baseline.
+#
+
+import argparse
+import asyncio
+import grpc
+import json
+import numpy as np
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import trimesh
+
+from concurrent import futures
+
+import service
+import zinspector_pb2
+import zinspector_pb2_grpc
+
+from benchmarks.synthetic import create_surface, parse_size
+from elements.mesh import Mesh
+from elements.object import ObjectIdDatabase
+from elements.project import Project
+from encoding import ENCODINGS
+
+
+class Server:
+    '''
+    The ZInspector service running on an event loop in a background thread, listening
+    on a free local port.
+    '''
+
+    def __init__(self, import_workers: int = None, compute_workers: int = None):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+        self.service = service.ZInspector(import_workers=import_workers, compute_workers=compute_workers)
+        self.service.warm_up()
+        self.server, self.port = self.run(self.__start__())
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def connect(self) -> grpc.Channel:
+        '''
+        Open a new channel to the server.
+        '''
+        return grpc.insecure_channel(f'localhost:{self.port}')
+
+    def close(self):
+        self.run(self.server.stop(grace=None))
+        self.service.shutdown()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    async def __start__(self):
+        server = grpc.aio.server()
+        zinspector_pb2_grpc.add_ZInspectorServicer_to_server(self.service, server)
+        port = server.add_insecure_port('localhost:0')
+        await server.start()
+        return server, port
+
+
+class Results:
+    '''
+    Collects the results and prints each one as a table row, together with the change
+    relative to the baseline run if one has been given.
+    '''
+
+    def __init__(self, args, baseline: str = None):
+        self.meta = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'numpy': np.__version__,
+            'grpc': grpc.__version__,
+            'args': vars(args)
+        }
+        self.results = []
+        self.baseline = {}
+
+        if baseline:
+            with open(baseline) as f:
+                self.baseline = {Results.__key__(result): result['metrics'] for result in json.load(f)['results']}
+
+        print(f'{"benchmark":>12} {"parameters":>40} {"metric":>20} {"value":>12} {"baseline":>9}')
+
+    def add(self, benchmark: str, params: dict, metrics: dict):
+        result = {'benchmark': benchmark, 'params': params, 'metrics': metrics}
+        self.results.append(result)
+
+        baseline = self.baseline.get(Results.__key__(result), {})
+        text = ' '.join(f'{key}={value}' for key, value in params.items())
+
+        for metric, value in metrics.items():
+            change = f'{value / baseline[metric]:>8.2f}x' if baseline.get(metric) else ''
+            print(f'{benchmark:>12} {text:>40} {metric:>20} {value:>12.4g} {change:>9}', flush=True)
+
+    def write(self, filename: str):
+        with open(filename, 'w') as f:
+            json.dump({'meta': self.meta, 'results': self.results}, f, indent=2)
+
+    @staticmethod
+    def __key__(result: dict):
+        return result['benchmark'], json.dumps(result['params'], sort_keys=True)
+
+
+def latencies(values: list) -> dict:
+    '''
+    Summarize a list of latencies in seconds.
+    '''
+    values = np.asarray(values)
+    return {'p50': float(np.percentile(values, 50)), 'p95': float(np.percentile(values, 95)), 'max': float(values.max())}
+
+
+def import_mesh(stub, project_id: str, path: str):
+    '''
+    Import a mesh and wait until the job is finished.
+
+    Returns:
+        Tuple of the mesh id, the wall clock time and the stage timings of the job.
+    '''
+    start = time.perf_counter()
+
+    job = stub.ImportMesh(zinspector_pb2.ImportMeshRequest(project=project_id, path=path)).ids[0]
+    for status in stub.WatchJob(zinspector_pb2.IdRequest(id=job)):
+        pass
+
+    elapsed = time.perf_counter() - start
+
+    if status.state != 'done' or not status.ids:
+        raise RuntimeError(f'Import of {path} failed: {status.message}')
+
+    return status.ids[0], elapsed, dict(status.timings)
+
+
+def get_mesh_data(stub, mesh_id: str, encoding: str):
+    '''
+    Stream the data of a mesh without keeping it.
+
+    Returns:
+        Tuple of the number of bytes, the time to the first chunk and the total time.
+    '''
+    size = 0
+    first = None
+    start = time.perf_counter()
+
+    for chunk in stub.GetMeshData(zinspector_pb2.MeshDataRequest(id=mesh_id, encoding=encoding)):
+        if first is None:
+            first = time.perf_counter() - start
+        size += len(chunk.data)
+
+    return size, first, time.perf_counter() - start
+
+
+def bench_startup(results: Results, repeat: int):
+    '''
+    Start the server process several times and measure the time until its port accepts
+    connections, until the service is loaded and until the server is ready.
+    '''
+    directory = os.path.dirname(os.path.abspath(service.__file__))
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+
+    times = {'bind': [], 'serving': [], 'ready': []}
+
+    for _ in range(repeat):
+        with socket.socket() as probe:
+            probe.bind(('localhost', 0))
+            port = probe.getsockname()[1]
+
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, 'zinspector.py', '--port', str(port), '--log-level', 'WARNING'],
+                                   cwd=directory, env=environment)
+
+        try:
+            # The gRPC channel would back off after the first refused connection
+            while True:
+                with socket.socket() as probe:
+                    if probe.connect_ex(('localhost', port)) == 0:
+                        break
+                if process.poll() is not None or time.perf_counter() - start > 60:
+                    raise RuntimeError('The server did not start')
+                time.sleep(0.001)
+
+            times['bind'].append(time.perf_counter() - start)
+
+            with grpc.insecure_channel(f'localhost:{port}') as channel:
+                stub = zinspector_pb2_grpc.ZInspectorStub(channel)
+
+                stub.GetObjectTree(zinspector_pb2.IdRequest(id=''))
+                times['serving'].append(time.perf_counter() - start)
+
+                stub.Health(zinspector_pb2.HealthRequest(wait=True, timeout=60))
+                times['ready'].append(time.perf_counter() - start)
+
+        finally:
+            process.terminate()
+            process.wait()
+
+    results.add('startup', {}, {f'{state}_seconds': float(np.median(values)) for state, values in times.items()})
+
+
+def bench_import(server: Server, results: Results, size: str, path: str) -> str:
+    stub = zinspector_pb2_grpc.ZInspectorStub(server.connect())
+    project_id = stub.CreateProject(zinspector_pb2.CreateProjectRequest(name=f'Import {size}')).ids[0]
+
+    mesh_id, elapsed, timings = import_mesh(stub, project_id, path)
+
+    metrics = {'seconds': elapsed, 'faces_per_second': ObjectIdDatabase.get(mesh_id).get_face_count() / elapsed}
+    metrics.update({f'{stage}_seconds': seconds for stage, seconds in sorted(timings.items())})
+    results.add('import', {'faces': size}, metrics)
+
+    return mesh_id
+
+
+def bench_persistence(results: Results, size: str, mesh_id: str, directory: str):
+    project = ObjectIdDatabase.get(mesh_id).get_parent()
+    filename = os.path.join(directory, f'{size}.h5')
+
+    start = time.perf_counter()
+    project.save(filename)
+    save_time = time.perf_counter() - start
+
+    metrics = {'save_seconds': save_time, 'file_bytes': os.path.getsize(filename)}
+
+    for lazy in (True, False):
+        loaded = Project('Loaded')
+
+        start = time.perf_counter()
+        loaded.load(filename, lazy=lazy)
+        infos = [mesh.get_info() for mesh in loaded.meshes]
+        metrics[f'load_{"lazy" if lazy else "full"}_seconds'] = time.perf_counter() - start
+
+        del infos, loaded
+
+    os.remove(filename)
+    results.add('persistence', {'faces': size}, metrics)
+
+
+def bench_mesh_data(server: Server, results: Results, size: str, mesh_id: str, encodings: list, clients: list, requests: int):
+    stub = zinspector_pb2_grpc.ZInspectorStub(server.connect())
+
+    for encoding in encodings:
+        # The first request encodes the mesh, later ones are answered from the cache
+        service.ZInspector.cache.clear()
+        payload, first, elapsed = get_mesh_data(stub, mesh_id, encoding)
+        results.add('mesh_data', {'faces': size, 'encoding': encoding, 'cache': 'cold'},
+                    {'seconds': elapsed, 'first_chunk_seconds': first, 'bytes': payload})
+
+        for count in clients:
+            def client():
+                with server.connect() as channel:
+                    client_stub = zinspector_pb2_grpc.ZInspectorStub(channel)
+                    return [get_mesh_data(client_stub, mesh_id, encoding) for _ in range(requests)]
+
+            start = time.perf_counter()
+            with futures.ThreadPoolExecutor(max_workers=count) as executor:
+                calls = [call for calls in executor.map(lambda _: client(), range(count)) for call in calls]
+            elapsed = time.perf_counter() - start
+
+            metrics = {'requests_per_second': len(calls) / elapsed,
+                       'mb_per_second': sum(call[0] for call in calls) / elapsed / 1024 / 1024}
+            metrics.update({f'latency_{key}': value for key, value in latencies([call[2] for call in calls]).items()})
+            metrics.update({f'first_chunk_{key}': value for key, value in latencies([call[1] for call in calls]).items()})
+
+            results.add('mesh_data', {'faces': size, 'encoding': encoding, 'cache': 'warm', 'clients': count}, metrics)
+
+
+def bench_slices(server: Server, results: Results, size: str, mesh_id: str, planes: int):
+    stub = zinspector_pb2_grpc.ZInspectorStub(server.connect())
+
+    bounds = ObjectIdDatabase.get(mesh_id).get_info()['bounds']
+    request = zinspector_pb2.SliceRequest(id=mesh_id, normal=[0.0, 0.0, 1.0], count=planes,
+                                          start=bounds[2], step=(bounds[5] - bounds[2]) / planes)
+
+    # The first request builds the edge index of the mesh
+    for index in ['cold', 'warm']:
+        points = 0
+        first = None
+        start = time.perf_counter()
+
+        for chunk in stub.GetSlices(request):
+            if first is None:
+                first = time.perf_counter() - start
+            points += len(chunk.points) // 12
+
+        elapsed = time.perf_counter() - start
+        results.add('slices', {'faces': size, 'planes': planes, 'index': index},
+                    {'seconds': elapsed, 'first_chunk_seconds': first, 'planes_per_second': planes / elapsed,
+                     'points': points})
+
+
+def bench_isolation(server: Server, results: Results, size: str, mesh_id: str, directory: str, requests: int):
+    stub = zinspector_pb2_grpc.ZInspectorStub(server.connect())
+
+    # Closest point queries against the imported mesh occupy all shared compute workers
+    bounds = np.asarray(ObjectIdDatabase.get(mesh_id).get_info()['bounds']).reshape(2, 3)
+    points = np.random.default_rng(0).uniform(bounds[0], bounds[1], (1000, 3)).astype('<f4').tobytes()
+    stop = threading.Event()
+
+    def load():
+        with server.connect() as channel:
+            load_stub = zinspector_pb2_grpc.ZInspectorStub(channel)
+            while not stop.is_set():
+                load_stub.ClosestPoint(zinspector_pb2.ClosestPointRequest(id=mesh_id, points=points))
+
+    path = os.path.join(directory, 'isolation.stl')
+    create_surface(10000).export(path)
+
+    for isolated in [False, True]:
+        project_id = stub.CreateProject(zinspector_pb2.CreateProjectRequest(name='Isolation', isolated=isolated)).ids[0]
+        small_id = import_mesh(stub, project_id, path)[0]
+        get_mesh_data(stub, small_id, 'glb')
+
+        stop.clear()
+        clients = server.service.workers.compute_workers * 2
+        with futures.ThreadPoolExecutor(max_workers=clients) as executor:
+            loads = [executor.submit(load) for _ in range(clients)]
+            time.sleep(0.5)
+
+            try:
+                calls = [get_mesh_data(stub, small_id, 'glb')[2] for _ in range(requests)]
+            finally:
+                stop.set()
+
+            for future in loads:
+                future.result()
+
+        stub.CloseProject(zinspector_pb2.IdRequest(id=project_id))
+
+        results.add('isolation', {'faces': size, 'isolated': isolated},
+                    {f'latency_{key}': value for key, value in latencies(calls).items()})
+
+    os.remove(path)
+
+
+def bench_tree(server: Server, results: Results, count: int, repeat: int):
+    part = trimesh.creation.box()
+    vertices, faces = np.asarray(part.vertices), np.asarray(part.faces)
+
+    project = Project(f'Tree {count}')
+    for index in range(count):
+        mesh = Mesh(f'Part {index}', None)
+        mesh.set_arrays(vertices + index, faces)
+        project.add_mesh(mesh)
+
+    service.ZInspector.root.add_project(project)
+
+    stub = zinspector_pb2_grpc.ZInspectorStub(server.connect())
+    request = zinspector_pb2.IdRequest(id=project.get_id())
+
+    # The first request serializes the tree, later ones are answered from the tree index
+    start = time.perf_counter()
+    stub.GetObjectTree(request)
+    cold = time.perf_counter() - start
+
+    warm = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        stub.GetObjectTree(request)
+        warm.append(time.perf_counter() - start)
+
+    info = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        stub.GetObjectInfo(zinspector_pb2.ObjectInfoRequest(parent=project.get_id()))
+        info.append(time.perf_counter() - start)
+
+    results.add('tree', {'objects': count}, {'cold_seconds': cold, 'warm_seconds': float(np.median(warm)),
+                                             'info_seconds': float(np.median(info))})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end server benchmark")
+    parser.add_argument("--sizes", nargs='+', default=['10k', '1M', '10M'], help="Face counts of the test meshes")
+    parser.add_argument("--objects", nargs='+', type=int, default=[1000, 10000], help="Object counts of the test trees")
+    parser.add_argument("--encodings", nargs='+', default=['glb', 'compressed'], choices=ENCODINGS,
+                        help="Encodings requested from GetMeshData")
+    parser.add_argument("--clients", nargs='+', type=int, default=[1, 4, 16], help="Numbers of concurrent clients")
+    parser.add_argument("--requests", type=int, default=4, help="Number of GetMeshData requests per client")
+    parser.add_argument("--planes", type=int, default=1000, help="Number of planes of the GetSlices requests")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs of the startup and tree requests")
+    parser.add_argument("--import-workers", type=int, default=None, help="Number of import worker processes")
+    parser.add_argument("--compute-workers", type=int, default=None, help="Number of compute threads")
+    parser.add_argument("--output", help="JSON file the results are written to")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+
+    args = parser.parse_args()
+
+    results = Results(args, args.baseline)
+
+    bench_startup(results, args.repeat)
+
+    server = Server(import_workers=args.import_workers, compute_workers=args.compute_workers)
+
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            for size in args.sizes:
+                path = os.path.join(directory, f'{size}.stl')
+                create_surface(parse_size(size)).export(path)
+
+                mesh_id = bench_import(server, results, size, path)
+                os.remove(path)
+
+                bench_persistence(results, size, mesh_id, directory)
+                bench_mesh_data(server, results, size, mesh_id, args.encodings, args.clients, args.requests)
+                bench_slices(server, results, size, mesh_id, args.planes)
+                bench_isolation(server, results, size, mesh_id, directory, args.requests * 5)
+
+            for count in args.objects:
+                bench_tree(server, results, count, args.repeat)
+
+    finally:
+        server.close()
+
+    if args.output:
+        results.write(args.output)
+
+
+if __name__ == '__main__':
+    main()
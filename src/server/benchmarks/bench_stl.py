@@ -0,0 +1,62 @@
+#
+# bench_stl.py - STL reader benchmark
+#
+# Compares the vectorized STL reader with trimesh on synthetic meshes. Run from the
+# server directory:
+#
+#   python -m benchmarks.bench_stl --sizes 1M 10M
+#
+
+import argparse
+import os
+import tempfile
+import time
+import trimesh
+
+from benchmarks.synthetic import create_surface, parse_size
+from elements.stl import read_stl
+
+
+def measure(function, repeat: int) -> float:
+    '''
+    Return the best wall clock time of several runs of a function.
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="STL reader benchmark")
+    parser.add_argument("--sizes", nargs='+', default=['1M', '10M'], help="Face counts of the test meshes")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs per measurement")
+    parser.add_argument("--ascii", action='store_true', help="Benchmark ASCII instead of binary files")
+
+    args = parser.parse_args()
+
+    print(f'{"faces":>12} {"format":>8} {"trimesh [s]":>12} {"read_stl [s]":>13} {"speedup":>8}')
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            mesh = create_surface(parse_size(size))
+            path = os.path.join(directory, f'{size}.stl')
+            mesh.export(path, file_type='stl_ascii' if args.ascii else 'stl')
+
+            del mesh
+
+            reference = measure(lambda: trimesh.load(path, file_type='stl'), args.repeat)
+            vectorized = measure(lambda: read_stl(path), args.repeat)
+
+            _, faces = read_stl(path)
+            print(f'{len(faces):>12} {"ascii" if args.ascii else "binary":>8} '
+                  f'{reference:>12.3f} {vectorized:>13.3f} {reference / vectorized:>7.1f}x')
+
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
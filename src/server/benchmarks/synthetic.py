@@ -0,0 +1,32 @@
+#
+# synthetic.py - Synthetic test meshes for benchmarks
+#
+
+import numpy as np
+import trimesh
+
+
+def create_surface(faces: int, seed: int = 0) -> trimesh.Trimesh:
+    '''
+    Create a wavy height field surface with approximately the given number of faces.
+    '''
+    n = max(int(np.sqrt(faces / 2)), 1) + 1
+
+    x, y = np.meshgrid(np.linspace(0.0, 100.0, n), np.linspace(0.0, 100.0, n), indexing='ij')
+    z = np.sin(x / 7.0) * np.cos(y / 5.0) * 3.0 + np.random.default_rng(seed).normal(0.0, 0.01, x.shape)
+    vertices = np.column_stack([x.ravel(), y.ravel(), z.ravel()])
+
+    index = np.arange(n * n).reshape(n, n)
+    a, b, c, d = index[:-1, :-1].ravel(), index[1:, :-1].ravel(), index[1:, 1:].ravel(), index[:-1, 1:].ravel()
+    faces = np.concatenate([np.column_stack([a, b, c]), np.column_stack([a, c, d])])
+
+    return trimesh.Trimesh(vertices=vertices, faces=faces, process=False)
+
+
+def parse_size(text: str) -> int:
+    '''
+    Parse a face count like '10k' or '1M'.
+    '''
+    factors = {'k': 1000, 'm': 1000 * 1000}
+    suffix = text[-1].lower()
+    return int(float(text[:-1]) * factors[suffix]) if suffix in factors else int(text)
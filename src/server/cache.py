@@ -0,0 +1,257 @@
+#
+# cache.py - Payload caching and streaming
+#
+
+import hashlib
+import mmap
+import tempfile
+import threading
+
+from collections import OrderedDict
+
+
+def iter_chunks(payload, chunk_size: int, start: int = 0, stop: int = None):
+    '''
+    Iterate over a payload or over the byte range [start, stop) of it in chunks of the
+    given size.
+
+    The payload can be a spilled payload or any object supporting the buffer protocol.
+    Chunks are sliced from a memoryview, so only the chunk currently handed out is copied.
+    '''
+    view = payload.view() if isinstance(payload, SpilledPayload) else memoryview(payload)
+    stop = len(view) if stop is None else min(stop, len(view))
+
+    try:
+        for offset in range(start, stop, chunk_size):
+            yield bytes(view[offset:min(offset + chunk_size, stop)])
+    finally:
+        view.release()
+
+
+def payload_tag(payload) -> str:
+    '''
+    Get the content hash of a payload, which clients use as entity tag to validate their
+    copies of it.
+    '''
+    view = payload.view() if isinstance(payload, SpilledPayload) else memoryview(payload)
+
+    try:
+        return hashlib.blake2b(view, digest_size=16).hexdigest()
+    finally:
+        view.release()
+
+
+class SpilledPayload:
+    '''
+    Payload stored in an anonymous temporary file and memory mapped for reading, so
+    large payloads do not occupy process memory while they are cached or streamed.
+
+    The file is removed as soon as the last reference to the payload is dropped.
+    '''
+
+    def __init__(self, payload, directory: str = None):
+        self._size = len(payload)
+        self._file = tempfile.TemporaryFile(dir=directory)
+        self._file.write(payload)
+        self._file.flush()
+
+        # Empty files cannot be mapped
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self._size else b''
+
+    def __del__(self):
+        try:
+            if self._size:
+                self._map.close()
+        except BufferError:
+            pass  # A view of the payload is still in use and keeps the mapping alive
+
+        self._file.close()
+
+    def __len__(self):
+        return self._size
+
+    def view(self) -> memoryview:
+        '''
+        Get a read only view of the payload.
+        '''
+        return memoryview(self._map)
+
+    def __repr__(self):
+        return f'<SpilledPayload size={self._size}>'
+
+
+class PayloadCache:
+    '''
+    Least recently used cache for encoded payloads with a byte budget.
+
+    Keys are tuples whose first element is the id of the object the payload was
+    derived from, so all payloads of an object can be discarded at once.
+
+    Optionally, payloads above a size threshold are spilled into a second cache
+    holding memory mapped temporary files with its own byte budget.
+
+    The content hash of each payload is computed once when it is added, see get_tag().
+    '''
+
+    def __init__(self, budget: int, spill_size: int = None, spill_budget: int = 0):
+        '''
+        Initialize the cache.
+
+        Args:
+            budget (int): Maximum number of payload bytes kept in memory.
+            spill_size (int): Payloads of at least this size are spilled to disk. If None,
+                no payloads are spilled.
+            spill_budget (int): Maximum number of payload bytes kept on disk.
+        '''
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.spill_size = spill_size
+        self.spill = PayloadCache(spill_budget) if spill_size is not None else None
+
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple):
+        '''
+        Get a payload from the cache or None if it is not present.
+        '''
+        with self._lock:
+            payload = self.__lookup__(key)
+            if payload is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+            return payload
+
+    def get_tag(self, key: tuple):
+        '''
+        Get the content hash of a cached payload or None if it is not present.
+        '''
+        with self._lock:
+            tag = self._tags.get(key)
+
+        if tag is None and self.spill is not None:
+            tag = self.spill.get_tag(key)
+
+        return tag
+
+    def put(self, key: tuple, payload):
+        '''
+        Add a payload to the cache, evicting the least recently used entries if the
+        budget is exceeded. Payloads larger than the whole budget are not cached.
+        '''
+        if self.spill is not None and len(payload) >= self.spill_size:
+            self.spill.put(key, payload if isinstance(payload, SpilledPayload) else SpilledPayload(payload))
+            return
+
+        tag = payload_tag(payload) if len(payload) <= self.budget else None
+
+        with self._lock:
+            if key in self._entries:
+                self.size -= len(self._entries.pop(key))
+                self._tags.pop(key)
+
+            if tag is None:
+                return
+
+            self._entries[key] = payload
+            self._tags[key] = tag
+            self.size += len(payload)
+
+            while self.size > self.budget:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                del self._tags[evicted_key]
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def get_or_create(self, key: tuple, create):
+        '''
+        Get a payload from the cache or create and cache it using the given function.
+        Concurrent requests for the same key wait for a single creation.
+        '''
+        payload = self.get(key)
+        if payload is not None:
+            return payload
+
+        with self._lock:
+            pending = self._pending.setdefault(key, threading.Lock())
+
+        try:
+            with pending:
+                with self._lock:
+                    payload = self.__lookup__(key)
+
+                if payload is None:
+                    payload = create()
+                    self.put(key, payload)
+
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+        return payload
+
+    def discard(self, obj_id: str):
+        '''
+        Remove all payloads derived from the object with the given id.
+        '''
+        if self.spill is not None:
+            self.spill.discard(obj_id)
+
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == obj_id]:
+                self.size -= len(self._entries.pop(key))
+                del self._tags[key]
+
+    def clear(self):
+        '''
+        Remove all payloads from the cache.
+        '''
+        if self.spill is not None:
+            self.spill.clear()
+
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        '''
+        Get the cache statistics.
+        '''
+        with self._lock:
+            stats = {
+                'entries': len(self._entries),
+                'size': self.size,
+                'budget': self.budget,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+        if self.spill is not None:
+            stats['spill'] = self.spill.stats()
+
+        return stats
+
+    def __lookup__(self, key: tuple):
+        '''
+        Look up a payload in memory and in the spill cache. Must be called with the lock held.
+        '''
+        payload = self._entries.get(key)
+        if payload is not None:
+            self._entries.move_to_end(key)
+        elif self.spill is not None:
+            payload = self.spill.get(key)
+
+        return payload
+
+    def __repr__(self):
+        return f'<PayloadCache size={self.size}/{self.budget}, #entries={len(self._entries)}>'
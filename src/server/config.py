@@ -0,0 +1,34 @@
+#
+# config.py - Server configuration
+#
+# Only imports the standard library, so it can be read before the service modules are
+# loaded.
+#
+
+import os
+import tempfile
+
+
+class Configuration:
+    '''
+    Constants user for configuration
+    '''
+    MESH_DATA_CHUNK_SIZE = 1024 * 1024 * 2  # Default limit for grpc is 4MB
+    MESH_DATA_MAX_CHUNK_SIZE = 1024 * 1024 * 4 - 1024 * 64  # Leave room for the message overhead
+    MESH_ENCODING = 'glb'  # Default mesh encoding if the client does not request one, see encoding.py
+    MESH_CACHE_SIZE = 1024 * 1024 * 512  # Byte budget of the encoded mesh cache
+    MESH_SPILL_SIZE = 1024 * 1024 * 64  # Payloads of at least this size are cached on disk
+    MESH_SPILL_CACHE_SIZE = 1024 * 1024 * 1024 * 4  # Byte budget of the on-disk mesh cache
+    SLICE_MAX_PLANES = 100000  # Maximum number of planes of a GetSlices request
+    JOB_STATUS_INTERVAL = 1.0  # Maximum time between two job status updates in seconds
+    COMPUTE_WORKERS = os.cpu_count()  # Default number of threads for CPU heavy requests
+    PROJECT_IMPORT_WORKERS = max(os.cpu_count() // 2, 1)  # Number of worker processes of each isolated project
+    PROJECT_COMPUTE_WORKERS = max(os.cpu_count() // 2, 1)  # Number of threads of each isolated project
+    GEOMETRY_BUDGET = None  # Byte budget of the resident mesh geometry, unlimited if not set
+    PREPROCESS_STEPS = None  # Preprocessing steps applied to imported meshes, DEFAULT_STEPS of preprocess.py if not set
+    MERGE_TOLERANCE = 1e-7  # Vertex merge tolerance relative to the bounding box diagonal
+    MIN_COMPONENT_FACES = 100  # Minimum face count of the components split off imported meshes
+    METRICS_PORT = None  # HTTP port serving the metrics for Prometheus at /metrics, disabled if not set
+    PROFILE_THRESHOLD = None  # Requests taking at least this many seconds are profiled, disabled if not set
+    PROFILE_DIR = os.path.join(tempfile.gettempdir(), 'zinspector-profiles')  # Directory of the request profiles
+    LOG_LEVEL = 'INFO'  # Level of the server log
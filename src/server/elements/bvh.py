@@ -0,0 +1,378 @@
+#
+# bvh.py - Bounding volume hierarchy
+#
+
+import h5py
+import numpy as np
+
+
+class BVH:
+    '''
+    Bounding volume hierarchy over the triangles of a mesh.
+
+    The hierarchy is a binary tree stored in flat arrays. The two children of an inner
+    node are stored next to each other, 'left' holds the index of the first one and is
+    -1 for leaves. Each node covers the triangles order[start:start + count].
+
+    The triangles are not copied: the hierarchy refers to them by index into the vertex
+    and face arrays of the mesh, which it shares with the mesh.
+
+    All queries are vectorized: instead of traversing the tree once per query, batches
+    of pairs of queries and nodes still to be visited are processed at once. The batches
+    are kept on a stack, so the traversal is depth first and its memory is bounded.
+    '''
+
+    # Maximum number of triangles in a leaf
+    LEAF_SIZE = 8
+
+    # Maximum number of query/node pairs processed in one traversal step
+    MAX_PAIRS = 64 * 1024
+
+    # Names of the arrays stored in an HDF5 group
+    ARRAYS = ['lower', 'upper', 'left', 'start', 'count', 'order']
+
+    def __init__(self, lower, upper, left, start, count, order, vertices, faces):
+        self.lower = lower
+        self.upper = upper
+        self.left = left
+        self.start = start
+        self.count = count
+        self.order = order
+
+        # Geometry of the mesh, the triangle order[i] has the corners vertices[faces[order[i]]]
+        self.vertices = vertices
+        self.faces = faces
+
+    @staticmethod
+    def build(vertices: np.ndarray, faces: np.ndarray, leaf_size: int = None) -> 'BVH':
+        '''
+        Build the hierarchy by recursively splitting the triangles at the median of
+        their centroids along the longest axis. All nodes of a tree level are split at
+        once.
+        '''
+        leaf_size = leaf_size or BVH.LEAF_SIZE
+        triangles = vertices[faces]
+        centroids = triangles.mean(axis=1)
+
+        order = np.arange(len(faces), dtype=np.int64)
+        start = [0]
+        count = [len(faces)]
+        left = [-1]
+
+        level = np.array([0]) if len(faces) > leaf_size else np.empty(0, dtype=np.int64)
+
+        while len(level):
+            level_start = np.array([start[node] for node in level])
+            level_count = np.array([count[node] for node in level])
+
+            # Gather the triangles of all nodes of the level into one segmented array
+            offsets = np.concatenate([[0], np.cumsum(level_count)[:-1]])
+            segment = np.repeat(np.arange(len(level)), level_count)
+            index = np.arange(level_count.sum()) - offsets[segment] + level_start[segment]
+            points = centroids[order[index]]
+
+            extent = np.maximum.reduceat(points, offsets) - np.minimum.reduceat(points, offsets)
+            axis = np.argmax(extent, axis=1)
+
+            # Sort each segment along its split axis
+            permutation = np.lexsort((points[np.arange(len(points)), axis[segment]], segment))
+            order[index] = order[index][permutation]
+
+            next_level = []
+            for node, node_start, node_count in zip(level, level_start, level_count):
+                half = node_count // 2
+                left[node] = len(start)
+
+                for child_start, child_count in ((node_start, half), (node_start + half, node_count - half)):
+                    if child_count > leaf_size:
+                        next_level.append(len(start))
+
+                    start.append(child_start)
+                    count.append(child_count)
+                    left.append(-1)
+
+            level = np.array(next_level, dtype=np.int64)
+
+        start = np.array(start, dtype=np.int64)
+        count = np.array(count, dtype=np.int64)
+        left = np.array(left, dtype=np.int64)
+        lower, upper = BVH.__compute_bounds__(triangles[order], start, count, left)
+
+        return BVH(lower, upper, left, start, count, order, vertices, faces)
+
+    @staticmethod
+    def load(group: h5py.Group, vertices: np.ndarray, faces: np.ndarray) -> 'BVH':
+        '''
+        Load a hierarchy from an HDF5 group. The triangles are taken from the mesh geometry.
+        '''
+        arrays = {name: group[name][:] for name in BVH.ARRAYS}
+        return BVH(vertices=vertices, faces=faces, **arrays)
+
+    def save(self, group: h5py.Group):
+        '''
+        Save the hierarchy to an HDF5 group.
+        '''
+        for name in BVH.ARRAYS:
+            group.create_dataset(name, data=getattr(self, name), compression='gzip', shuffle=True)
+
+    def ray_cast(self, origins: np.ndarray, directions: np.ndarray):
+        '''
+        Find the first intersection of each ray with the mesh.
+
+        Returns:
+            Tuple of the (n,) hit distances in units of the direction vector length, which
+            are infinite for rays missing the mesh, and the (n,) hit face indices, which
+            are -1 for rays missing the mesh.
+        '''
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+
+        distances = np.full(len(origins), np.inf)
+        faces = np.full(len(origins), -1, dtype=np.int64)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inverse = 1.0 / directions
+
+        def prune(queries, nodes):
+            # Keep the pairs whose ray hits the node box before the closest hit so far
+            with np.errstate(invalid='ignore'):
+                t0 = (self.lower[nodes] - origins[queries]) * inverse[queries]
+                t1 = (self.upper[nodes] - origins[queries]) * inverse[queries]
+
+            t_near = np.nanmax(np.minimum(t0, t1), axis=1)
+            t_far = np.nanmin(np.maximum(t0, t1), axis=1)
+
+            return (t_near <= t_far) & (t_far >= 0) & (t_near <= distances[queries])
+
+        def visit(queries, nodes):
+            candidates, triangles = self.__expand_leaves__(queries, nodes)
+            if len(candidates):
+                t = BVH.__intersect__(origins[candidates], directions[candidates], self.__triangles__(triangles))
+                closer = t < distances[candidates]
+                self.__update__(distances, faces, candidates[closer], t[closer], self.order[triangles[closer]])
+
+        self.__traverse__(np.arange(len(origins)), np.zeros(len(origins), dtype=np.int64), prune, visit)
+
+        return distances, faces
+
+    def closest_point(self, points: np.ndarray):
+        '''
+        Find the closest point on the mesh surface for each query point.
+
+        Returns:
+            Tuple of the (n, 3) closest points, the (n,) distances and the (n,) face indices.
+        '''
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+
+        closest = np.zeros_like(points)
+        distances = np.full(len(points), np.inf)
+        faces = np.full(len(points), -1, dtype=np.int64)
+
+        if len(self.order) == 0:
+            return closest, distances, faces
+
+        # Descend greedily to the nearest leaf first to get an upper bound for the distance
+        queries = np.arange(len(points))
+        nodes = np.zeros(len(points), dtype=np.int64)
+
+        while True:
+            inner = self.left[nodes] >= 0
+            if not inner.any():
+                break
+
+            children = self.left[nodes[inner]]
+            first = self.__box_distance__(points[inner], children) <= self.__box_distance__(points[inner], children + 1)
+            nodes[inner] = np.where(first, children, children + 1)
+
+        self.__closest_in_leaves__(points, queries, nodes, closest, distances, faces)
+
+        # Visit all nodes which may contain a closer point
+        self.__traverse__(queries, np.zeros(len(points), dtype=np.int64),
+                          lambda queries, nodes: self.__box_distance__(points[queries], nodes) < distances[queries] ** 2,
+                          lambda queries, nodes: self.__closest_in_leaves__(points, queries, nodes, closest, distances, faces))
+
+        return closest, distances, faces
+
+    def __traverse__(self, queries, nodes, prune, visit):
+        '''
+        Traverse the hierarchy for pairs of queries and start nodes. 'prune' returns the
+        mask of the pairs to descend into and 'visit' processes pairs of queries and leaves.
+        '''
+        stack = [(queries, nodes)]
+
+        while stack:
+            queries, nodes = stack.pop()
+
+            if len(queries) > BVH.MAX_PAIRS:
+                stack.append((queries[BVH.MAX_PAIRS:], nodes[BVH.MAX_PAIRS:]))
+                queries, nodes = queries[:BVH.MAX_PAIRS], nodes[:BVH.MAX_PAIRS]
+
+            keep = prune(queries, nodes)
+            queries, nodes = queries[keep], nodes[keep]
+
+            leaf = self.left[nodes] < 0
+            visit(queries[leaf], nodes[leaf])
+
+            queries, nodes = queries[~leaf], nodes[~leaf]
+            if len(queries):
+                stack.append((np.repeat(queries, 2), np.repeat(self.left[nodes], 2) + np.tile([0, 1], len(nodes))))
+
+    def __closest_in_leaves__(self, points, queries, nodes, closest, distances, faces):
+        candidates, triangles = self.__expand_leaves__(queries, nodes)
+        if not len(candidates):
+            return
+
+        nearest = closest_point_on_triangles(points[candidates], self.__triangles__(triangles))
+        distance = np.linalg.norm(nearest - points[candidates], axis=1)
+
+        closer = distance < distances[candidates]
+        best = self.__update__(distances, faces, candidates[closer], distance[closer], self.order[triangles[closer]])
+        closest[candidates[closer][best]] = nearest[closer][best]
+
+    def __triangles__(self, triangles):
+        '''
+        Get the (n, 3, 3) corners of triangles given by their positions in hierarchy order.
+        '''
+        return self.vertices[self.faces[self.order[triangles]]]
+
+    def __expand_leaves__(self, queries, nodes):
+        '''
+        Expand pairs of queries and leaves into pairs of queries and triangles.
+        '''
+        counts = self.count[nodes]
+        offsets = np.repeat(np.cumsum(counts) - counts, counts)
+        triangles = np.repeat(self.start[nodes], counts) + np.arange(counts.sum()) - offsets
+        return np.repeat(queries, counts), triangles
+
+    def __update__(self, distances, faces, queries, values, face_indices):
+        '''
+        Store the smallest value per query if it improves the current one. Returns the
+        indices of the pairs which have been stored.
+        '''
+        order = np.lexsort((values, queries))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = queries[order][1:] != queries[order][:-1]
+        best = order[first]
+
+        distances[queries[best]] = values[best]
+        faces[queries[best]] = face_indices[best]
+
+        return best
+
+    def __box_distance__(self, points, nodes):
+        '''
+        Squared distance of points to node boxes, 0 for points inside the box.
+        '''
+        delta = np.maximum(self.lower[nodes] - points, 0) + np.maximum(points - self.upper[nodes], 0)
+        return (delta ** 2).sum(axis=1)
+
+    @staticmethod
+    def __intersect__(origins, directions, triangles, epsilon=1e-12):
+        '''
+        Moeller-Trumbore ray triangle intersection of pairs of rays and triangles. Returns
+        the ray parameter of the hits and infinity for misses.
+        '''
+        edge1 = triangles[:, 1] - triangles[:, 0]
+        edge2 = triangles[:, 2] - triangles[:, 0]
+
+        p = np.cross(directions, edge2)
+        determinant = (edge1 * p).sum(axis=1)
+        valid = np.abs(determinant) > epsilon
+        inverse = np.divide(1.0, determinant, out=np.zeros_like(determinant), where=valid)
+
+        s = origins - triangles[:, 0]
+        u = (s * p).sum(axis=1) * inverse
+        q = np.cross(s, edge1)
+        v = (directions * q).sum(axis=1) * inverse
+        t = (edge2 * q).sum(axis=1) * inverse
+
+        hit = valid & (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= 0)
+        return np.where(hit, t, np.inf)
+
+    @staticmethod
+    def __compute_bounds__(triangles, start, count, left):
+        '''
+        Compute the node boxes bottom up.
+        '''
+        lower = np.empty((len(start), 3))
+        upper = np.empty((len(start), 3))
+
+        leaves = np.flatnonzero(left < 0)
+        leaves = leaves[np.argsort(start[leaves])]
+
+        if len(triangles):
+            corners_lower = triangles.min(axis=1)
+            corners_upper = triangles.max(axis=1)
+            lower[leaves] = np.minimum.reduceat(corners_lower, start[leaves])
+            upper[leaves] = np.maximum.reduceat(corners_upper, start[leaves])
+        else:
+            lower[leaves] = 0.0
+            upper[leaves] = 0.0
+
+        # Children are always stored after their parent, so process the nodes backwards
+        for node in np.flatnonzero(left >= 0)[::-1]:
+            lower[node] = np.minimum(lower[left[node]], lower[left[node] + 1])
+            upper[node] = np.maximum(upper[left[node]], upper[left[node] + 1])
+
+        return lower, upper
+
+    def __repr__(self):
+        return f'<BVH #nodes={len(self.start)}, #triangles={len(self.order)}>'
+
+
+def closest_point_on_triangles(points: np.ndarray, triangles: np.ndarray) -> np.ndarray:
+    '''
+    Closest points on triangles for pairs of (n, 3) points and (n, 3, 3) triangles, following
+    the region based method from Ericson, Real-Time Collision Detection.
+    '''
+    a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+    ab, ac, ap = b - a, c - a, points - a
+
+    d1 = (ab * ap).sum(axis=1)
+    d2 = (ac * ap).sum(axis=1)
+
+    bp = points - b
+    d3 = (ab * bp).sum(axis=1)
+    d4 = (ac * bp).sum(axis=1)
+
+    cp = points - c
+    d5 = (ab * cp).sum(axis=1)
+    d6 = (ac * cp).sum(axis=1)
+
+    va = d3 * d6 - d5 * d4
+    vb = d5 * d2 - d1 * d6
+    vc = d1 * d4 - d3 * d2
+
+    # Inside the face region by default
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denominator = 1.0 / (va + vb + vc)
+        v = vb * denominator
+        w = vc * denominator
+        result = a + ab * v[:, None] + ac * w[:, None]
+
+        # Edge regions
+        t_bc = (d4 - d3) / ((d4 - d3) + (d5 - d6))
+        t_ac = d2 / (d2 - d6)
+        t_ab = d1 / (d1 - d3)
+
+    regions = [
+        (va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0), b + (c - b) * t_bc[:, None],
+        (vb <= 0) & (d2 >= 0) & (d6 <= 0), a + ac * t_ac[:, None],
+        (vc <= 0) & (d1 >= 0) & (d3 <= 0), a + ab * t_ab[:, None],
+        (d6 >= 0) & (d5 <= d6), c,
+        (d3 >= 0) & (d4 <= d3), b,
+        (d1 <= 0) & (d2 <= 0), a
+    ]
+
+    # Apply in reverse priority, so the vertex regions win over the edge regions
+    for mask, value in zip(regions[::2], regions[1::2]):
+        result = np.where(mask[:, None], value, result)
+
+    # Degenerate triangles: fall back to the nearest corner
+    degenerate = ~np.isfinite(result).all(axis=1)
+    if degenerate.any():
+        corners = triangles[degenerate]
+        nearest = np.argmin(((corners - points[degenerate][:, None]) ** 2).sum(axis=2), axis=1)
+        result[degenerate] = corners[np.arange(len(corners)), nearest]
+
+    return result
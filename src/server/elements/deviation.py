@@ -0,0 +1,70 @@
+#
+# deviation.py - Mesh to mesh deviation analysis
+#
+
+import numpy as np
+
+from .bvh import BVH
+from .shared import SharedArrays, map_ranges
+
+
+def signed_distances(points: np.ndarray, bvh: BVH, normals: np.ndarray) -> np.ndarray:
+    '''
+    Compute the signed distances of points to a reference surface. The distance is
+    positive if the point lies on the side of the closest face its normal points to.
+
+    Args:
+        points (np.ndarray): (n, 3) query points.
+        bvh (BVH): Bounding volume hierarchy of the reference mesh.
+        normals (np.ndarray): (m, 3) face normals of the reference mesh.
+
+    Returns:
+        (n,) float32 array of signed distances.
+    '''
+    closest, distances, faces = bvh.closest_point(points)
+    sign = np.sign(((points - closest) * normals[faces]).sum(axis=1))
+    return (np.where(sign < 0, -distances, distances)).astype(np.float32)
+
+
+def compute_range(description: dict, start: int, stop: int):
+    '''
+    Compute the signed distances of a range of points into the shared result array.
+    Runs in a worker process.
+    '''
+    with SharedArrays(description=description) as shared:
+        bvh = BVH(*(shared[name] for name in BVH.ARRAYS), vertices=shared['vertices'], faces=shared['faces'])
+        shared['result'][start:stop] = signed_distances(shared['points'][start:stop], bvh, shared['normals'])
+
+
+def compute_deviation(points: np.ndarray, bvh: BVH, normals: np.ndarray, executor=None, chunk_size: int = 256 * 1024):
+    '''
+    Compute the signed distances of points to a reference surface in chunks.
+
+    If an executor is given, the chunks are computed concurrently in its worker processes.
+    The points, the reference hierarchy and the result are shared with the workers via
+    shared memory, so only the chunk ranges are sent to them.
+
+    Yields:
+        Tuples of the start index and the (n,) float32 distances of each chunk, in order.
+    '''
+    ranges = [(start, min(start + chunk_size, len(points))) for start in range(0, len(points), chunk_size)]
+
+    if executor is None:
+        for start, stop in ranges:
+            yield start, signed_distances(points[start:stop], bvh, normals)
+        return
+
+    arrays = {name: getattr(bvh, name) for name in BVH.ARRAYS}
+    arrays.update(vertices=bvh.vertices,
+                  faces=bvh.faces,
+                  points=np.asarray(points, dtype=np.float64),
+                  normals=np.asarray(normals, dtype=np.float64),
+                  result=np.zeros(len(points), dtype=np.float32))
+
+    results = map_ranges(executor, compute_range, arrays, ranges)
+
+    try:
+        for (start, stop), (shared, _) in zip(ranges, results):
+            yield start, shared['result'][start:stop].copy()
+    finally:
+        results.close()
@@ -0,0 +1,37 @@
+#
+# files.py - Access to project files
+#
+# HDF5 cannot open a file for writing while it is open for reading elsewhere in the
+# process. Project files are therefore only opened through open_file(), which holds a
+# lock per file while the file is open. Lazy reads of mesh data and incremental saves
+# into the same file wait for each other instead of failing.
+#
+
+import contextlib
+import h5py
+import os
+import threading
+
+
+_locks = {}  # Normalized file path -> lock of the file
+_locks_lock = threading.Lock()
+
+
+def get_lock(filename: str) -> threading.RLock:
+    '''
+    Get the lock of a file. The lock is reentrant, so a thread writing a file can still
+    read from it, like when unchanged data is copied within the file.
+    '''
+    key = os.path.normcase(os.path.realpath(filename))
+    with _locks_lock:
+        return _locks.setdefault(key, threading.RLock())
+
+
+@contextlib.contextmanager
+def open_file(filename: str, mode: str = 'r'):
+    '''
+    Open an HDF5 file while holding its lock.
+    '''
+    with get_lock(filename):
+        with h5py.File(filename, mode) as f:
+            yield f
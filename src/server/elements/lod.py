@@ -0,0 +1,94 @@
+#
+# lod.py - Level of detail generation
+#
+
+import numpy as np
+
+
+def decimate(vertices: np.ndarray, faces: np.ndarray, resolution: int):
+    '''
+    Decimate a mesh by vertex clustering.
+
+    All vertices falling into the same cell of a regular grid are merged into their
+    centroid. Faces collapsing in the process and duplicate faces are removed.
+
+    Args:
+        vertices (np.ndarray): (n, 3) vertex coordinates.
+        faces (np.ndarray): (m, 3) vertex indices of the faces.
+        resolution (int): Number of grid cells along the longest bounding box axis.
+
+    Returns:
+        Tuple of the decimated (vertices, faces) arrays.
+    '''
+    lower = vertices.min(axis=0)
+    extent = vertices.max(axis=0) - lower
+    cell_size = max(extent.max() / resolution, np.finfo(np.float64).tiny)
+
+    cells = np.floor((vertices - lower) / cell_size).astype(np.int64)
+    dims = cells.max(axis=0) + 1
+    keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+
+    # Only clusters referenced by a surviving face will be kept, so map the vertices
+    # to dense cluster indices first
+    _, clusters = np.unique(keys, return_inverse=True)
+    clusters = clusters.reshape(-1)
+
+    new_faces = clusters[faces]
+    new_faces = new_faces[(new_faces[:, 0] != new_faces[:, 1]) &
+                          (new_faces[:, 1] != new_faces[:, 2]) &
+                          (new_faces[:, 0] != new_faces[:, 2])]
+
+    # Remove faces sharing the same set of vertices, keeping the original order
+    _, unique = np.unique(np.sort(new_faces, axis=1), axis=0, return_index=True)
+    new_faces = new_faces[np.sort(unique)]
+
+    # Compute the cluster centroids and drop clusters not referenced by any face
+    counts = np.bincount(clusters)
+    centroids = np.column_stack([np.bincount(clusters, weights=vertices[:, axis]) / counts for axis in range(3)])
+
+    used, new_faces = np.unique(new_faces, return_inverse=True)
+    new_faces = new_faces.reshape(-1, 3)
+
+    return centroids[used], new_faces
+
+
+def build_levels(vertices: np.ndarray, faces: np.ndarray, reduction: int, min_faces: int, max_levels: int):
+    '''
+    Build a pyramid of decimated versions of a mesh.
+
+    Each level has roughly 1 / reduction of the faces of the next finer one. Levels are
+    generated until either max_levels is reached or a level would drop below min_faces.
+
+    Returns:
+        List of (vertices, faces) tuples ordered from the coarsest to the finest level. The
+        full resolution mesh itself is not part of the list.
+    '''
+    levels = []
+
+    if len(faces) == 0:
+        return levels
+
+    target = len(faces) // reduction
+
+    # For a surface, the number of faces grows roughly with the square of the grid resolution
+    resolution = max(int(np.sqrt(len(faces) / 2)), 1)
+
+    while len(levels) < max_levels and target >= min_faces:
+        level = None
+
+        # Adjust the grid resolution until the face count is close enough to the target
+        for _ in range(4):
+            resolution = max(int(resolution / np.sqrt(reduction)) if level is None else
+                             int(resolution * np.sqrt(target / max(len(level[1]), 1))), 1)
+            level = decimate(vertices, faces, resolution)
+
+            if len(level[1]) <= target * 1.5:
+                break
+
+        if len(level[1]) >= len(levels[0][1] if levels else faces):
+            break
+
+        levels.insert(0, level)
+        target = len(level[1]) // reduction
+
+    return levels
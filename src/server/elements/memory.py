@@ -0,0 +1,205 @@
+#
+# memory.py - Geometry memory management
+#
+
+import collections
+import h5py
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+import weakref
+
+from .object import HandleRef
+
+
+class GeometryManager:
+    '''
+    Keeps the geometry of the meshes resident in memory within a byte budget.
+
+    Meshes report when their geometry becomes resident and when it is accessed. If the
+    resident geometry exceeds the budget, the geometry of the least recently used meshes
+    is evicted. Geometry which is stored unchanged in a project file is simply dropped,
+    the geometry of unsaved meshes is written into a spill file first. In both cases,
+    the mesh reloads its geometry transparently on the next access.
+    '''
+
+    def __init__(self, budget: int, spill_dir: str = None):
+        '''
+        Args:
+            budget (int): Maximum number of bytes of resident geometry.
+            spill_dir (str): Directory for the spill files. A temporary directory is
+                created on demand if not given.
+        '''
+        self.budget = budget
+        self.spill_dir = spill_dir
+
+        self._resident = collections.OrderedDict()  # Handle -> (weak mesh reference, bytes), least recently used first
+        self._size = 0
+        self._collected = collections.deque()  # Handles of garbage collected meshes which have not been removed yet
+        self._spilled = {}  # Spill file name -> (finalizer removing the file, bytes)
+        self._temp_dir = None
+        self._lock = threading.Lock()
+
+        self.evictions = 0
+        self.reloads = 0
+        self.spills = 0
+
+    def access(self, mesh):
+        '''
+        Record an access to the geometry of a mesh.
+        '''
+        with self._lock:
+            if mesh.handle in self._resident:
+                self._resident.move_to_end(mesh.handle)
+
+    def admit(self, mesh, size: int, source=None):
+        '''
+        Record that the geometry of a mesh became resident, either because it has been set
+        or because it has been reloaded from the given (filename, group path) source. Must
+        be called with the lock of the mesh held. Evicts other meshes if the budget is
+        exceeded.
+        '''
+        with self._lock:
+            self.__purge__()
+
+            if source is not None:
+                self.reloads += 1
+                self.__release_spill__(source[0])
+
+            _, previous = self._resident.pop(mesh.handle, (None, 0))
+            self._size += size - previous
+            self._resident[mesh.handle] = (HandleRef(mesh, self.__collect__), size)
+
+            victims = []
+            excess = self._size - self.budget
+            for handle, (mesh_ref, victim_size) in self._resident.items():
+                if excess <= 0:
+                    break
+                if handle != mesh.handle:
+                    victims.append(mesh_ref)
+                    excess -= victim_size
+
+        for mesh_ref in victims:
+            victim = mesh_ref()
+            if victim is not None:
+                victim.__evict__(self)
+
+    def release(self, mesh, source=None):
+        '''
+        Record that the geometry of a mesh is not resident anymore. If the geometry had
+        been evicted to a spill file, given as (filename, group path) source, but is not
+        needed anymore, the spill file is removed. Must be called with the lock of the mesh
+        held.
+        '''
+        with self._lock:
+            _, size = self._resident.pop(mesh.handle, (None, 0))
+            self._size -= size
+
+            if source is not None:
+                self.__release_spill__(source[0])
+
+    def spill(self, mesh, arrays: dict):
+        '''
+        Write geometry arrays of a mesh which is evicted into a spill file. Returns the
+        (filename, group path) source the arrays can be read from.
+        '''
+        filename = os.path.join(self.__get_spill_dir__(), f'{uuid.uuid4().hex}.h5')
+
+        with h5py.File(filename, 'w') as f:
+            for name, array in arrays.items():
+                if array is not None:
+                    f.create_dataset(name, data=array)
+
+        size = os.path.getsize(filename)
+
+        with self._lock:
+            self._spilled[filename] = (weakref.finalize(mesh, GeometryManager.__remove__, filename), size)
+            self.spills += 1
+
+        return filename, '/'
+
+    def evicted(self, mesh):
+        '''
+        Record the eviction of the geometry of a mesh. Must be called with the lock of the
+        mesh held.
+        '''
+        with self._lock:
+            _, size = self._resident.pop(mesh.handle, (None, 0))
+            self._size -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        '''
+        Get the residency and eviction statistics.
+        '''
+        with self._lock:
+            self.__purge__()
+
+            return {
+                'meshes': len(self._resident),
+                'size': self._size,
+                'budget': self.budget,
+                'evictions': self.evictions,
+                'reloads': self.reloads,
+                'spills': self.spills,
+                'spilled': len(self._spilled),
+                'spill_size': sum(size for _, size in self._spilled.values())
+            }
+
+    def close(self):
+        '''
+        Remove all spill files.
+        '''
+        with self._lock:
+            for finalizer, _ in self._spilled.values():
+                finalizer()
+            self._spilled = {}
+
+            if self._temp_dir is not None:
+                shutil.rmtree(self._temp_dir, ignore_errors=True)
+                self._temp_dir = None
+
+    def __get_spill_dir__(self) -> str:
+        with self._lock:
+            if self.spill_dir is not None:
+                return self.spill_dir
+
+            if self._temp_dir is None:
+                self._temp_dir = tempfile.mkdtemp(prefix='zinspector-spill-')
+
+            return self._temp_dir
+
+    def __release_spill__(self, filename: str):
+        entry = self._spilled.pop(filename, None)
+        if entry is not None:
+            entry[0]()
+
+    def __collect__(self, mesh_ref):
+        '''
+        Queue the handle of a garbage collected mesh for removal. Garbage collection may run
+        while the lock is held, so the entry is only removed by the next admission.
+        '''
+        self._collected.append(mesh_ref.handle)
+
+    def __purge__(self):
+        '''
+        Remove the entries of garbage collected meshes. Must be called with the lock held.
+        '''
+        while self._collected:
+            handle = self._collected.popleft()
+            entry = self._resident.get(handle)
+            if entry is not None and entry[0]() is None:
+                del self._resident[handle]
+                self._size -= entry[1]
+
+    @staticmethod
+    def __remove__(filename: str):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+    def __repr__(self):
+        return f'<GeometryManager size={self._size}, budget={self.budget}, #meshes={len(self._resident)}>'
@@ -2,37 +2,854 @@
 # mesh.py - Mesh element
 #
 
+import contextlib
 import h5py
+import hashlib
 import io
+import json
 import numpy as np
+import os
+import threading
 import trimesh
+import weakref
 
+from .bvh import BVH
+from .files import open_file
+from .lod import build_levels
 from .object import Object
+from .slicing import EdgeIndex, slice_planes
+from .stats import STATS, compute_stats
 
 
 class Mesh (Object):
     '''
     This object represents a mesh. It stores the mesh data and provides methods
     for manipulating it.
+
+    On disk, a mesh is stored as native arrays ('vertices', 'faces' and optionally
+    'normals') in its HDF5 group. Project files written by earlier versions contain
+    a single STL byte blob named 'data' instead, which can still be loaded.
+
+    A mesh can be loaded lazily. In this case only its metadata is read and the
+    geometry is loaded from the project file the first time it is accessed.
+
+    Statistics of the geometry, like the bounds, surface area and volume, are stored as
+    attributes of the mesh group, so they are available without loading the geometry.
+
+    In memory, the geometry is kept as plain contiguous (vertices, faces) arrays. The
+    trimesh object returned by 'data' wraps these arrays without copying them. It is
+    created on demand and, unless KEEP_TRIMESH is set, only kept while it is in use
+    elsewhere, so the internal caches of trimesh do not stay alive with the mesh.
+
+    For fast previews, a pyramid of decimated levels of detail is derived from the
+    geometry and stored in the 'lods' subgroup of the mesh.
+
+    Spatial queries use a bounding volume hierarchy, which is built on first use and
+    stored in the 'bvh' subgroup of the mesh when the project is saved.
+
+    If a GeometryManager is installed as 'geometry_manager', the resident geometry is
+    kept within its memory budget. Evicted geometry is reloaded transparently from the
+    project file or from a spill file the next time it is accessed. The spatial indices
+    derived from the geometry, the hierarchy and the edge index, count against the
+    budget as well and are dropped with the geometry.
+
+    Meshes which have been split into their connected components at import time have
+    the components as child meshes, which are stored in the 'children' subgroup. The
+    geometry of a component is a range of the geometry of its parent, see set_range(),
+    so only the range is stored in its 'range' attribute instead of the arrays. The
+    preprocessing steps applied at import time are recorded in the 'preprocessing'
+    attribute.
+
+    Deviation fields, the signed distances of the vertices to a reference mesh, are
+    stored in the 'deviations' subgroup. They are keyed by the content digest of the
+    reference geometry, because object ids and versions do not persist across loads.
     '''
 
+    # Storage layout identifier written into the group attributes
+    LAYOUT = 'arrays'
+
+    # Data type used for vertex coordinates on disk
+    VERTEX_DTYPE = np.float64
+
+    # Data type used for the face vertex indices on disk
+    FACE_DTYPE = np.int32
+
+    # If set, the face normals are stored alongside the geometry
+    STORE_NORMALS = False
+
+    # Number of rows per chunk of the geometry datasets
+    CHUNK_ROWS = 64 * 1024
+
+    # Compression filter applied to the geometry datasets
+    COMPRESSION = 'gzip'
+    COMPRESSION_LEVEL = 4
+
+    # Level of detail pyramid: face count ratio between levels, minimum number of faces
+    # of the coarsest level and maximum number of levels
+    LOD_REDUCTION = 4
+    LOD_MIN_FACES = 1000
+    LOD_MAX_LEVELS = 4
+
+    # If set, the trimesh object wrapping the geometry is kept alive with the mesh
+    KEEP_TRIMESH = False
+
+    # Geometry manager keeping the resident geometry of all meshes within a memory budget,
+    # see memory.py. No budget is applied if not set.
+    geometry_manager = None
+
+    # Statistics stored as attributes of the mesh group in addition to the bounds
+    STATS_ATTRIBUTES = ('area', 'volume', 'watertight')
+
+    __slots__ = ('children', '_vertices', '_faces', '_normals', '_wrapper', '_source', '_location', '_stats',
+                 '_stats_version', '_levels', '_version', '_levels_version', '_bvh', '_bvh_version', '_edges', '_edges_version',
+                 '_digest', '_digest_version', '_deviations', '_deviations_version', '_preprocessing', '_range', '_lock')
+
     def __init__(self, name: str, data: trimesh.Trimesh):
         super().__init__(name)
-        self.data = data
+        self.children = []  # Meshes of the connected components, see preprocess.py
+        self._vertices = None  # (n, 3) float64 vertex coordinates
+        self._faces = None  # (m, 3) int64 vertex indices
+        self._normals = None  # (m, 3) face normals if they have been read from the project file
+        self._wrapper = None  # Trimesh object wrapping the arrays, see 'data'
+        self._source = None  # (filename, group path) the geometry is loaded from on demand
+        self._location = None  # (filename, group path) the current geometry is stored at
+        self._stats = None  # Statistics of the geometry, see get_stats()
+        self._stats_version = 0
+        self._levels = None  # Levels of detail as [face count, data, (filename, group path)]
+        self._version = 0  # Incremented each time the geometry changes
+        self._levels_version = 0
+        self._bvh = None  # Bounding volume hierarchy of the geometry, see get_bvh()
+        self._bvh_version = 0
+        self._edges = None  # Edge index of the geometry used for slicing, see get_edge_index()
+        self._edges_version = 0
+        self._digest = None  # Content digest of the geometry, see get_digest()
+        self._digest_version = 0
+        self._deviations = None  # Reference mesh digest -> signed vertex distances
+        self._deviations_version = 0
+        self._preprocessing = None  # Record of the preprocessing applied at import time
+        self._range = None  # Range of the geometry of the parent mesh, see set_range()
+        self._lock = threading.RLock()
+
+        if data is not None:
+            self.data = data
+
+    @property
+    def data(self) -> trimesh.Trimesh:
+        '''
+        Mesh geometry as trimesh object. Lazily loaded meshes read it from the project file
+        on first access.
+        '''
+        vertices, faces = self.get_arrays()
+        if vertices is None:
+            return None
+
+        with self._lock:
+            data = self._wrapper() if isinstance(self._wrapper, weakref.ref) else self._wrapper
+
+            if data is None:
+                data = trimesh.Trimesh(vertices=vertices, faces=faces, face_normals=self._normals, process=False)
+                self.__wrap__(data)
+
+            return data
+
+    @data.setter
+    def data(self, data: trimesh.Trimesh):
+        with self._lock:
+            self.set_arrays(data.vertices, data.faces)
+            self.__wrap__(data)
+
+    def get_children(self):
+        '''
+        Get the child meshes.
+        '''
+        return self.children
+
+    def add_child(self, mesh: 'Mesh'):
+        '''
+        Add a child mesh.
+        '''
+        mesh.set_parent(self)
+        self.children.append(mesh)
+        self.set_modified()
+        self.__notify__('add', mesh)
+
+    def is_modified(self):
+        '''
+        Check if the mesh or one of its children has been changed since it was last loaded
+        or saved.
+        '''
+        return self.modified or any(child.is_modified() for child in self.children)
+
+    def get_preprocessing(self) -> dict:
+        '''
+        Get the record of the preprocessing applied at import time or None, see
+        Pipeline.run().
+        '''
+        return self._preprocessing
+
+    def set_preprocessing(self, record: dict):
+        '''
+        Set the record of the preprocessing applied at import time.
+        '''
+        self._preprocessing = record
+        self.set_modified()
+
+    def get_arrays(self):
+        '''
+        Get the geometry as plain (vertices, faces) arrays without creating a trimesh object.
+        Lazily loaded or evicted meshes read it from the project or spill file. Meshes
+        which refer to a range of their parent slice it out of the parent.
+        '''
+        manager = Mesh.geometry_manager
+
+        # Eviction sets the source before it clears the arrays
+        vertices, faces = self._vertices, self._faces
+        if (vertices is None or faces is None) and self._source is not None:
+            with self._lock:
+                if self._source is not None:
+                    source = self._source
+                    with open_file(source[0]) as f:
+                        self._vertices, self._faces, self._normals = self.__read_arrays__(f[source[1]])
+                    self._source = None
+
+                    if manager is not None:
+                        manager.admit(self, self.__size__(), source)
+
+                return self._vertices, self._faces
+
+        if vertices is None and self._range is not None:
+            with self._lock:
+                if self._vertices is None and self._range is not None:
+                    vertex_start, vertex_stop, face_start, face_stop = self._range
+                    parent_vertices, parent_faces = self.get_parent().get_arrays()
+                    self._vertices = parent_vertices[vertex_start:vertex_stop].copy()
+                    self._faces = parent_faces[face_start:face_stop] - vertex_start
+
+                    if manager is not None:
+                        manager.admit(self, self.__size__())
+
+                return self._vertices, self._faces
+
+        if manager is not None and vertices is not None:
+            manager.access(self)
+
+        return vertices, faces
+
+    def set_arrays(self, vertices: np.ndarray, faces: np.ndarray):
+        '''
+        Replace the geometry by plain (vertices, faces) arrays. Child meshes which refer
+        to a range of the previous geometry get a copy of their range.
+        '''
+        for child in self.children:
+            child.__detach__()
+
+        with self._lock:
+            source = self._source
+
+            self._vertices = np.ascontiguousarray(vertices, dtype=np.float64)
+            self._faces = np.ascontiguousarray(faces, dtype=np.int64)
+            self._range = None
+            self._normals = None
+            self._wrapper = None
+            self._source = None
+            self._location = None
+            self._stats = None
+            self._bvh = self._edges = None  # They refer to the previous arrays
+            self._version += 1
+            self.set_modified()
+
+            manager = Mesh.geometry_manager
+            if manager is not None:
+                if source is not None:
+                    manager.release(self, source)
+                manager.admit(self, self.__size__())
+
+        self.__notify__('geometry')
+
+    def get_range(self):
+        '''
+        Get the (vertex start, vertex stop, face start, face stop) range of the geometry
+        of the parent mesh this mesh refers to or None if it has a geometry of its own.
+        '''
+        return self._range
+
+    def set_range(self, part: tuple):
+        '''
+        Replace the geometry by a (vertex start, vertex stop, face start, face stop) range
+        of the geometry of the parent mesh. The faces in the range must only refer to the
+        vertices in the range. The range is sliced out of the parent when the geometry is
+        accessed and only the range is stored in the project file.
+        '''
+        with self._lock:
+            source = self._source
+
+            self._vertices = self._faces = self._normals = self._wrapper = None
+            self._source = None
+            self._location = None
+            self._stats = None
+            self._bvh = self._edges = None
+            self._range = tuple(int(value) for value in part)
+            self._version += 1
+            self.set_modified()
+
+            if Mesh.geometry_manager is not None:
+                Mesh.geometry_manager.release(self, source)
+
+        self.__notify__('geometry')
+
+    def __detach__(self):
+        '''
+        Copy the range of the parent geometry the mesh refers to, before the geometry of
+        the parent is replaced. The geometry itself does not change.
+        '''
+        with self._lock:
+            if self._range is not None:
+                self.get_arrays()
+                self._range = None
+                self._location = None  # The stored group does not contain the arrays
+                self.set_modified()
+
+    def get_version(self) -> int:
+        '''
+        Get the version of the mesh geometry. The version changes whenever the geometry
+        is replaced, so it can be used to key data derived from it.
+        '''
+        return self._version
+
+    def is_loaded(self) -> bool:
+        '''
+        Check if the geometry of the mesh is resident in memory.
+        '''
+        return self._source is None and (self._range is None or self._vertices is not None)
+
+    def get_location(self):
+        '''
+        Get the (filename, group path) tuple the current geometry is stored at or None if
+        the geometry has not been saved yet.
+        '''
+        return self._location
+
+    def load_data(self):
+        '''
+        Read all data of the mesh which is still pending in the project file.
+        '''
+        self.get_arrays()
+        for level in self.__get_levels__():
+            self.__get_level_data__(level)
+
+    def get_face_count(self) -> int:
+        '''
+        Get the number of faces of the full resolution mesh.
+        '''
+        with self._lock:
+            if self._stats is not None and self._stats_version == self._version:
+                return self._stats['faces']
+
+        return len(self.get_arrays()[1])
+
+    def get_info(self) -> dict:
+        '''
+        Get a dictionary with the metadata of the mesh. In addition to the common object
+        metadata, it contains the statistics of the geometry, see get_stats(). The
+        geometry of lazily loaded meshes is not read for this. Meshes from project files
+        written before the statistics were stored only report those which can be read
+        without the geometry.
+        '''
+        info = super().get_info()
+
+        with self._lock:
+            stats = self._stats if self._stats_version == self._version else None
+            if stats is None or (self.is_loaded() and not STATS.issubset(stats)):
+                stats = self.get_stats()
+
+        info.update(stats)
+        return info
+
+    def get_stats(self) -> dict:
+        '''
+        Get the statistics of the geometry, see compute_stats(). They are computed at
+        import time and stored with the geometry, so they are usually available without
+        loading it.
+        '''
+        with self._lock:
+            if self._stats is None or self._stats_version != self._version or not STATS.issubset(self._stats):
+                self._stats = compute_stats(*self.get_arrays())
+                self._stats_version = self._version
+
+            return self._stats
+
+    def set_stats(self, stats: dict):
+        '''
+        Set the statistics of the current geometry if they have been computed elsewhere,
+        like in an import worker.
+        '''
+        with self._lock:
+            self._stats = stats
+            self._stats_version = self._version
+
+    def get_levels(self) -> list:
+        '''
+        Get the face counts of the available levels of detail, ordered from the coarsest
+        level to the full resolution mesh.
+        '''
+        return [level[0] for level in self.__get_levels__()] + [self.get_face_count()]
+
+    def get_level(self, max_faces: int) -> trimesh.Trimesh:
+        '''
+        Get the finest level of detail with at most the given number of faces. If even the
+        coarsest level exceeds the budget, the coarsest level is returned. A budget of 0
+        selects the full resolution mesh.
+        '''
+        if max_faces <= 0 or max_faces >= self.get_face_count():
+            return self.data
+
+        levels = self.__get_levels__()
+        if not levels:
+            return self.data
+
+        candidates = [level for level in levels if level[0] <= max_faces]
+        return self.__get_level_data__(candidates[-1] if candidates else levels[0])
+
+    def get_digest(self) -> str:
+        '''
+        Get a digest of the mesh geometry. Unlike the id and the version, it identifies
+        the geometry across project loads.
+        '''
+        with self._lock:
+            if self._digest is None or self._digest_version != self._version:
+                vertices, faces = self.get_arrays()
+                digest = hashlib.blake2b(digest_size=16)
+                digest.update(vertices)
+                digest.update(faces)
+                self._digest = digest.hexdigest()
+                self._digest_version = self._version
+
+            return self._digest
+
+    def get_deviation(self, reference: 'Mesh'):
+        '''
+        Get the signed distances of the vertices to a reference mesh if they have been
+        computed before, either in memory or in the project file. Returns None otherwise.
+        '''
+        key = reference.get_digest()
+
+        with self._lock:
+            values = self.__get_deviations__().get(key)
+
+            if values is None and self._location is not None and os.path.exists(self._location[0]):
+                with open_file(self._location[0]) as f:
+                    group = f[self._location[1]]
+                    if 'deviations' in group and key in group['deviations']:
+                        values = group['deviations'][key][:]
+                        self._deviations[key] = values
 
-    def __load__(self, parent: h5py.Group):
+            return values
+
+    def set_deviation(self, reference: 'Mesh', values: np.ndarray):
+        '''
+        Store the signed distances of the vertices to a reference mesh. They are written
+        into the project file the next time it is saved.
+        '''
+        with self._lock:
+            self.__get_deviations__()[reference.get_digest()] = values
+
+    def __get_deviations__(self) -> dict:
+        with self._lock:
+            if self._deviations is None or self._deviations_version != self._version:
+                self._deviations = {}
+                self._deviations_version = self._version
+
+            return self._deviations
+
+    def get_bvh(self) -> BVH:
+        '''
+        Get the bounding volume hierarchy of the mesh geometry. It is read from the project
+        file if it has been stored there and built otherwise.
+        '''
+        with self._lock:
+            if self._bvh is None or self._bvh_version != self._version:
+                vertices, faces = self.get_arrays()
+
+                self._bvh = None
+                if self._location is not None and os.path.exists(self._location[0]):
+                    with open_file(self._location[0]) as f:
+                        group = f[self._location[1]]
+                        if 'bvh' in group:
+                            self._bvh = BVH.load(group['bvh'], vertices, faces)
+
+                if self._bvh is None:
+                    self._bvh = BVH.build(vertices, faces)
+
+                self._bvh_version = self._version
+                self.__account__()
+
+            return self._bvh
+
+    def get_edge_index(self) -> EdgeIndex:
+        '''
+        Get the edge index of the mesh geometry, which is built on first use.
+        '''
+        with self._lock:
+            if self._edges is None or self._edges_version != self._version:
+                self._edges = EdgeIndex.build(self.get_arrays()[1])
+                self._edges_version = self._version
+                self.__account__()
+
+            return self._edges
+
+    def slice(self, normal: np.ndarray, offsets: np.ndarray) -> list:
+        '''
+        Intersect the mesh with parallel planes, see slice_planes().
+        '''
+        vertices, faces = self.get_arrays()
+        return slice_planes(vertices, faces, self.get_edge_index(), normal, offsets)
+
+    def ray_cast(self, origins: np.ndarray, directions: np.ndarray):
+        '''
+        Intersect rays with the mesh, see BVH.ray_cast().
+        '''
+        return self.get_bvh().ray_cast(origins, directions)
+
+    def closest_point(self, points: np.ndarray):
+        '''
+        Find the closest points on the mesh surface, see BVH.closest_point().
+        '''
+        return self.get_bvh().closest_point(points)
+
+    def __get_levels__(self) -> list:
+        '''
+        Get the levels of detail, computing them if they are missing or outdated.
+        '''
+        with self._lock:
+            if self._levels is None or self._levels_version != self._version:
+                levels = build_levels(*self.get_arrays(), Mesh.LOD_REDUCTION, Mesh.LOD_MIN_FACES, Mesh.LOD_MAX_LEVELS)
+                self._levels = [[len(faces), trimesh.Trimesh(vertices=vertices, faces=faces, process=False), None]
+                                for vertices, faces in levels]
+                self._levels_version = self._version
+
+            return self._levels
+
+    def __get_level_data__(self, level: list) -> trimesh.Trimesh:
+        '''
+        Get the geometry of a level of detail, reading it from the project file if needed.
+        '''
+        with self._lock:
+            if level[1] is None:
+                filename, path = level[2]
+                with open_file(filename) as f:
+                    level[1] = self.__read__(f[path])
+                level[2] = None
+
+            return level[1]
+
+    def __load__(self, parent: h5py.Group, lazy: bool = False):
         super().__load__(parent)
 
-        dset = parent['data']
-        self.data = trimesh.load(io.BytesIO(dset[:]), file_type=dset.attrs['file_type'])
+        if lazy or 'range' in parent.attrs:
+            with self._lock:
+                source = self._source
+                self._vertices = self._faces = self._normals = self._wrapper = None
+
+                # Ranges are sliced out of the parent, which is loaded after the children
+                self._range = tuple(parent.attrs['range'].tolist()) if 'range' in parent.attrs else None
+                self._source = (parent.file.filename, parent.name) if self._range is None else None
+
+                if Mesh.geometry_manager is not None:
+                    Mesh.geometry_manager.release(self, source)
+        else:
+            vertices, faces, normals = self.__read_arrays__(parent)
+            with self._lock:
+                self.set_arrays(vertices, faces)
+                self._normals = normals
+
+        with self._lock:
+            self._location = (parent.file.filename, parent.name)
+            self._stats = self.__read_stats__(parent)
+            self._stats_version = self._version
+            self._levels = None
+            self._levels_version = self._version
+            self._digest = parent.attrs.get('digest')
+            self._digest_version = self._version
+            self._preprocessing = json.loads(parent.attrs['preprocessing']) if 'preprocessing' in parent.attrs else None
+
+            self.children = []
+            for key in sorted(parent['children'], key=int) if 'children' in parent else []:
+                child = Mesh('', None)
+                child.__load__(parent['children'][key], lazy=lazy)
+                child.set_parent(self)
+                self.children.append(child)
+
+            self.set_modified(False)
+
+            if 'lods' in parent:
+                groups = sorted(parent['lods'].values(), key=lambda group: group['faces'].shape[0])
+                self._levels = [[group['faces'].shape[0],
+                                 None if lazy else self.__read__(group),
+                                 (parent.file.filename, group.name) if lazy else None] for group in groups]
+
+    def __read_stats__(self, parent: h5py.Group):
+        '''
+        Read the geometry statistics from an HDF5 group without reading the geometry.
+        Groups written before the statistics were stored only provide the counts and the
+        bounds. Returns None for the legacy layout, where not even these can be determined
+        this way.
+        '''
+        if 'range' in parent.attrs:
+            vertex_start, vertex_stop, face_start, face_stop = parent.attrs['range'].tolist()
+            vertices, faces = vertex_stop - vertex_start, face_stop - face_start
+        elif 'vertices' in parent:
+            vertices, faces = parent['vertices'].shape[0], parent['faces'].shape[0]
+        else:
+            return None
+
+        # The in-memory arrays use the trimesh data types
+        stats = {
+            'vertices': vertices,
+            'faces': faces,
+            'bounds': parent.attrs['bounds'].tolist() if 'bounds' in parent.attrs else [],
+            'size': vertices * 3 * np.dtype(np.float64).itemsize + faces * 3 * np.dtype(np.int64).itemsize
+        }
+
+        for key in Mesh.STATS_ATTRIBUTES:
+            if key in parent.attrs:
+                stats[key] = parent.attrs[key].item()
+
+        return stats
+
+    def __read__(self, parent: h5py.Group) -> trimesh.Trimesh:
+        '''
+        Read the mesh geometry from an HDF5 group.
+        '''
+        vertices, faces, normals = self.__read_arrays__(parent)
+        return trimesh.Trimesh(vertices=vertices, faces=faces, face_normals=normals, process=False)
+
+    def __read_arrays__(self, parent: h5py.Group):
+        '''
+        Read the mesh geometry from an HDF5 group as (vertices, faces, normals) arrays. The
+        normals are None if they have not been stored.
+        '''
+        if 'data' in parent:
+            dset = parent['data']
+            data = trimesh.load(io.BytesIO(dset[:]), file_type=dset.attrs['file_type'])
+            return np.asarray(data.vertices), np.asarray(data.faces), None
+
+        normals = parent['normals'][:].astype(np.float64) if 'normals' in parent else None
+        return parent['vertices'][:].astype(np.float64, copy=False), parent['faces'][:].astype(np.int64), normals
 
     def __save__(self, parent: h5py.Group):
         """Save the object to an HDF5 group."""
+
+        # Unchanged meshes are copied over from their previous location without decoding.
+        # The children are saved on their own, as they may have been changed.
+        with self._lock:
+            location = self._location if not self.modified else None
+
+        if location is not None and os.path.exists(location[0]):
+            with open_file(location[0]) as f:
+                source = f[location[1]]
+                for key, value in source.attrs.items():
+                    parent.attrs[key] = value
+                for key in source:
+                    if key != 'children':
+                        parent.copy(source[key], parent, name=key)
+
+            super().__save__(parent)
+            self.__save_children__(parent)
+            self.__save_derived__(parent)
+            return
+
         super().__save__(parent)
 
-        data = np.frombuffer(trimesh.exchange.export.export_stl(self.data), dtype=np.uint8)
-        dset = parent.create_dataset('data', data=data)
-        dset.attrs['file_type'] = 'stl'
+        parent.attrs['layout'] = Mesh.LAYOUT
+        parent.attrs['digest'] = self.get_digest()
+
+        if self._preprocessing is not None:
+            parent.attrs['preprocessing'] = json.dumps(self._preprocessing)
+
+        vertices, faces = self.get_arrays()
+        self.__save_stats__(parent, self.get_stats())
+
+        if self._range is not None:
+            parent.attrs['range'] = np.asarray(self._range)
+        else:
+            self.__create_array__(parent, 'vertices', vertices, Mesh.VERTEX_DTYPE)
+            self.__create_array__(parent, 'faces', faces, Mesh.FACE_DTYPE)
+
+            if Mesh.STORE_NORMALS:
+                self.__create_array__(parent, 'normals', self.data.face_normals, Mesh.VERTEX_DTYPE)
+
+        levels = parent.create_group('lods')
+        for index, level in enumerate(self.__get_levels__()):
+            data = self.__get_level_data__(level)
+            group = levels.create_group(str(index))
+            self.__create_array__(group, 'vertices', data.vertices, Mesh.VERTEX_DTYPE)
+            self.__create_array__(group, 'faces', data.faces, Mesh.FACE_DTYPE)
+
+        self.__save_children__(parent)
+        self.__save_derived__(parent)
+
+    def __save_children__(self, parent: h5py.Group):
+        '''
+        Save the child meshes into the 'children' subgroup, named by their index.
+        '''
+        if self.children:
+            group = parent.create_group('children')
+            for index, child in enumerate(self.children):
+                child.__save__(group.create_group(str(index)))
+
+    def __save_derived__(self, parent: h5py.Group):
+        '''
+        Add data derived from the geometry which has been computed since the mesh group
+        was written. The group must contain the current geometry.
+        '''
+        with self._lock:
+            stats = self._stats if self._stats_version == self._version else None
+            if stats is not None and STATS.issubset(stats) and not all(key in parent.attrs for key in Mesh.STATS_ATTRIBUTES):
+                self.__save_stats__(parent, stats)
+
+            if 'bvh' not in parent and self._bvh is not None and self._bvh_version == self._version:
+                self._bvh.save(parent.create_group('bvh'))
+
+            deviations = self._deviations if self._deviations_version == self._version else None
+            if deviations:
+                group = parent.require_group('deviations')
+                for key, values in deviations.items():
+                    if key not in group:
+                        group.create_dataset(key, data=values, compression='gzip', shuffle=True)
+
+        for index, child in enumerate(self.children):
+            if 'children' in parent and str(index) in parent['children']:
+                child.__save_derived__(parent['children'][str(index)])
+
+    def __save_stats__(self, parent: h5py.Group, stats: dict):
+        '''
+        Store the geometry statistics as attributes of the mesh group. The counts and the
+        size follow from the datasets.
+        '''
+        if stats['bounds']:
+            parent.attrs['bounds'] = np.asarray(stats['bounds'])
+
+        for key in Mesh.STATS_ATTRIBUTES:
+            parent.attrs[key] = stats[key]
+
+    def __relocate__(self, filename: str, path: str):
+        '''
+        Record that the mesh has been saved to the given group, so data still pending is
+        read from there from now on.
+        '''
+        with self._lock:
+            self._location = (filename, path)
+
+            if self._source is not None:
+                # The geometry may have been evicted into a spill file since it was saved
+                if Mesh.geometry_manager is not None:
+                    Mesh.geometry_manager.release(self, self._source)
+                self._source = self._location
+
+            for index, level in enumerate(self._levels or []):
+                if level[2] is not None:
+                    level[2] = (filename, f'{path}/lods/{index}')
+
+            for index, child in enumerate(self.children):
+                child.__relocate__(filename, f'{path}/children/{index}')
+
+            self.set_modified(False)
+
+    def __acquire__(self, stack: contextlib.ExitStack):
+        '''
+        Acquire the locks of the children and of the mesh itself in the given exit stack.
+        The children are locked first, like when a component is sliced out of its parent.
+        '''
+        for child in self.children:
+            child.__acquire__(stack)
+
+        stack.enter_context(self._lock)
+
+    def __evict__(self, manager) -> bool:
+        '''
+        Drop the resident geometry, which is reloaded on the next access. It is read back
+        from the project file if it is stored there unchanged, sliced out of the parent if
+        the mesh refers to a range of it and spilled into a file of the manager otherwise.
+        Meshes which are in use by another thread or wrapped by a trimesh
+        object which is still alive are skipped. Returns if the geometry has been evicted.
+
+        The spatial indices are dropped as well. They are read back from the project file
+        if they are stored there and rebuilt otherwise.
+        '''
+        if not self._lock.acquire(blocking=False):
+            return False
+
+        try:
+            if self._vertices is None or self._source is not None:
+                return False
+
+            # The trimesh object would keep the arrays alive anyway
+            if isinstance(self._wrapper, weakref.ref) and self._wrapper() is not None:
+                return False
+
+            # The statistics answer metadata requests while the geometry is evicted
+            self.get_stats()
+
+            if self._range is not None:
+                source = None  # Sliced out of the parent again
+            elif self._location is not None and os.path.exists(self._location[0]):
+                source = self._location
+            else:
+                source = manager.spill(self, {'vertices': self._vertices, 'faces': self._faces, 'normals': self._normals})
+
+            self._source = source
+            self._vertices = self._faces = self._normals = self._wrapper = None
+            self._bvh = self._edges = None
+
+            manager.evicted(self)
+            return True
+
+        finally:
+            self._lock.release()
+
+    def __size__(self) -> int:
+        '''
+        Get the number of bytes of the resident geometry arrays and of the spatial indices
+        derived from them.
+        '''
+        arrays = [self._vertices, self._faces, self._normals]
+        if self._bvh is not None:
+            arrays.extend(getattr(self._bvh, name) for name in BVH.ARRAYS)
+        if self._edges is not None:
+            arrays.extend(getattr(self._edges, name) for name in EdgeIndex.ARRAYS)
+
+        return sum(array.nbytes for array in arrays if array is not None)
+
+    def __account__(self):
+        '''
+        Report the changed size of the resident geometry to the manager. Must be called
+        with the lock held.
+        '''
+        manager = Mesh.geometry_manager
+        if manager is not None and self._vertices is not None:
+            manager.admit(self, self.__size__())
+
+    def __wrap__(self, data: trimesh.Trimesh):
+        '''
+        Remember the trimesh object wrapping the geometry arrays.
+        '''
+        self._wrapper = data if Mesh.KEEP_TRIMESH else weakref.ref(data)
+
+    def __create_array__(self, parent: h5py.Group, name: str, data: np.ndarray, dtype) -> h5py.Dataset:
+        '''
+        Create a chunked and compressed dataset for a (n, 3) geometry array.
+        '''
+        data = np.ascontiguousarray(data, dtype=dtype)
+
+        # Empty datasets cannot be chunked
+        if len(data) == 0:
+            return parent.create_dataset(name, data=data)
+
+        return parent.create_dataset(name, data=data,
+                                     chunks=(min(len(data), Mesh.CHUNK_ROWS), data.shape[1]),
+                                     compression=Mesh.COMPRESSION,
+                                     compression_opts=Mesh.COMPRESSION_LEVEL,
+                                     shuffle=True)
 
     def __repr__(self):
         return f'<Mesh id={self.get_id()}>'
@@ -2,32 +2,107 @@
 # object.py - Object management
 #
 
+import collections
 import h5py
+import threading
 import uuid
 import weakref
 
 from abc import ABC, abstractmethod
 
 
+def to_handle(obj_id: str) -> int:
+    """Convert an object UUID into the integer handle used internally. Raises a KeyError
+    for malformed ids, just like for unknown ones."""
+    try:
+        return uuid.UUID(obj_id).int
+    except (TypeError, ValueError, AttributeError):
+        raise KeyError(f"Object with UUID {obj_id} not found.")
+
+
+def to_id(handle: int) -> str:
+    """Convert an integer object handle into the UUID used at the API."""
+    return str(uuid.UUID(int=handle))
+
+
+class HandleRef (weakref.ref):
+    """Weak reference to an object which remembers the handle of the object."""
+
+    __slots__ = ('handle',)
+
+    def __init__(self, obj, callback=None):
+        super().__init__(obj, callback)
+        self.handle = obj.handle
+
+
 class ObjectIdDatabase:
-    """Singleton class to store and manage objects by their UUID."""
-    _storage = {}
+    """Singleton class to store and manage objects by their UUID.
+
+    Internally, objects are identified by integer handles, which are the numeric values
+    of their UUIDs. The UUID strings only appear at the interface of the database.
+
+    The database can be used from multiple threads. The entries are distributed over a
+    number of dictionaries by their handle, each guarded by its own lock, so concurrent
+    requests rarely contend. Objects are referenced weakly. The callbacks of the weak
+    references only queue the handles of collected objects, which are removed by the
+    next modification of the database. So garbage collection, which may run at any time,
+    never changes a dictionary while a lock is held.
+
+    Besides the ids, the database indexes the objects by type and by parent, so objects
+    can be found without walking the object tree. The indexes keep the order in which the
+    objects have been added to them, so the children of an object are found in the order
+    they have been added to it. Unlike the child lists of the objects, the indexes can be
+    read while other threads change the tree.
+    """
+
+    # Number of independently locked partitions of the handle storage
+    STRIPES = 16
+
+    _stripes = [{} for _ in range(STRIPES)]
+    _locks = [threading.Lock() for _ in range(STRIPES)]
+
+    _types = {}  # Type name -> handles, as dictionary keys in insertion order
+    _children = {}  # Parent handle -> handles, as dictionary keys in insertion order
+    _entries = {}  # Handle -> [type name, parent handle]
+    _index_lock = threading.Lock()
+
+    _collected = collections.deque()  # Handles of garbage collected objects which have not been removed yet
 
     @staticmethod
     def add(obj):
         """Add an object to the database."""
-        ObjectIdDatabase._storage[obj.id] = weakref.ref(obj)  # Use weak reference to avoid memory leaks
+        ObjectIdDatabase.__purge__()
+
+        handle = obj.handle
+        obj_ref = HandleRef(obj, ObjectIdDatabase.__collect__)  # Use weak reference to avoid memory leaks
+
+        stripe, lock = ObjectIdDatabase.__stripe__(handle)
+        with lock:
+            stripe[handle] = obj_ref
+
+        with ObjectIdDatabase._index_lock:
+            type_name = obj.__type__()
+            ObjectIdDatabase._entries[handle] = [type_name, None]
+            ObjectIdDatabase._types.setdefault(type_name, {})[handle] = None
 
     @staticmethod
     def remove(obj_id):
         """Remove an object from the database."""
-        if obj_id in ObjectIdDatabase._storage:
-            del ObjectIdDatabase._storage[obj_id]
+        try:
+            handle = to_handle(obj_id)
+        except KeyError:
+            return
+
+        stripe, lock = ObjectIdDatabase.__stripe__(handle)
+        with lock:
+            stripe.pop(handle, None)
+
+        ObjectIdDatabase.__unindex__(handle)
 
     @staticmethod
     def get(obj_id):
         """Retrieve an object by its UUID."""
-        obj_ref = ObjectIdDatabase._storage.get(obj_id)
+        obj_ref = ObjectIdDatabase.__lookup__(to_handle(obj_id))
         if obj_ref is None:
             raise KeyError(f"Object with UUID {obj_id} not found.")
         obj = obj_ref()
@@ -35,18 +110,138 @@ class ObjectIdDatabase:
             raise KeyError(f"Object with UUID {obj_id} has been garbage-collected.")
         return obj
 
+    @staticmethod
+    def get_many(obj_ids):
+        """Retrieve many objects by their UUIDs at once. Unknown or garbage-collected objects
+        are returned as None."""
+        objs = []
+        for obj_id in obj_ids:
+            try:
+                obj_ref = ObjectIdDatabase.__lookup__(to_handle(obj_id))
+            except KeyError:
+                obj_ref = None
+            objs.append(obj_ref() if obj_ref is not None else None)
+        return objs
+
+    @staticmethod
+    def find(type_name=None, parent_id=None):
+        """Find the objects of the given type and/or with the given parent, in the order they
+        have been added to the type or parent. The cost depends on the number of matching
+        objects, not on the size of the database."""
+        ObjectIdDatabase.__purge__()
+
+        with ObjectIdDatabase._index_lock:
+            by_type = ObjectIdDatabase._types.get(type_name, {}) if type_name is not None else None
+            by_parent = ObjectIdDatabase._children.get(to_handle(parent_id), {}) if parent_id is not None else None
+
+            if by_type is None and by_parent is None:
+                handles = list(ObjectIdDatabase._entries)
+            elif by_type is None or by_parent is None:
+                handles = list(by_type if by_parent is None else by_parent)
+            else:
+                handles = [handle for handle in by_parent if handle in by_type]
+
+        objs = [ObjectIdDatabase.__lookup__(handle) for handle in handles]
+        return [obj for obj in (obj_ref() if obj_ref is not None else None for obj_ref in objs) if obj is not None]
+
     @staticmethod
     def list_objects():
         """List all currently stored objects."""
-        return {obj_id: obj_ref() for obj_id, obj_ref in ObjectIdDatabase._storage.items() if obj_ref() is not None}
+        objects = {}
+        for stripe, lock in zip(ObjectIdDatabase._stripes, ObjectIdDatabase._locks):
+            with lock:
+                refs = list(stripe.items())
+            for handle, obj_ref in refs:
+                obj = obj_ref()
+                if obj is not None:
+                    objects[to_id(handle)] = obj
+        return objects
+
+    @staticmethod
+    def __reparent__(handle, parent_handle):
+        """Record the parent of an object in the parent index."""
+        with ObjectIdDatabase._index_lock:
+            entry = ObjectIdDatabase._entries.get(handle)
+            if entry is None or entry[1] == parent_handle:
+                return
+
+            ObjectIdDatabase.__discard__(ObjectIdDatabase._children, entry[1], handle)
+            entry[1] = parent_handle
+            if parent_handle is not None:
+                ObjectIdDatabase._children.setdefault(parent_handle, {})[handle] = None
+
+    @staticmethod
+    def __stripe__(handle):
+        index = handle % ObjectIdDatabase.STRIPES
+        return ObjectIdDatabase._stripes[index], ObjectIdDatabase._locks[index]
+
+    @staticmethod
+    def __lookup__(handle):
+        stripe, lock = ObjectIdDatabase.__stripe__(handle)
+        with lock:
+            return stripe.get(handle)
+
+    @staticmethod
+    def __collect__(obj_ref):
+        """Queue the handle of a garbage collected object for removal."""
+        ObjectIdDatabase._collected.append(obj_ref.handle)
+
+    @staticmethod
+    def __purge__():
+        """Remove the entries of garbage collected objects."""
+        collected = ObjectIdDatabase._collected
+        while collected:
+            try:
+                handle = collected.popleft()
+            except IndexError:
+                break
+
+            stripe, lock = ObjectIdDatabase.__stripe__(handle)
+            with lock:
+                obj_ref = stripe.get(handle)
+                if obj_ref is not None and obj_ref() is None:
+                    del stripe[handle]
+
+            ObjectIdDatabase.__unindex__(handle)
+
+    @staticmethod
+    def __unindex__(handle):
+        with ObjectIdDatabase._index_lock:
+            entry = ObjectIdDatabase._entries.pop(handle, None)
+            if entry is not None:
+                ObjectIdDatabase.__discard__(ObjectIdDatabase._types, entry[0], handle)
+                ObjectIdDatabase.__discard__(ObjectIdDatabase._children, entry[1], handle)
+
+            # Children of a removed object keep their entries until they are reparented
+            ObjectIdDatabase._children.pop(handle, None)
+
+    @staticmethod
+    def __discard__(index, key, handle):
+        handles = index.get(key)
+        if handles is not None:
+            handles.pop(handle, None)
+            if not handles:
+                del index[key]
 
 
 class Object (ABC):
-    """Base class for all objects with a unique UUID."""
+    """Base class for all objects with a unique UUID.
+
+    Objects use slots instead of a per-instance dictionary and keep their UUID as integer
+    handle, which is only formatted as string when requested, so projects with many small
+    objects stay compact in memory."""
+
+    __slots__ = ('handle', 'name', 'parent', 'modified', '__weakref__')
+
+    # Observers notified about structural changes of the object tree. Each observer is
+    # called with the changed object, the kind of change and an optional child object.
+    observers = []
 
     def __init__(self, name):
-        self.id = str(uuid.uuid4())  # Assign a unique UUID
+        self.handle = uuid.uuid4().int  # Assign a unique UUID, kept in its integer form
         self.name = name
+        self.parent = None  # Weak reference to the parent object
+        self.modified = True  # Set if the object has been changed since it was last loaded or saved
 
         ObjectIdDatabase.add(self)  # Automatically register the object in the database
 
@@ -54,16 +249,61 @@ class Object (ABC):
         """Get the name of the object."""
         return self.name
 
+    def set_name(self, name):
+        """Set the name of the object."""
+        self.name = name
+        self.set_modified()
+        self.__notify__('rename')
+
+    @property
+    def id(self):
+        """UUID of the object."""
+        return to_id(self.handle)
+
     def get_id(self):
         """Get the UUID of the object."""
-        return self.id
+        return to_id(self.handle)
+
+    def get_handle(self):
+        """Get the integer handle of the object, the numeric value of its UUID."""
+        return self.handle
+
+    def get_parent(self):
+        """Get the parent object or None if the object is not part of the tree."""
+        return self.parent() if self.parent is not None else None
+
+    def set_parent(self, parent):
+        """Set the parent object."""
+        self.parent = weakref.ref(parent) if parent is not None else None
+        ObjectIdDatabase.__reparent__(self.handle, parent.handle if parent is not None else None)
 
     def get_children(self):
         """Get a list of child objects."""
         return []
 
-    def __del__(self):
-        ObjectIdDatabase.remove(self.id)  # Automatically deregister the object when it is destructed
+    def get_info(self):
+        """Get a dictionary with the metadata of the object."""
+        return {
+            'id': self.get_id(),
+            'name': self.get_name(),
+            'type': self.__type__(),
+            'children': len(self.get_children())
+        }
+
+    def is_modified(self):
+        """Check if the object has been changed since it was last loaded or saved."""
+        return self.modified
+
+    def set_modified(self, modified=True):
+        """Mark the object as changed or unchanged."""
+        self.modified = modified
+
+    def __notify__(self, change, child=None):
+        """Notify the observers about a change. Possible changes are 'add' and 'remove' of a
+        child, 'rename' of the object, 'update' if all children have been replaced and
+        'geometry' if the geometry of a mesh has been replaced."""
+        for observer in Object.observers:
+            observer(self, change, child)
 
     def __repr__(self):
         return f'<{self.__class__.__name__} id={self.id}, name={self.name}>'
@@ -0,0 +1,353 @@
+#
+# preprocess.py - Mesh repair and preprocessing
+#
+# Vectorized repair steps for raw meshes, like scans, which are applied at import time.
+# All steps work on plain (vertices, faces) arrays and only use numpy.
+#
+
+import numpy as np
+import time
+
+
+# Available steps in the order they are applied
+STEPS = ('merge', 'degenerate', 'duplicate', 'winding', 'split')
+
+# Steps applied if none are configured
+DEFAULT_STEPS = ('merge', 'degenerate', 'duplicate', 'winding')
+
+
+def merge_vertices(vertices: np.ndarray, faces: np.ndarray, tolerance: float):
+    '''
+    Merge vertices which fall into the same cell of a grid with the given spacing. The
+    merged vertex is the first vertex of each cell. Vertices closer than the tolerance
+    but in neighbouring cells are not merged.
+
+    Returns:
+        Tuple of the merged (vertices, faces) arrays.
+    '''
+    if len(vertices) == 0:
+        return vertices, faces
+
+    cells = np.floor(vertices / tolerance).astype(np.int64) if tolerance > 0 else vertices
+    order = np.lexsort(cells.T[::-1])
+    sorted_cells = cells[order]
+
+    starts = np.empty(len(order), dtype=bool)
+    starts[0] = True
+    starts[1:] = np.any(sorted_cells[1:] != sorted_cells[:-1], axis=1)
+
+    # Keep the vertices in the order of their first occurrence
+    first = np.minimum.reduceat(order, np.flatnonzero(starts))
+    rank = np.empty(len(first), dtype=np.int64)
+    rank[np.argsort(first)] = np.arange(len(first))
+
+    inverse = np.empty(len(order), dtype=np.int64)
+    inverse[order] = rank[np.cumsum(starts) - 1]
+
+    return vertices[np.sort(first)], inverse[faces]
+
+
+def remove_degenerate_faces(vertices: np.ndarray, faces: np.ndarray, epsilon: float = 1e-12) -> np.ndarray:
+    '''
+    Remove faces which reference a vertex more than once or whose area is zero relative
+    to their longest edge.
+    '''
+    triangles = vertices[faces]
+    edges = triangles[:, [1, 2, 0]] - triangles
+
+    area = np.linalg.norm(np.cross(edges[:, 0], edges[:, 1]), axis=1)
+    longest = np.max(np.einsum('ijk,ijk->ij', edges, edges), axis=1)
+
+    valid = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 2] != faces[:, 0])
+    valid &= area > epsilon * longest
+
+    return faces[valid]
+
+
+def remove_duplicate_faces(faces: np.ndarray) -> np.ndarray:
+    '''
+    Remove faces referencing the same vertices as an earlier face, regardless of their
+    orientation.
+    '''
+    if len(faces) == 0:
+        return faces
+
+    keys = np.sort(faces, axis=1)
+    order = np.lexsort(keys.T[::-1])
+    sorted_keys = keys[order]
+
+    starts = np.empty(len(order), dtype=bool)
+    starts[0] = True
+    starts[1:] = np.any(sorted_keys[1:] != sorted_keys[:-1], axis=1)
+
+    return faces[np.sort(np.minimum.reduceat(order, np.flatnonzero(starts)))]
+
+
+def remove_unreferenced_vertices(vertices: np.ndarray, faces: np.ndarray):
+    '''
+    Remove vertices which are not referenced by any face.
+    '''
+    used = np.zeros(len(vertices), dtype=bool)
+    used[faces.ravel()] = True
+
+    if used.all():
+        return vertices, faces
+
+    index = np.cumsum(used) - 1
+    return vertices[used], index[faces]
+
+
+def connected_components(count: int, edges: np.ndarray) -> np.ndarray:
+    '''
+    Label the connected components of a graph with the given number of nodes and (k, 2)
+    array of edges. The components are numbered from 0 in the order of their smallest
+    node.
+
+    The roots of components with a connecting edge are hooked onto the smaller root and
+    the labels are compressed by pointer jumping, so the number of rounds grows only
+    logarithmically with the number of nodes.
+    '''
+    labels = np.arange(count)
+    a, b = edges[:, 0], edges[:, 1]
+
+    while True:
+        la, lb = labels[a], labels[b]
+        crossing = la != lb
+        if not crossing.any():
+            break
+
+        la, lb = la[crossing], lb[crossing]
+        np.minimum.at(labels, np.maximum(la, lb), np.minimum(la, lb))
+
+        while True:
+            parents = labels[labels]
+            if np.array_equal(parents, labels):
+                break
+            labels = parents
+
+    return np.unique(labels, return_inverse=True)[1]
+
+
+def face_adjacency(faces: np.ndarray):
+    '''
+    Find the pairs of faces sharing a manifold edge, that is an edge used by exactly two
+    faces.
+
+    Returns:
+        Tuple of the (k, 2) face pairs, a boolean array which is set for pairs using the
+        edge in the same direction, so their orientation is inconsistent, and the number
+        of boundary and non-manifold edges of each face.
+    '''
+    edges = faces[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2)
+    low, high = edges.min(axis=1), edges.max(axis=1)
+    forward = edges[:, 0] < edges[:, 1]
+
+    order = np.lexsort((high, low))
+    same = (low[order][1:] == low[order][:-1]) & (high[order][1:] == high[order][:-1])
+
+    # An edge is manifold if it is equal to its successor, but not to its predecessor nor
+    # to the successor of its successor
+    padded = np.concatenate([[False], same, [False]])
+    starts = np.flatnonzero(padded[1:-1] & ~padded[:-2] & ~padded[2:])
+
+    first, second = order[starts], order[starts + 1]
+    pairs = np.column_stack([first // 3, second // 3])
+
+    manifold = np.zeros(len(edges), dtype=bool)
+    manifold[first] = manifold[second] = True
+    open_edges = np.bincount(np.flatnonzero(~manifold) // 3, minlength=len(faces))
+
+    valid = pairs[:, 0] != pairs[:, 1]
+    return pairs[valid], (forward[first] == forward[second])[valid], open_edges
+
+
+def fix_winding(vertices: np.ndarray, faces: np.ndarray) -> np.ndarray:
+    '''
+    Orient the faces of each edge connected patch consistently, so the face normals
+    point to the same side. Closed patches are oriented outwards. Open patches keep the
+    orientation of the majority of their faces.
+
+    The orientation is propagated breadth first over the face adjacency, processing the
+    whole front of all patches at once.
+    '''
+    count = len(faces)
+    if count == 0:
+        return faces
+
+    pairs, inconsistent, open_edges = face_adjacency(faces)
+    patches = connected_components(count, pairs)
+
+    # Adjacency lists of the faces in compressed sparse row form
+    source = np.concatenate([pairs[:, 0], pairs[:, 1]])
+    target = np.concatenate([pairs[:, 1], pairs[:, 0]])
+    relation = np.concatenate([inconsistent, inconsistent])
+
+    order = np.argsort(source, kind='stable')
+    target, relation = target[order], relation[order]
+    degree = np.bincount(source, minlength=count)
+    offsets = np.concatenate([[0], np.cumsum(degree)])
+
+    flip = np.zeros(count, dtype=bool)
+    visited = np.zeros(count, dtype=bool)
+
+    front = np.unique(patches, return_index=True)[1]
+    visited[front] = True
+
+    while len(front):
+        counts = degree[front]
+        total = counts.sum()
+        if total == 0:
+            break
+
+        origin = np.repeat(front, counts)
+        index = np.repeat(offsets[front] - np.cumsum(counts) + counts, counts) + np.arange(total)
+
+        neighbours = target[index]
+        parity = flip[origin] ^ relation[index]
+
+        new = ~visited[neighbours]
+        neighbours, first = np.unique(neighbours[new], return_index=True)
+
+        flip[neighbours] = parity[new][first]
+        visited[neighbours] = True
+        front = neighbours
+
+    # Decide the side of each patch
+    oriented = faces.copy()
+    oriented[flip] = oriented[flip][:, ::-1]
+
+    triangles = vertices[oriented]
+    volume = np.bincount(patches, np.einsum('ij,ij->i', triangles[:, 0], np.cross(triangles[:, 1], triangles[:, 2])))
+    closed = np.bincount(patches, open_edges) == 0
+    flipped = np.bincount(patches, flip)
+    sizes = np.bincount(patches)
+
+    invert = np.where(closed, volume < 0, flipped * 2 > sizes)
+    flip ^= invert[patches]
+
+    faces = faces.copy()
+    faces[flip] = faces[flip][:, ::-1]
+    return faces
+
+
+def split_components(vertices: np.ndarray, faces: np.ndarray):
+    '''
+    Order a mesh by its vertex connected components, so the vertices and the faces of
+    each component form a contiguous range. The components are ordered by decreasing
+    face count, vertices without faces come last.
+
+    Returns:
+        Tuple of the reordered (vertices, faces) and the list of (vertex start, vertex
+        stop, face start, face stop) ranges of the components.
+    '''
+    if len(faces) == 0:
+        return vertices, faces, []
+
+    labels = connected_components(len(vertices), np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]]]))
+    face_labels = labels[faces[:, 0]]
+
+    # Rank the components by their face count
+    sizes = np.bincount(face_labels, minlength=labels.max() + 1)
+    order = np.argsort(-sizes, kind='stable')
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+
+    vertex_ranks, face_ranks = rank[labels], rank[face_labels]
+    vertex_order = np.argsort(vertex_ranks, kind='stable')
+    face_order = np.argsort(face_ranks, kind='stable')
+
+    index = np.empty(len(vertices), dtype=np.int64)
+    index[vertex_order] = np.arange(len(vertices))
+
+    vertex_starts = np.concatenate([[0], np.cumsum(np.bincount(vertex_ranks, minlength=len(order)))]).tolist()
+    face_starts = np.concatenate([[0], np.cumsum(sizes[order])]).tolist()
+    ranges = [(vertex_starts[i], vertex_starts[i + 1], face_starts[i], face_starts[i + 1])
+              for i in range(len(order)) if face_starts[i + 1] > face_starts[i]]
+
+    return vertices[vertex_order], index[faces[face_order]], ranges
+
+
+class Pipeline:
+    '''
+    Configurable preprocessing pipeline. The enabled steps are applied in the order of
+    STEPS:
+
+    - 'merge': merge vertices closer than the tolerance, relative to the diagonal of
+      the bounding box
+    - 'degenerate': remove faces with repeated vertices or without area
+    - 'duplicate': remove faces referencing the same vertices as another face
+    - 'winding': orient the faces consistently
+    - 'split': order the mesh by its connected components and split off those with at
+      least min_component_faces faces. The mesh is only split if there are at least
+      two. The components refer to ranges of the mesh, see split_components(), and
+      smaller components are only part of the mesh itself. Their number and face
+      count are reported as 'small_components' and 'small_component_faces'.
+
+    The split step is not part of DEFAULT_STEPS, as it adds child meshes to the
+    imported meshes.
+
+    A pipeline is a plain object, so it can be passed to worker processes.
+    '''
+
+    def __init__(self, steps=DEFAULT_STEPS, tolerance: float = 1e-7, min_component_faces: int = 100):
+        unknown = set(steps) - set(STEPS)
+        if unknown:
+            raise ValueError(f'Unknown preprocessing steps: {", ".join(sorted(unknown))}')
+
+        self.steps = [step for step in STEPS if step in steps]
+        self.tolerance = tolerance
+        self.min_component_faces = min_component_faces
+
+    def run(self, vertices: np.ndarray, faces: np.ndarray):
+        '''
+        Run the pipeline.
+
+        Returns:
+            Tuple of the processed (vertices, faces), the list of (vertex start, vertex
+            stop, face start, face stop) ranges of the components if the mesh has been
+            split and a report with the 'steps' which ran, the vertex and face counts
+            before and after and the 'timings' of the steps in seconds.
+        '''
+        report = {
+            'steps': self.steps,
+            'tolerance': self.tolerance,
+            'vertices': [len(vertices), 0],
+            'faces': [len(faces), 0],
+            'components': 1,
+            'timings': {}
+        }
+
+        components = []
+
+        for step in self.steps:
+            start = time.perf_counter()
+
+            if step == 'merge':
+                diagonal = np.linalg.norm(np.ptp(vertices, axis=0)) if len(vertices) else 0.0
+                vertices, faces = merge_vertices(vertices, faces, self.tolerance * diagonal)
+            elif step == 'degenerate':
+                faces = remove_degenerate_faces(vertices, faces)
+            elif step == 'duplicate':
+                faces = remove_duplicate_faces(faces)
+            elif step == 'winding':
+                faces = fix_winding(vertices, faces)
+            elif step == 'split':
+                vertices, faces = remove_unreferenced_vertices(vertices, faces)
+                vertices, faces, ranges = split_components(vertices, faces)
+                components = [part for part in ranges if part[3] - part[2] >= self.min_component_faces]
+                report['components'] = len(components)
+                report['small_components'] = len(ranges) - len(components)
+                report['small_component_faces'] = int(len(faces) - sum(part[3] - part[2] for part in components))
+                if len(components) < 2:
+                    components = []
+
+            report['timings'][step] = time.perf_counter() - start
+
+        vertices, faces = remove_unreferenced_vertices(vertices, faces)
+        report['vertices'][1] = len(vertices)
+        report['faces'][1] = len(faces)
+
+        return vertices, faces, components, report
+
+    def __repr__(self):
+        return f'<Pipeline steps={self.steps}, tolerance={self.tolerance}>'
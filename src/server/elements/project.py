@@ -2,8 +2,11 @@
 # project.py - Project data storage
 #
 
+import contextlib
 import h5py
+import os
 
+from .files import get_lock, open_file
 from .object import Object
 from .mesh import Mesh
 
@@ -12,8 +15,30 @@ class Project (Object):
     '''
     This object represents a project. It stored all the projects data including the
     large blobs
+
+    A full save writes the complete project into a temporary file which atomically
+    replaces the project file. An incremental save writes new and changed meshes into
+    the existing file and leaves the groups of unchanged meshes alone, so its cost does
+    not depend on the size of the file. The new groups are written under temporary
+    names first and only replace the previous ones once all of them have been written,
+    so a failing save leaves the previous meshes in place. The space of removed groups
+    is reclaimed by a full save once it exceeds REPACK_RATIO of the file.
+
+    The project file is only opened through open_file(), so lazy reads of mesh data and
+    incremental saves wait for each other.
     '''
 
+    # Suffix of the groups written by an incremental save before they replace the
+    # previous groups
+    PENDING_SUFFIX = '.pending'
+
+    # Repack the file when more than this fraction of it, and at least the given number of
+    # bytes, are not occupied by the data of the project
+    REPACK_RATIO = 0.5
+    REPACK_MIN_SIZE = 1024 * 1024 * 64
+
+    __slots__ = ('filename', 'meshes')
+
     def __init__(self, name):
         """
         Initialize a new Project instance.
@@ -31,13 +56,21 @@ class Project (Object):
         '''
         return self.meshes
 
-    def load(self, filename: str):
+    def load(self, filename: str, lazy: bool = False):
         '''
         Load the project data from disk.
+
+        Args:
+            filename (str): The project file to load.
+            lazy (bool): If set, only the mesh metadata is read. The mesh geometry is
+                loaded from the file when it is accessed for the first time.
         '''
+        for mesh in self.meshes:
+            mesh.set_parent(None)
+
         self.meshes = []
 
-        with h5py.File(filename, 'r') as f:
+        with open_file(filename) as f:
 
             project_group = f['project']
             super().__load__(project_group)
@@ -45,39 +78,162 @@ class Project (Object):
             meshes = f['meshes']
             for _, group in meshes.items():
                 mesh = Mesh('', None)
-                mesh.__load__(group)
+                mesh.__load__(group, lazy=lazy)
+                mesh.set_parent(self)
                 self.meshes.append(mesh)
 
         self.filename = filename
+        self.set_modified(False)
+        self.__notify__('update')
 
-    def save(self, filename: str):
+    def save(self, filename: str, incremental: bool = False):
         '''
         Save the project data to disk.
-        '''
 
-        with h5py.File(filename, 'w') as f:
+        Args:
+            filename (str): The project file to write.
+            incremental (bool): If set and the project is saved to the file it was loaded
+                from or last saved to, only new and changed meshes are written.
+        '''
+        if incremental and self.__is_own_file__(filename):
+            self.__save_incremental__(filename)
 
-            project_group = f.create_group('project')
-            super().__save__(project_group)
+            with open_file(filename) as f:
+                garbage = os.path.getsize(filename) - sum(dset.id.get_storage_size() for dset in Project.__datasets__(f))
 
-            meshes = f.create_group('meshes')
-            for mesh in self.meshes:
-                mesh_group = meshes.create_group(mesh.get_id())
-                mesh.__save__(mesh_group)
+            if garbage < max(Project.REPACK_RATIO * os.path.getsize(filename), Project.REPACK_MIN_SIZE):
+                return
 
-        self.filename = filename
+        self.__save_full__(filename)
 
     def add_mesh(self, mesh: Mesh):
         '''
         Add a mesh to the project.
         '''
+        mesh.set_parent(self)
         self.meshes.append(mesh)
+        self.set_modified()
+        self.__notify__('add', mesh)
+
+    def remove_mesh(self, mesh: Mesh):
+        '''
+        Remove a mesh from the project.
+        '''
+        self.meshes.remove(mesh)
+        mesh.set_parent(None)
+        self.set_modified()
+        self.__notify__('remove', mesh)
+
+    def __save_full__(self, filename: str):
+        '''
+        Write the complete project into a temporary file which replaces the project file.
+        '''
+        temp_filename = filename + '.tmp'
+        paths = []
+
+        try:
+            with h5py.File(temp_filename, 'w') as f:
+
+                project_group = f.create_group('project')
+                super().__save__(project_group)
+
+                meshes = f.create_group('meshes')
+                for mesh in self.meshes:
+                    mesh_group = meshes.create_group(mesh.get_id())
+                    mesh.__save__(mesh_group)
+                    paths.append(mesh_group.name)
+
+            with get_lock(filename):
+                os.replace(temp_filename, filename)
+
+        finally:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+
+        for mesh, path in zip(self.meshes, paths):
+            mesh.__relocate__(filename, path)
+
+        self.filename = filename
+        self.set_modified(False)
+
+    def __save_incremental__(self, filename: str):
+        '''
+        Write new and changed meshes into the project file and remove the groups of meshes
+        which have been removed or replaced.
+        '''
+        written = {}
+        unchanged = []
+
+        # Lazy reads lock the mesh before the file, so the meshes are locked first as well
+        with contextlib.ExitStack() as stack:
+            for mesh in self.meshes:
+                mesh.__acquire__(stack)
+
+            with open_file(filename, 'a') as f:
+
+                meshes = f['meshes']
+
+                # Determine which mesh groups can be kept as they are
+                kept = set()
+                for mesh in self.meshes:
+                    location = mesh.get_location()
+                    if not mesh.is_modified() and location is not None and \
+                            Project.__is_same_file__(location[0], filename) and location[1].startswith(meshes.name + '/'):
+                        kept.add(location[1])
+                        unchanged.append(mesh)
+                        meshes[location[1]].attrs['name'] = mesh.get_name()
+                    else:
+                        written[mesh] = mesh.get_id()
+
+                pending = {name + Project.PENDING_SUFFIX for name in written.values()}
+                try:
+                    for mesh, name in written.items():
+                        mesh.__save__(meshes.create_group(name + Project.PENDING_SUFFIX))
+                except BaseException:
+                    for name in pending:
+                        if name in meshes:
+                            del meshes[name]
+                    raise
+
+                # Groups of removed and replaced meshes and of interrupted saves
+                for name in [name for name, group in meshes.items() if group.name not in kept and name not in pending]:
+                    del meshes[name]
+
+                for name in written.values():
+                    meshes.move(name + Project.PENDING_SUFFIX, name)
+
+                super().__save__(f['project'])
+
+                # Derived data like spatial indices may have been computed for unchanged meshes
+                for mesh in unchanged:
+                    mesh.__save_derived__(f[mesh.get_location()[1]])
+
+            for mesh, name in written.items():
+                mesh.__relocate__(filename, f'/meshes/{name}')
+
+        self.set_modified(False)
+
+    def __is_own_file__(self, filename: str) -> bool:
+        '''
+        Check if the given file is the existing file of this project.
+        '''
+        return self.filename is not None and Project.__is_same_file__(filename, self.filename)
+
+    @staticmethod
+    def __is_same_file__(a: str, b: str) -> bool:
+        return os.path.exists(a) and os.path.exists(b) and os.path.samefile(a, b)
+
+    @staticmethod
+    def __datasets__(group: h5py.Group) -> list:
+        datasets = []
+        group.visititems(lambda _, obj: datasets.append(obj) if isinstance(obj, h5py.Dataset) else None)
+        return datasets
 
     def __load__(self, parent: h5py.Group):
         super ().__load__(parent)
 
     def __save__(self, parent: h5py.Group):
         super ().__save__(parent)
-    
+
     def __repr__(self):
         return f'<Project filename={self.filename} #meshes={len(self.meshes)}, id={self.get_id()}>'
@@ -0,0 +1,88 @@
+#
+# shared.py - Arrays shared with worker processes
+#
+
+import numpy as np
+
+from multiprocessing import shared_memory
+
+
+class SharedArrays:
+    '''
+    Set of numpy arrays in shared memory blocks, so worker processes can access them
+    without copying. The creating process owns the blocks and releases them in close().
+    Other processes attach to them via the picklable description.
+    '''
+
+    def __init__(self, arrays: dict = None, description: dict = None):
+        self.blocks = {}
+        self.arrays = {}
+        self.owner = description is None
+
+        if self.owner:
+            description = {}
+            for name, array in arrays.items():
+                array = np.ascontiguousarray(array)
+                block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                self.blocks[name] = block
+                description[name] = (block.name, array.shape, array.dtype.str)
+
+                np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        else:
+            for name, (block_name, _, _) in description.items():
+                self.blocks[name] = shared_memory.SharedMemory(name=block_name)
+
+        self.description = description
+
+        for name, (_, shape, dtype) in description.items():
+            self.arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=self.blocks[name].buf)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+    def close(self):
+        '''
+        Detach from the shared memory blocks. The owner also frees them.
+        '''
+        self.arrays = {}
+
+        for block in self.blocks.values():
+            block.close()
+            if self.owner:
+                block.unlink()
+
+        self.blocks = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def map_ranges(executor, function, arrays: dict, ranges: list, *args):
+    '''
+    Run a function over ranges of arrays in the worker processes of an executor.
+
+    The arrays are copied into shared memory once and function(description, start, stop,
+    *args) is submitted for each (start, stop) range, so only the ranges are sent to the
+    workers. Closing the generator cancels the ranges which have not been started yet.
+
+    Yields:
+        Tuples of the shared arrays and the result of each range, in order, as soon as
+        they are available.
+    '''
+    with SharedArrays(arrays) as shared:
+        tasks = [executor.submit(function, shared.description, start, stop, *args) for start, stop in ranges]
+
+        try:
+            for task in tasks:
+                yield shared, task.result()
+
+        finally:
+            # The shared memory must not be released while workers still use it
+            for task in tasks:
+                task.cancel()
+            for task in tasks:
+                if not task.cancelled():
+                    task.exception()
@@ -0,0 +1,325 @@
+#
+# slicing.py - Cross sections of meshes
+#
+
+import numpy as np
+
+from .shared import SharedArrays, map_ranges
+
+
+# Distance relative to the largest coordinate of a section below which consecutive
+# points of a polyline count as repeated, see simplify_polylines()
+REPEAT_TOLERANCE = 1e-9
+
+
+class EdgeIndex:
+    '''
+    Unique edges of a mesh and the edges of each face. The intersection points of a plane
+    are computed per edge, so the segments of adjacent faces meet in the point of their
+    common edge and can be joined into polylines by the edge ids alone.
+    '''
+
+    # Arrays of the index, see SharedArrays
+    ARRAYS = ('edges', 'face_edges')
+
+    def __init__(self, edges: np.ndarray, face_edges: np.ndarray):
+        self.edges = edges  # (k, 2) vertex indices of each edge, the lower index first
+        self.face_edges = face_edges  # (m, 3) ids of the edges (a, b), (b, c) and (c, a) of each face
+
+    @staticmethod
+    def build(faces: np.ndarray) -> 'EdgeIndex':
+        '''
+        Build the edge index of a mesh.
+        '''
+        edges = faces[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2).astype(np.int64)
+        low, high = edges.min(axis=1), edges.max(axis=1)
+
+        base = int(high.max()) + 1 if len(high) else 1
+        keys, inverse = np.unique(low * base + high, return_inverse=True)
+
+        dtype = np.int32 if base < np.iinfo(np.int32).max else np.int64
+        return EdgeIndex(np.column_stack([keys // base, keys % base]).astype(dtype),
+                         inverse.reshape(-1, 3).astype(np.int32 if len(keys) < np.iinfo(np.int32).max else np.int64))
+
+    def __len__(self):
+        return len(self.edges)
+
+
+def plane_heights(vertices: np.ndarray, normal: np.ndarray) -> np.ndarray:
+    '''
+    Compute the distances of the vertices from the origin along a plane normal, which is
+    normalized.
+    '''
+    normal = np.asarray(normal, dtype=np.float64)
+    length = np.linalg.norm(normal) if normal.shape == (3,) else 0.0
+    if not np.isfinite(length) or length == 0.0:
+        raise ValueError('The plane normal must be a finite non-zero 3D vector')
+
+    return vertices @ (normal / length)
+
+
+def slice_planes(vertices: np.ndarray, faces: np.ndarray, index: EdgeIndex, normal: np.ndarray, offsets: np.ndarray,
+                 heights: np.ndarray = None) -> list:
+    '''
+    Intersect a mesh with parallel planes in a single vectorized pass.
+
+    Each face crossed by a plane contributes one segment, oriented by the winding of the
+    face. On a consistently oriented mesh the segments therefore join into polylines
+    which run counterclockwise around the material when viewed against the normal, so
+    holes run clockwise. A vertex lying exactly on a plane counts as above it.
+
+    Args:
+        vertices (np.ndarray): (n, 3) vertex coordinates.
+        faces (np.ndarray): (m, 3) vertex indices.
+        index (EdgeIndex): Edge index of the mesh.
+        normal (np.ndarray): (3,) common normal of the planes, it is normalized.
+        offsets (np.ndarray): (p,) distances of the planes from the origin along the normal.
+        heights (np.ndarray): (n,) distances of the vertices along the normal if they have
+            been computed already, see plane_heights().
+
+    Returns:
+        List with a tuple for each plane: the (k, 3) float64 points of all polylines one
+        after another, the (l,) number of points of each polyline and the (l,) flags which
+        are set for closed polylines. The first point of a closed polyline is not repeated.
+    '''
+    if heights is None:
+        heights = plane_heights(vertices, normal)
+
+    offsets = np.asarray(offsets, dtype=np.float64)
+
+    order = np.argsort(offsets, kind='stable')
+    sorted_offsets = offsets[order]
+
+    # Pairs of faces and the planes crossing them: a plane crosses a face if at least one
+    # vertex lies below and one on or above it
+    face_heights = heights[faces]
+    h0, h1, h2 = face_heights.T
+    first = np.searchsorted(sorted_offsets, np.minimum(np.minimum(h0, h1), h2), 'right')
+    counts = np.searchsorted(sorted_offsets, np.maximum(np.maximum(h0, h1), h2), 'right') - first
+
+    crossed = np.flatnonzero(counts > 0)
+    counts = counts[crossed]
+    face = np.repeat(crossed, counts)
+    plane = np.repeat(first[crossed] - np.cumsum(counts) + counts, counts) + np.arange(len(face))
+
+    # Segments are numbered by plane, so the polylines come out ordered by plane
+    by_plane = np.argsort(plane, kind='stable')
+    face, plane = face[by_plane], plane[by_plane]
+
+    # Each crossed face has exactly one edge going down through the plane and one going up,
+    # in the direction of its winding. The segment runs from the first to the second. A
+    # neighbor uses the common edge in the opposite direction, so the segment of one face
+    # ends where the segment of the other begins.
+    above = face_heights[face] >= sorted_offsets[plane][:, None]
+    next_above = np.roll(above, -1, axis=1)
+    start_edge = index.face_edges[face, np.argmax(above & ~next_above, axis=1)]
+    end_edge = index.face_edges[face, np.argmax(~above & next_above, axis=1)]
+
+    # Nodes are the crossings of an edge with a plane
+    start = plane.astype(np.int64) * len(index) + start_edge
+    end = plane.astype(np.int64) * len(index) + end_edge
+
+    following = link_segments(start, end)
+    segments, lengths, closed = chain_segments(following)
+
+    points = edge_crossings(vertices, heights, index, sorted_offsets, start[segments])
+
+    # Open polylines end in the end point of their last segment
+    stops = np.cumsum(lengths)
+    tails = segments[stops[~closed] - 1]
+    points = np.insert(points, stops[~closed], edge_crossings(vertices, heights, index, sorted_offsets, end[tails]), axis=0)
+    lengths = lengths + ~closed
+    planes = plane[segments[stops - 1]] if len(segments) else np.empty(0, np.int64)
+
+    tolerance = REPEAT_TOLERANCE * np.abs(points).max() if len(points) else 0.0
+    points, lengths, closed, planes = simplify_polylines(points, lengths, closed, planes, tolerance)
+
+    # Split the polylines by plane, in the order of the requested offsets
+    results = [None] * len(offsets)
+    bounds = np.searchsorted(planes, np.arange(len(offsets) + 1))
+    point_bounds = np.concatenate([[0], np.cumsum(lengths)])
+
+    for sorted_index, plane_index in enumerate(order):
+        a, b = bounds[sorted_index], bounds[sorted_index + 1]
+        results[plane_index] = (points[point_bounds[a]:point_bounds[b]], lengths[a:b], closed[a:b])
+
+    return results
+
+
+def slice_range(description: dict, start: int, stop: int, normal: np.ndarray) -> list:
+    '''
+    Intersect a mesh in shared memory with a range of the shared planes, see
+    slice_planes(). Runs in a worker process.
+    '''
+    with SharedArrays(description=description) as shared:
+        index = EdgeIndex(*(shared[name] for name in EdgeIndex.ARRAYS))
+        return slice_planes(shared['vertices'], shared['faces'], index, normal, shared['offsets'][start:stop],
+                            heights=shared['heights'])
+
+
+def slice_mesh(vertices: np.ndarray, faces: np.ndarray, index: EdgeIndex, normal: np.ndarray, offsets: np.ndarray,
+               executor=None, chunk_size: int = 64):
+    '''
+    Intersect a mesh with parallel planes in chunks of planes, see slice_planes().
+
+    If an executor is given, the chunks are computed concurrently in its worker processes.
+    The mesh, its edge index and the plane offsets are shared with the workers via shared
+    memory, so only the chunk ranges are sent to them.
+
+    Yields:
+        Tuples of the index of the first plane and the results of the planes of each
+        chunk, in order.
+    '''
+    offsets = np.asarray(offsets, dtype=np.float64)
+    ranges = [(start, min(start + chunk_size, len(offsets))) for start in range(0, len(offsets), chunk_size)]
+
+    heights = plane_heights(vertices, normal)
+
+    if executor is None:
+        for start, stop in ranges:
+            yield start, slice_planes(vertices, faces, index, normal, offsets[start:stop], heights=heights)
+        return
+
+    arrays = {name: getattr(index, name) for name in EdgeIndex.ARRAYS}
+    arrays.update(vertices=np.asarray(vertices, dtype=np.float64), faces=faces, heights=heights, offsets=offsets)
+
+    results = map_ranges(executor, slice_range, arrays, ranges, normal)
+
+    try:
+        for (start, _), (_, planes) in zip(ranges, results):
+            yield start, planes
+    finally:
+        results.close()
+
+
+def link_segments(start: np.ndarray, end: np.ndarray) -> np.ndarray:
+    '''
+    Find the segment following each segment, the one starting in its end node. Nodes
+    used by more than two segments, as on non-manifold edges, are not linked.
+
+    Returns:
+        (s,) index of the following segment or -1.
+    '''
+    following = np.full(len(start), -1, dtype=np.int64)
+    if len(start) == 0:
+        return following
+
+    order = np.argsort(start, kind='stable')
+    sorted_start = start[order]
+
+    position = np.searchsorted(sorted_start, end)
+    found = position < len(start)
+    found[found] = sorted_start[position[found]] == end[found]
+
+    # The start node must be unique
+    unique = np.ones(len(start), dtype=bool)
+    unique[1:] &= sorted_start[1:] != sorted_start[:-1]
+    unique[:-1] &= sorted_start[:-1] != sorted_start[1:]
+    found[found] = unique[position[found]]
+
+    following[found] = order[position[found]]
+
+    # And so must be the end node
+    targets = following[found]
+    shared = np.bincount(targets, minlength=len(start)) > 1
+    following[np.flatnonzero(found)[shared[targets]]] = -1
+
+    return following
+
+
+def chain_segments(following: np.ndarray):
+    '''
+    Order linked segments into polylines by pointer jumping, in O(s log s) without a
+    loop over the segments. Cycles become closed polylines starting at their lowest
+    segment.
+
+    Returns:
+        Tuple of the (s,) segments ordered by polyline, the (l,) number of segments of
+        each polyline and the (l,) flags of the closed polylines.
+    '''
+    count = len(following)
+    identity = np.arange(count)
+    steps = max(count.bit_length(), 1)
+
+    # The lowest segment reachable from each segment. Segments still pointing to another
+    # segment after more jumps than there are segments lie on a cycle.
+    lowest, pointer = identity.copy(), following.copy()
+    for _ in range(steps):
+        valid = np.flatnonzero(pointer >= 0)
+        if len(valid) == 0:
+            break
+        lowest[valid] = np.minimum(lowest[valid], lowest[pointer[valid]])
+        pointer[valid] = pointer[pointer[valid]]
+
+    cyclic = pointer >= 0
+
+    # Open each cycle before its lowest segment
+    previous = np.full(count, -1, dtype=np.int64)
+    linked = np.flatnonzero(following >= 0)
+    previous[following[linked]] = linked
+
+    following = following.copy()
+    following[previous[np.flatnonzero(cyclic & (lowest == identity))]] = -1
+
+    # Distance of each segment to the last segment of its polyline
+    rank = (following >= 0).astype(np.int64)
+    last, pointer = identity.copy(), following.copy()
+    for _ in range(steps):
+        valid = np.flatnonzero(pointer >= 0)
+        if len(valid) == 0:
+            break
+        rank[valid] += rank[pointer[valid]]
+        last[valid] = last[pointer[valid]]
+        pointer[valid] = pointer[pointer[valid]]
+
+    segments = np.lexsort((-rank, last))
+
+    heads = np.flatnonzero(np.diff(last[segments], prepend=-1) != 0)
+    lengths = np.diff(np.append(heads, count))
+
+    return segments, lengths, cyclic[segments[heads]]
+
+
+def edge_crossings(vertices: np.ndarray, heights: np.ndarray, index: EdgeIndex, offsets: np.ndarray,
+                  nodes: np.ndarray) -> np.ndarray:
+    '''
+    Compute the points where edges cross planes, given as nodes plane * edges + edge.
+    '''
+    plane, edge = np.divmod(nodes, len(index))
+    low, high = index.edges[edge, 0], index.edges[edge, 1]
+
+    t = ((offsets[plane] - heights[low]) / (heights[high] - heights[low]))[:, None]
+    return vertices[low] + t * (vertices[high] - vertices[low])
+
+
+def simplify_polylines(points: np.ndarray, lengths: np.ndarray, closed: np.ndarray, planes: np.ndarray,
+                       tolerance: float = 0.0):
+    '''
+    Remove repeated points, which occur where a plane passes through a vertex, and the
+    polylines collapsing to a single point. The crossings of the edges meeting in such a
+    vertex only agree up to rounding, so points within the tolerance of the previous
+    point of their polyline count as repeated, like the last point of a closed polyline
+    within the tolerance of its first point.
+    '''
+    polyline = np.repeat(np.arange(len(lengths)), lengths)
+
+    keep = np.ones(len(points), dtype=bool)
+    keep[1:] = (np.linalg.norm(points[1:] - points[:-1], axis=1) > tolerance) | (polyline[1:] != polyline[:-1])
+    points, polyline = points[keep], polyline[keep]
+    lengths = np.bincount(polyline, minlength=len(lengths))
+
+    # The last point of a closed polyline must not repeat its first point
+    lasts = np.cumsum(lengths) - 1
+    firsts = lasts - lengths + 1
+    wrapped = np.flatnonzero(closed & (lengths > 1))
+    repeated = wrapped[np.linalg.norm(points[lasts[wrapped]] - points[firsts[wrapped]], axis=1) <= tolerance]
+
+    keep = np.ones(len(points), dtype=bool)
+    keep[lasts[repeated]] = False
+    points, polyline = points[keep], polyline[keep]
+    lengths[repeated] -= 1
+
+    valid = lengths > 1
+    points = points[valid[polyline]]
+
+    return points, lengths[valid], closed[valid], planes[valid]
@@ -0,0 +1,49 @@
+#
+# stats.py - Mesh statistics
+#
+
+import numpy as np
+
+from .preprocess import face_adjacency
+
+
+# Keys of the statistics returned by compute_stats()
+STATS = frozenset(('vertices', 'faces', 'bounds', 'size', 'area', 'volume', 'watertight'))
+
+
+def compute_stats(vertices: np.ndarray, faces: np.ndarray) -> dict:
+    '''
+    Compute the statistics of a mesh in a single vectorized pass.
+
+    Returns:
+        Dictionary with the number of 'vertices' and 'faces', the 'bounds' as [min x,
+        min y, min z, max x, max y, max z], the 'size' of the in-memory geometry arrays in
+        bytes, the surface 'area', the enclosed 'volume' and 'watertight', which is set if
+        each edge is shared by exactly two faces. The volume is only meaningful for
+        watertight meshes with consistently oriented faces.
+    '''
+    stats = {
+        'vertices': len(vertices),
+        'faces': len(faces),
+        'bounds': np.concatenate([vertices.min(axis=0), vertices.max(axis=0)]).tolist() if len(vertices) else [],
+        'size': len(vertices) * 3 * np.dtype(np.float64).itemsize + len(faces) * 3 * np.dtype(np.int64).itemsize,
+        'area': 0.0,
+        'volume': 0.0,
+        'watertight': False
+    }
+
+    if len(faces) == 0:
+        return stats
+
+    a, b, c = vertices[faces[:, 0]], vertices[faces[:, 1]], vertices[faces[:, 2]]
+    normals = np.cross(b - a, c - a)
+
+    stats['area'] = float(np.linalg.norm(normals, axis=1).sum() / 2.0)
+
+    # Sum of the signed volumes of the tetrahedra spanned by the faces and the origin
+    stats['volume'] = float(np.einsum('ij,ij->', a, normals) / 6.0)
+
+    _, _, open_edges = face_adjacency(faces)
+    stats['watertight'] = not open_edges.any()
+
+    return stats
@@ -0,0 +1,152 @@
+#
+# stl.py - STL file reader
+#
+
+import numpy as np
+import os
+import re
+
+
+# Binary STL layout: 80 byte header, uint32 triangle count and 50 bytes per triangle
+HEADER_SIZE = 80
+COUNT_SIZE = 4
+TRIANGLE_DTYPE = np.dtype([('normal', '<f4', (3,)),
+                           ('vertices', '<f4', (3, 3)),
+                           ('attributes', '<u2')])
+
+# Matches the three coordinates of an ASCII STL 'vertex' line
+ASCII_VERTEX = re.compile(rb'vertex\s+(\S+\s+\S+\s+\S+)')
+
+
+def is_binary_stl(path: str) -> bool:
+    '''
+    Check if a file is a binary STL file. ASCII files start with 'solid', but some binary
+    files do too, so those are recognized by their file size matching the triangle count.
+    Binary files with a wrong triangle count or trailing bytes may still not be detected,
+    see read_stl().
+    '''
+    size = os.path.getsize(path)
+    if size < HEADER_SIZE + COUNT_SIZE:
+        return False
+
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+        count = int(np.frombuffer(f.read(COUNT_SIZE), dtype='<u4')[0])
+
+    if not header.lstrip().startswith(b'solid'):
+        return True
+
+    return size == HEADER_SIZE + COUNT_SIZE + count * TRIANGLE_DTYPE.itemsize
+
+
+def read_binary_triangles(path: str) -> np.ndarray:
+    '''
+    Read the triangles of a binary STL file as (n, 3, 3) float32 array. The file is
+    memory mapped and decoded in a single pass.
+
+    Files with trailing bytes or a triangle count exceeding the file are read up to the
+    smaller of the triangle count and the number of complete triangles in the file.
+    '''
+    size = os.path.getsize(path)
+    if size < HEADER_SIZE + COUNT_SIZE:
+        raise ValueError(f'{path}: Truncated binary STL file')
+
+    with open(path, 'rb') as f:
+        f.seek(HEADER_SIZE)
+        count = int(np.frombuffer(f.read(COUNT_SIZE), dtype='<u4')[0])
+
+    count = min(count, (size - HEADER_SIZE - COUNT_SIZE) // TRIANGLE_DTYPE.itemsize)
+    if count == 0:
+        return np.empty((0, 3, 3), dtype=np.float32)
+
+    triangles = np.memmap(path, dtype=TRIANGLE_DTYPE, mode='r', offset=HEADER_SIZE + COUNT_SIZE, shape=(count,))
+
+    try:
+        return np.array(triangles['vertices'], dtype=np.float32)
+    finally:
+        del triangles
+
+
+def read_ascii_triangles(path: str) -> np.ndarray:
+    '''
+    Read the triangles of an ASCII STL file as (n, 3, 3) float32 array.
+    '''
+    with open(path, 'rb') as f:
+        coordinates = b' '.join(ASCII_VERTEX.findall(f.read()))
+
+    values = np.fromstring(coordinates.decode('ascii'), dtype=np.float32, sep=' ')
+    if len(values) % 9 != 0:
+        raise ValueError(f'{path}: Malformed ASCII STL file')
+
+    return values.reshape(-1, 3, 3)
+
+
+def merge_vertices(triangles: np.ndarray):
+    '''
+    Merge bitwise identical vertices of a triangle soup.
+
+    The corners are grouped by sorting a 64 bit hash of their coordinates. Hash
+    collisions are detected by comparing the coordinates of neighbouring corners, so
+    they can only leave a vertex unmerged but never merge different vertices. The
+    unique vertices are ordered by their first occurrence.
+
+    Args:
+        triangles (np.ndarray): (n, 3, 3) array of triangle corner coordinates.
+
+    Returns:
+        Tuple of the unique (vertices, faces) arrays.
+    '''
+    corners = np.ascontiguousarray(triangles.reshape(-1, 3), dtype=np.float32)
+
+    if len(corners) == 0:
+        return np.empty((0, 3), dtype=np.float64), np.empty((0, 3), dtype=np.int64)
+
+    # Adding zero turns -0.0 into 0.0, so both compare equal bitwise
+    corners += 0.0
+
+    bits = corners.view(np.uint32).astype(np.uint64)
+    keys = (bits[:, 0] * np.uint64(0x9E3779B97F4A7C15)) ^ \
+           (bits[:, 1] * np.uint64(0xC2B2AE3D27D4EB4F)) ^ \
+           (bits[:, 2] * np.uint64(0x165667B19E3779F9))
+
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+    sorted_corners = corners[order]
+
+    starts = np.empty(len(order), dtype=bool)
+    starts[0] = True
+    starts[1:] = (sorted_keys[1:] != sorted_keys[:-1]) | np.any(sorted_corners[1:] != sorted_corners[:-1], axis=1)
+
+    # Renumber the groups by the first occurrence of their vertex in the input
+    first = np.minimum.reduceat(order, np.flatnonzero(starts))
+    rank = np.empty(len(first), dtype=np.int64)
+    rank[np.argsort(first)] = np.arange(len(first))
+
+    inverse = np.empty(len(order), dtype=np.int64)
+    inverse[order] = rank[np.cumsum(starts) - 1]
+
+    return corners[np.sort(first)].astype(np.float64), inverse.reshape(-1, 3)
+
+
+def read_stl(path: str):
+    '''
+    Read an STL file, either binary or ASCII. Files starting with 'solid' which do not
+    contain any ASCII vertices are read as binary files.
+
+    Returns:
+        Tuple of the (vertices, faces) arrays with merged vertices.
+
+    Raises:
+        ValueError: If the file does not contain any triangles or cannot be parsed.
+    '''
+    triangles = None
+    if not is_binary_stl(path):
+        triangles = read_ascii_triangles(path)
+
+    if triangles is None or len(triangles) == 0:
+        triangles = read_binary_triangles(path)
+
+    if len(triangles) == 0:
+        raise ValueError(f'{path}: STL file does not contain any triangles')
+
+    return merge_vertices(triangles)
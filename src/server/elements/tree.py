@@ -0,0 +1,169 @@
+#
+# tree.py - Object tree index
+#
+
+import json
+import threading
+
+from collections import deque
+
+from .object import Object
+
+
+class ObjectTree:
+    '''
+    Index of the object tree below a root object.
+
+    The serialized children of each object are cached and only rebuilt for the parts
+    of the tree which changed. Each change increments the tree revision and is recorded
+    as a delta, so clients can follow the tree without fetching it as a whole.
+
+    A delta is a dictionary with the keys 'revision', 'action', 'id', 'parent', 'label',
+    'type' and 'json'. The action is one of 'add', 'remove', 'rename' or 'update'. For
+    'add' and 'update', 'json' contains the serialized children of the object with the
+    given id.
+
+    Clients can wait for changes either blocking via wait() or by registering a listener
+    which is called after each change.
+    '''
+
+    def __init__(self, root: Object, history: int = 1000):
+        '''
+        Initialize the tree index and start observing changes.
+
+        Args:
+            root (Object): Root object of the tree.
+            history (int): Maximum number of deltas kept for clients catching up.
+        '''
+        self.root = root
+        self.revision = 0
+
+        self._cache = {}  # Object id -> serialized list of children
+        self._deltas = deque(maxlen=history)
+        self._listeners = []
+        self._condition = threading.Condition(threading.RLock())
+
+        Object.observers.append(self.__on_change__)
+
+    def close(self):
+        '''
+        Stop observing changes.
+        '''
+        Object.observers.remove(self.__on_change__)
+
+    def get_json(self, obj: Object = None) -> str:
+        '''
+        Get the serialized children of an object in JSON format. Each node is a dictionary
+        with the keys 'id', 'label', 'type' and 'children'.
+        '''
+        obj = obj if obj is not None else self.root
+
+        with self._condition:
+            serialized = self._cache.get(obj.get_id())
+
+            if serialized is None:
+                nodes = []
+                for child in obj.get_children():
+                    node = json.dumps({'id': child.get_id(), 'label': child.get_name(), 'type': child.__type__()})
+                    nodes.append(f'{node[:-1]}, "children": {self.get_json(child)}}}')
+
+                serialized = f'[{", ".join(nodes)}]'
+                self._cache[obj.get_id()] = serialized
+
+            return serialized
+
+    def get_snapshot(self):
+        '''
+        Get the current revision together with the serialized tree.
+        '''
+        with self._condition:
+            return self.revision, self.get_json()
+
+    def get_deltas(self, revision: int):
+        '''
+        Get the deltas following the given revision or None if they are no longer available.
+        '''
+        with self._condition:
+            if revision > self.revision:
+                return None
+            if revision == self.revision:
+                return []
+            if not self._deltas or self._deltas[0]['revision'] > revision + 1:
+                return None
+
+            return [delta for delta in self._deltas if delta['revision'] > revision]
+
+    def wait(self, revision: int, timeout: float = None) -> bool:
+        '''
+        Wait until the tree revision exceeds the given one. Returns False on timeout.
+        '''
+        with self._condition:
+            return self._condition.wait_for(lambda: self.revision > revision, timeout=timeout)
+
+    def add_listener(self, listener):
+        '''
+        Register a callable which is called without arguments after each change.
+        '''
+        with self._condition:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self._condition:
+            self._listeners.remove(listener)
+
+    def __contains__(self, obj: Object) -> bool:
+        while obj is not None:
+            if obj is self.root:
+                return True
+            obj = obj.get_parent()
+
+        return False
+
+    def __invalidate__(self, obj: Object):
+        '''
+        Drop the cached serialization of an object and of all its ancestors.
+        '''
+        while obj is not None:
+            self._cache.pop(obj.get_id(), None)
+            obj = obj.get_parent()
+
+    def __drop__(self, obj: Object):
+        '''
+        Drop the cached serializations of a whole subtree.
+        '''
+        self._cache.pop(obj.get_id(), None)
+        for child in obj.get_children():
+            self.__drop__(child)
+
+    def __on_change__(self, obj: Object, change: str, child: Object = None):
+        with self._condition:
+            if obj not in self:
+                return
+
+            target = child if child is not None else obj
+            parent = obj if child is not None else obj.get_parent()
+
+            if change == 'remove':
+                self.__drop__(child)
+                self.__invalidate__(obj)
+            elif change == 'update':
+                # The previous children are not known anymore, so start over
+                self._cache.clear()
+            else:
+                self.__invalidate__(target)
+
+            self.revision += 1
+            self._deltas.append({
+                'revision': self.revision,
+                'action': change,
+                'id': target.get_id(),
+                'parent': parent.get_id() if parent is not None else '',
+                'label': target.get_name() or '',
+                'type': target.__type__(),
+                'json': self.get_json(target) if change in ('add', 'update') else ''
+            })
+
+            self._condition.notify_all()
+
+            for listener in self._listeners:
+                listener()
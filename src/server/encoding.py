@@ -0,0 +1,184 @@
+#
+# encoding.py - Mesh transport encodings
+#
+# Besides glTF binary, meshes can be transferred in a compact buffer format which the
+# client can turn into vertex and index buffers without parsing. All values are little
+# endian. A payload starts with a header of 40 bytes:
+#
+#   offset  size  content
+#        0     4  magic 'ZMSH'
+#        4     1  format version (1)
+#        5     1  vertex format: 0 = float32, 1 = uint16 quantized
+#        6     1  index format: 0 = uint16, 1 = uint32
+#        7     1  flags: 1 = body deflate compressed, 2 = delta coded and byte shuffled
+#        8     4  vertex count (uint32)
+#       12     4  face count (uint32)
+#       16    12  offset (3 x float32)
+#       28    12  scale (3 x float32)
+#
+# The body contains the (n, 3) vertex array followed by the (m, 3) index array. The
+# vertex array is padded to a multiple of 4 bytes. Quantized positions are decoded as
+# offset + q * scale, float32 positions are stored as they are.
+#
+# The compressed encoding deflates the body (zlib stream). Before, the quantized
+# coordinates and the indices are delta coded along the arrays (each component
+# separately for the coordinates, the flattened index stream for the indices). The
+# differences wrap around at the width of the values and are zigzag coded, so small
+# negative differences become small values. Finally, the bytes are shuffled, so the
+# bytes of equal significance are stored consecutively.
+#
+
+import numpy as np
+import struct
+import trimesh
+import zlib
+
+
+MAGIC = b'ZMSH'
+VERSION = 1
+
+HEADER = struct.Struct('<4sBBBBII3f3f')
+
+VERTEX_FLOAT32 = 0
+VERTEX_UINT16 = 1
+
+INDEX_UINT16 = 0
+INDEX_UINT32 = 1
+
+FLAG_DEFLATE = 1
+FLAG_DELTA = 2
+
+# Deflate compression level of the compressed encoding
+COMPRESSION_LEVEL = 6
+
+# Available encodings: glTF binary, float32 buffers, 16 bit quantized buffers and
+# compressed quantized buffers
+ENCODINGS = ('glb', 'raw', 'quantized', 'compressed')
+
+
+def encode_mesh(data: trimesh.Trimesh, encoding: str):
+    '''
+    Encode a mesh for the transport to the client. Raises a ValueError for unknown
+    encodings.
+    '''
+    if encoding == 'glb':
+        return data.export(file_type='glb')
+
+    vertices, faces = np.asarray(data.vertices), np.asarray(data.faces)
+
+    if encoding == 'raw':
+        return encode_buffers(vertices, faces, quantize=False, compress=False)
+    if encoding == 'quantized':
+        return encode_buffers(vertices, faces, quantize=True, compress=False)
+    if encoding == 'compressed':
+        return encode_buffers(vertices, faces, quantize=True, compress=True)
+
+    raise ValueError(f'Unknown mesh encoding "{encoding}", expected one of {", ".join(ENCODINGS)}')
+
+
+def encode_buffers(vertices: np.ndarray, faces: np.ndarray, quantize: bool, compress: bool) -> bytes:
+    '''
+    Encode vertex and face arrays in the buffer format described above.
+    '''
+    offset, scale = np.zeros(3), np.ones(3)
+
+    if quantize:
+        if len(vertices):
+            offset = vertices.min(axis=0)
+            scale = (vertices.max(axis=0) - offset) / 65535.0
+            scale[scale == 0.0] = 1.0
+
+        vertex_data = np.clip(np.rint((vertices - offset) / scale), 0, 65535).astype('<u2')
+    else:
+        vertex_data = vertices.astype('<f4')
+
+    index_data = faces.astype('<u2' if len(vertices) <= 65536 else '<u4')
+
+    flags = 0
+    if compress:
+        vertex_data = shuffle(zigzag(delta(vertex_data)))
+        index_data = shuffle(zigzag(delta(index_data.ravel())))
+        flags = FLAG_DEFLATE | FLAG_DELTA
+
+    vertex_bytes = vertex_data.tobytes()
+    body = vertex_bytes + bytes(-len(vertex_bytes) % 4) + index_data.tobytes()
+
+    if compress:
+        body = zlib.compress(body, COMPRESSION_LEVEL)
+
+    header = HEADER.pack(MAGIC, VERSION,
+                         VERTEX_UINT16 if quantize else VERTEX_FLOAT32,
+                         INDEX_UINT16 if index_data.dtype.itemsize == 2 else INDEX_UINT32,
+                         flags, len(vertices), len(faces), *offset, *scale)
+
+    return header + body
+
+
+def decode_buffers(payload: bytes):
+    '''
+    Decode a payload in the buffer format into float32 (vertices, faces) arrays.
+    '''
+    magic, version, vertex_format, index_format, flags, vertex_count, face_count, *transform = \
+        HEADER.unpack_from(payload)
+
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Invalid mesh buffer payload')
+
+    body = memoryview(payload)[HEADER.size:]
+    if flags & FLAG_DEFLATE:
+        body = zlib.decompress(body)
+
+    vertex_dtype = np.dtype('<u2' if vertex_format == VERTEX_UINT16 else '<f4')
+    index_dtype = np.dtype('<u2' if index_format == INDEX_UINT16 else '<u4')
+
+    vertex_size = vertex_count * 3 * vertex_dtype.itemsize
+    vertex_data = np.frombuffer(body, dtype=vertex_dtype, count=vertex_count * 3)
+    index_data = np.frombuffer(body, dtype=index_dtype, count=face_count * 3, offset=vertex_size + -vertex_size % 4)
+
+    if flags & FLAG_DELTA:
+        vertex_data = undelta(unzigzag(unshuffle(vertex_data)).reshape(-1, 3))
+        index_data = undelta(unzigzag(unshuffle(index_data)))
+
+    vertices = vertex_data.reshape(-1, 3).astype(np.float32)
+    if vertex_format == VERTEX_UINT16:
+        vertices = np.float32(transform[:3]) + vertices * np.float32(transform[3:])
+
+    return vertices, index_data.reshape(-1, 3)
+
+
+def delta(values: np.ndarray) -> np.ndarray:
+    '''
+    Get the differences of consecutive values of an unsigned integer array along its
+    first axis. The differences wrap around at the width of the values.
+    '''
+    return np.diff(values, axis=0, prepend=np.zeros((1,) + values.shape[1:], dtype=values.dtype))
+
+
+def undelta(values: np.ndarray) -> np.ndarray:
+    return np.cumsum(values, axis=0, dtype=values.dtype)
+
+
+def zigzag(values: np.ndarray) -> np.ndarray:
+    '''
+    Map the two's complement values of an unsigned integer array, so values of small
+    magnitude stay small: 0, -1, 1, -2, ... become 0, 1, 2, 3, ...
+    '''
+    signed = values.view(values.dtype.str.replace('u', 'i'))
+    return ((signed << 1) ^ (signed >> (values.dtype.itemsize * 8 - 1))).view(values.dtype)
+
+
+def unzigzag(values: np.ndarray) -> np.ndarray:
+    return (values >> 1) ^ (np.zeros_like(values) - (values & 1))
+
+
+def shuffle(values: np.ndarray) -> np.ndarray:
+    '''
+    Reorder the bytes of an integer array, so the bytes of equal significance of all
+    values are stored consecutively.
+    '''
+    values = np.ascontiguousarray(values).ravel()
+    return values.view(np.uint8).reshape(-1, values.dtype.itemsize).T.ravel().view(values.dtype)
+
+
+def unshuffle(values: np.ndarray) -> np.ndarray:
+    return values.view(np.uint8).reshape(values.dtype.itemsize, -1).T.ravel().view(values.dtype)
@@ -0,0 +1,436 @@
+#
+# jobs.py - Background job management
+#
+
+import asyncio
+import logging
+import multiprocessing
+import numpy as np
+import os
+import threading
+import time
+import uuid
+
+from concurrent import futures
+
+from elements.deviation import compute_deviation
+from elements.mesh import Mesh
+from elements.preprocess import Pipeline
+from elements.slicing import slice_mesh
+from elements.stats import compute_stats
+from elements.stl import read_stl
+
+log = logging.getLogger(__name__)
+
+
+def load_mesh_file(path: str, pipeline: Pipeline = None):
+    '''
+    Load a mesh file, preprocess it and compute the statistics of the resulting meshes.
+    Runs in a worker process, so only plain arrays are returned.
+
+    Returns:
+        Tuple of the (vertices, faces, stats) of the mesh, the list of (range, stats) of
+        its connected components and the preprocessing report, see Pipeline.run(). The
+        report is None if no pipeline has been given.
+    '''
+    start = time.perf_counter()
+    vertices, faces = read_stl(path)
+    timings = {'read': time.perf_counter() - start}
+
+    components, report = [], None
+    if pipeline is not None:
+        vertices, faces, components, report = pipeline.run(vertices, faces)
+        timings.update(report['timings'])
+
+    start = time.perf_counter()
+    mesh = (vertices, faces, compute_stats(vertices, faces))
+    components = [((vertex_start, vertex_stop, face_start, face_stop),
+                   compute_stats(vertices[vertex_start:vertex_stop], faces[face_start:face_stop] - vertex_start))
+                  for vertex_start, vertex_stop, face_start, face_stop in components]
+    timings['stats'] = time.perf_counter() - start
+
+    if report is not None:
+        report['timings'] = timings
+
+    return mesh, components, report
+
+
+def get_worker_id(_=None) -> int:
+    '''
+    Get the process id of a worker. Unpickling this function imports this module and the
+    modules used by load_mesh_file() in the worker.
+    '''
+    return os.getpid()
+
+
+class Job:
+    '''
+    State of a background job. Each change of the state increments the revision, so
+    observers can wait for the next change, either blocking via wait() or by registering
+    a listener which is called after each change.
+    '''
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, total: int):
+        self.id = str(uuid.uuid4())
+        self.state = Job.QUEUED
+        self.total = total
+        self.completed = 0
+        self.ids = []
+        self.errors = []
+        self.timings = {}  # Stage -> accumulated seconds of all tasks
+        self.revision = 0
+        self.listeners = []
+
+        self._condition = threading.Condition()
+
+    def get_id(self):
+        """Get the UUID of the job."""
+        return self.id
+
+    def is_finished(self) -> bool:
+        '''
+        Check if the job has been finished, either successfully or not.
+        '''
+        return self.state in (Job.DONE, Job.FAILED)
+
+    def get_progress(self) -> float:
+        '''
+        Get the progress of the job in the range [0, 1].
+        '''
+        return self.completed / self.total if self.total else 1.0
+
+    def get_status(self) -> dict:
+        '''
+        Get a consistent snapshot of the job state.
+        '''
+        with self._condition:
+            return {
+                'id': self.id,
+                'state': self.state,
+                'progress': self.get_progress(),
+                'ids': list(self.ids),
+                'message': '\n'.join(self.errors),
+                'timings': dict(self.timings),
+                'revision': self.revision
+            }
+
+    def wait(self, revision: int, timeout: float = None) -> bool:
+        '''
+        Wait until the job revision exceeds the given one. Returns False on timeout.
+        '''
+        with self._condition:
+            return self._condition.wait_for(lambda: self.revision > revision, timeout=timeout)
+
+    def add_listener(self, listener):
+        '''
+        Register a callable which is called without arguments after each change.
+        '''
+        with self._condition:
+            self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self._condition:
+            self.listeners.remove(listener)
+
+    def __changed__(self):
+        self.revision += 1
+        self._condition.notify_all()
+
+        for listener in self.listeners:
+            listener()
+
+    def update(self, ids=None, error=None, timings=None):
+        '''
+        Record the completion of one task of the job, optionally with the time its stages
+        took in seconds.
+        '''
+        with self._condition:
+            self.completed += 1
+
+            if ids:
+                self.ids.extend(ids)
+            if error:
+                self.errors.append(error)
+            for stage, seconds in (timings or {}).items():
+                self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+            if self.completed >= self.total:
+                self.state = Job.FAILED if self.errors else Job.DONE
+            else:
+                self.state = Job.RUNNING
+
+            self.__changed__()
+
+    def start(self):
+        '''
+        Mark the job as running.
+        '''
+        with self._condition:
+            if self.state == Job.QUEUED:
+                if self.completed < self.total:
+                    self.state = Job.RUNNING
+                else:
+                    self.state = Job.FAILED if self.errors else Job.DONE
+                self.__changed__()
+
+    def __repr__(self):
+        return f'<Job id={self.id}, state={self.state}, progress={self.completed}/{self.total}>'
+
+
+class JobManager:
+    '''
+    Runs CPU heavy jobs like mesh imports, deviation analyses and slicing in a pool of
+    worker processes.
+    '''
+
+    # Number of finished jobs kept for status queries
+    MAX_FINISHED_JOBS = 100
+
+    # Number of vertices per deviation task. Smaller meshes are processed in the calling thread.
+    DEVIATION_CHUNK_SIZE = 256 * 1024
+
+    # Number of planes per slicing task. Fewer planes or planes through meshes with fewer
+    # faces are processed in the calling thread.
+    SLICE_CHUNK_SIZE = 32
+    SLICE_MIN_FACES = 64 * 1024
+
+    def __init__(self, max_workers: int = None, pipeline: Pipeline = None, metrics=None):
+        '''
+        Args:
+            max_workers (int): Number of worker processes, by default the number of CPUs.
+            pipeline (Pipeline): Preprocessing applied to imported meshes. No preprocessing
+                is applied if not given.
+            metrics (Metrics): Registry recording the imports and the time of their stages,
+                see metrics.py.
+        '''
+        self.max_workers = max_workers or os.cpu_count()
+        self.pipeline = pipeline
+        self.metrics = metrics
+        self.jobs = {}
+
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def get(self, job_id: str) -> Job:
+        '''
+        Retrieve a job by its id.
+        '''
+        with self._lock:
+            job = self.jobs.get(job_id)
+
+        if job is None:
+            raise KeyError(f'Job with UUID {job_id} not found.')
+
+        return job
+
+    def warm_up(self):
+        '''
+        Start the worker processes and let them import the modules used for imports, which
+        would otherwise delay the first import. Blocks until the workers are ready.
+        '''
+        list(self.__get_executor__().map(get_worker_id, range(self.max_workers)))
+
+    def import_meshes(self, project, paths: list) -> Job:
+        '''
+        Import mesh files concurrently into a project. The meshes are added to the project
+        as soon as the respective file has been parsed and preprocessed.
+        '''
+        job = self.__create_job__(len(paths))
+
+        for path in paths:
+            future = self.__get_executor__().submit(load_mesh_file, path, self.pipeline)
+            future.add_done_callback(lambda future, path=path: self.__add_mesh__(job, project, path, future))
+
+        job.start()
+
+        return job
+
+    def compute_deviation(self, source: Mesh, reference: Mesh):
+        '''
+        Compute the signed distances of the vertices of a mesh to a reference mesh. The
+        chunks are computed concurrently and yielded as tuples of the start index and the
+        distances in order, as soon as they are available. The result is stored in the
+        source mesh, so it is computed only once.
+        '''
+        values = source.get_deviation(reference)
+        if values is not None:
+            yield 0, values
+            return
+
+        points = source.get_arrays()[0]
+        executor = self.__get_executor__() if len(points) > JobManager.DEVIATION_CHUNK_SIZE else None
+
+        results = compute_deviation(points, reference.get_bvh(), np.asarray(reference.data.face_normals),
+                                    executor=executor, chunk_size=JobManager.DEVIATION_CHUNK_SIZE)
+        chunks = []
+
+        try:
+            for start, chunk in results:
+                chunks.append(chunk)
+                yield start, chunk
+        finally:
+            results.close()
+
+        source.set_deviation(reference, np.concatenate(chunks) if chunks else np.empty(0, dtype=np.float32))
+
+    def slice_mesh(self, mesh: Mesh, normal: np.ndarray, offsets: np.ndarray):
+        '''
+        Intersect a mesh with parallel planes. Dense stacks of planes through large meshes
+        are sliced concurrently in chunks. The results are yielded as tuples of the index
+        of the first plane of each chunk and the results of its planes, see slice_planes().
+        '''
+        vertices, faces = mesh.get_arrays()
+        index = mesh.get_edge_index()
+
+        parallel = len(offsets) > JobManager.SLICE_CHUNK_SIZE and len(faces) >= JobManager.SLICE_MIN_FACES
+        executor = self.__get_executor__() if parallel else None
+
+        yield from slice_mesh(vertices, faces, index, normal, offsets, executor=executor,
+                              chunk_size=JobManager.SLICE_CHUNK_SIZE)
+
+    def shutdown(self, wait: bool = True):
+        '''
+        Shut down the worker processes. Imports which have not been started yet fail.
+        '''
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait, cancel_futures=True)
+                self._executor = None
+
+    def __add_mesh__(self, job, project, path, future):
+        try:
+            (vertices, faces, stats), components, report = future.result()
+            start = time.perf_counter()
+
+            mesh = Mesh(os.path.basename(path), None)
+            mesh.set_arrays(vertices, faces)
+            mesh.set_stats(stats)
+
+            for index, (part, component_stats) in enumerate(components):
+                child = Mesh(f'Component {index + 1}', None)
+                child.set_range(part)
+                child.set_stats(component_stats)
+                mesh.add_child(child)
+
+            timings = {}
+            if report is not None:
+                timings = report.pop('timings')
+                mesh.set_preprocessing(report)
+                log.info(f'Preprocessed {path}: ' + ', '.join(f'{stage} {seconds:.3f}s' for stage, seconds in timings.items()))
+
+            project.add_mesh(mesh)
+
+            timings['add'] = time.perf_counter() - start
+            job.update(ids=[mesh.get_id()], timings=timings)
+
+            if self.metrics is not None:
+                self.metrics.add('imported_meshes')
+                self.metrics.add('imported_faces', len(faces))
+                for stage, seconds in timings.items():
+                    self.metrics.observe('import_stage_seconds', seconds, stage=stage)
+
+        except futures.CancelledError:
+            job.update(error=f'{path}: import cancelled')
+
+        except Exception as e:
+            log.error(f'Import of {path} failed: {e}')
+            job.update(error=f'{path}: {e}')
+
+            if self.metrics is not None:
+                self.metrics.add('import_errors')
+
+    def __create_job__(self, total: int) -> Job:
+        job = Job(total)
+
+        with self._lock:
+            finished = [key for key, other in self.jobs.items() if other.is_finished()]
+            for key in finished[:max(len(finished) - JobManager.MAX_FINISHED_JOBS + 1, 0)]:
+                del self.jobs[key]
+
+            self.jobs[job.get_id()] = job
+
+        return job
+
+    def __get_executor__(self) -> futures.ProcessPoolExecutor:
+        # The pool is created on first use and uses 'spawn' because forking a process
+        # running gRPC threads is unsafe
+        with self._lock:
+            if self._executor is None:
+                self._executor = futures.ProcessPoolExecutor(max_workers=self.max_workers,
+                                                             mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+
+class WorkerPool:
+    '''
+    Workers running the CPU heavy work of one or more projects: a JobManager with worker
+    processes for imports and deviation analyses and a bounded pool of threads for
+    requests like mesh encoding and spatial queries. Requests exceeding the thread pool
+    size wait on the event loop for a free thread instead of queueing up in the pool.
+
+    A project with its own pool does not compete with other projects for workers, so a
+    long import or analysis in one project does not delay the requests of another.
+    '''
+
+    def __init__(self, import_workers: int = None, compute_workers: int = None, pipeline: Pipeline = None,
+                 metrics=None, name: str = 'compute'):
+        '''
+        Args:
+            import_workers (int): Number of worker processes, by default the number of CPUs.
+            compute_workers (int): Number of threads, by default the number of CPUs.
+            pipeline (Pipeline): Preprocessing applied to imported meshes, see JobManager.
+            metrics (Metrics): Registry recording the imports, see JobManager.
+            name (str): Prefix of the thread names.
+        '''
+        self.jobs = JobManager(max_workers=import_workers, pipeline=pipeline, metrics=metrics)
+        self.compute_workers = compute_workers or os.cpu_count()
+
+        self._executor = futures.ThreadPoolExecutor(max_workers=self.compute_workers, thread_name_prefix=name)
+        self._slots = asyncio.Semaphore(self.compute_workers)
+
+    async def run(self, function, *args):
+        '''
+        Run a CPU heavy function in the thread pool without blocking the event loop.
+        '''
+        async with self._slots:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    async def iterate(self, generator):
+        '''
+        Iterate over a generator whose items are computed in the thread pool. When the
+        iteration ends or is cancelled, the generator is closed in the thread pool as well,
+        after the item being computed is done, so its cleanup never blocks the event loop.
+        '''
+        pending = None
+
+        try:
+            while True:
+                pending = asyncio.ensure_future(self.run(next, generator, None))
+                item = await asyncio.shield(pending)
+                if item is None:
+                    return
+                yield item
+
+        finally:
+            if pending is not None and not pending.done():
+                await asyncio.wait([pending])
+            await self.run(generator.close)
+
+    def warm_up(self):
+        '''
+        Start the worker processes, see JobManager.warm_up().
+        '''
+        self.jobs.warm_up()
+
+    def shutdown(self, wait: bool = True):
+        '''
+        Stop the threads and the worker processes. Pending work is cancelled, running work
+        is finished in the background unless waiting for it.
+        '''
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+        self.jobs.shutdown(wait=wait)
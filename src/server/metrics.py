@@ -0,0 +1,470 @@
+#
+# metrics.py - Server metrics and profiling
+#
+# Counters, gauges and latency histograms of the RPCs and of the work done on their
+# behalf, a gRPC server interceptor recording each call and an opt-in sampling profiler
+# capturing the stacks of slow requests.
+#
+
+import asyncio
+import bisect
+import grpc
+import http.server
+import math
+import os
+import sys
+import threading
+import time
+
+from collections import deque
+from contextlib import contextmanager
+
+
+# Upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    '''
+    Histogram with fixed bucket bounds. Quantiles are estimated by linear interpolation
+    within the bucket containing them.
+    '''
+
+    __slots__ = ('bounds', 'counts', 'count', 'sum')
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # The last bucket has no upper bound
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        '''
+        Estimate the q-quantile of the observed values. Values beyond the last bound are
+        reported as the last bound.
+        '''
+        if self.count == 0:
+            return 0.0
+
+        rank = q * self.count
+        total = 0
+        for index, count in enumerate(self.counts):
+            if count and total + count >= rank:
+                if index == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[index - 1] if index else 0.0
+                return lower + (self.bounds[index] - lower) * (rank - total) / count
+            total += count
+
+        return self.bounds[-1]
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': dict(zip([str(bound) for bound in self.bounds] + ['+Inf'], self.counts))
+        }
+
+
+class Metrics:
+    '''
+    Registry of named counters, gauges and histograms. Each value is identified by its
+    name and its labels, given as keyword arguments.
+    '''
+
+    def __init__(self):
+        self.start_time = time.time()
+
+        self._counters = {}  # (name, labels) -> value
+        self._gauges = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> Histogram
+        self._lock = threading.Lock()
+
+    def add(self, name: str, value: float = 1, **labels):
+        '''
+        Increment a counter.
+        '''
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def adjust(self, name: str, delta: float, **labels):
+        '''
+        Change a gauge by the given amount.
+        '''
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + delta
+
+    def observe(self, name: str, value: float, **labels):
+        '''
+        Add a value to a histogram.
+        '''
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        '''
+        Context manager adding the time spent in it to a histogram.
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> dict:
+        '''
+        Get all values as a dictionary with the 'uptime' in seconds and the 'counters',
+        'gauges' and 'histograms' by name, each a list of their labels and values.
+        '''
+        def group(values: dict, convert=lambda value: value) -> dict:
+            result = {}
+            for (name, labels), value in sorted(values.items(), key=lambda item: item[0]):
+                result.setdefault(name, []).append({'labels': dict(labels), 'value': convert(value)})
+            return result
+
+        with self._lock:
+            return {
+                'uptime': time.time() - self.start_time,
+                'counters': group(self._counters),
+                'gauges': group(self._gauges),
+                'histograms': group(self._histograms, Histogram.to_dict)
+            }
+
+    def prometheus(self, gauges: dict = None, prefix: str = 'zinspector_') -> str:
+        '''
+        Get all values in the Prometheus text exposition format.
+
+        Args:
+            gauges (dict): Additional unlabeled gauges by name, like the statistics of
+                the caches, see flatten().
+            prefix (str): Prefix of the metric names.
+        '''
+        lines = []
+
+        def sample(name: str, labels, value):
+            text = ','.join(f'{key}="{Metrics.__escape__(value)}"' for key, value in labels)
+            lines.append(f'{prefix}{name}{{{text}}} {value}' if text else f'{prefix}{name} {value}')
+
+        def family(values: dict, kind: str, suffix: str = ''):
+            names = sorted({name for name, _ in values})
+            for name in names:
+                lines.append(f'# TYPE {prefix}{name}{suffix} {kind}')
+                for (other, labels), value in sorted(values.items(), key=lambda item: item[0]):
+                    if other != name:
+                        continue
+                    if kind == 'histogram':
+                        total = 0
+                        for bound, count in zip(list(value.bounds) + ['+Inf'], value.counts):
+                            total += count
+                            sample(f'{name}_bucket', labels + (('le', bound),), total)
+                        sample(f'{name}_sum', labels, value.sum)
+                        sample(f'{name}_count', labels, value.count)
+                    else:
+                        sample(f'{name}{suffix}', labels, value)
+
+        with self._lock:
+            family(self._counters, 'counter', '_total')
+            family(self._gauges, 'gauge')
+            family(self._histograms, 'histogram')
+
+        family({(name, ()): value for name, value in (gauges or {}).items()}, 'gauge')
+
+        lines.append(f'# TYPE {prefix}uptime_seconds gauge')
+        sample('uptime_seconds', (), time.time() - self.start_time)
+
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def __escape__(value) -> str:
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def flatten(stats: dict, prefix: str = '') -> dict:
+    '''
+    Flatten nested statistics into a dictionary of their numeric values, named by their
+    path joined with underscores.
+    '''
+    values = {}
+
+    for key, value in (stats or {}).items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            values.update(flatten(value, f'{name}_'))
+        elif isinstance(value, (bool, int, float)) and not math.isnan(value):
+            values[name] = float(value)
+
+    return values
+
+
+class MetricsInterceptor(grpc.aio.ServerInterceptor):
+    '''
+    Server interceptor recording the calls, the status codes, the calls in flight, the
+    latency and the number of streamed messages of each RPC. Streaming calls last until
+    their last message has been sent.
+
+    If a profiler is given, the calls of all methods except the excluded ones are
+    reported to it.
+    '''
+
+    # Long lived streams which would keep the profiler sampling all the time
+    PROFILER_EXCLUDE = ('WatchObjectTree', 'WatchJob')
+
+    def __init__(self, metrics: Metrics, profiler: 'SamplingProfiler' = None):
+        self.metrics = metrics
+        self.profiler = profiler
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        if handler is None:
+            return None
+
+        method = handler_call_details.method.rsplit('/', 1)[-1]
+
+        if handler.unary_unary is not None:
+            return grpc.unary_unary_rpc_method_handler(self.__unary__(method, handler.unary_unary),
+                                                       request_deserializer=handler.request_deserializer,
+                                                       response_serializer=handler.response_serializer)
+        if handler.unary_stream is not None:
+            return grpc.unary_stream_rpc_method_handler(self.__stream__(method, handler.unary_stream),
+                                                        request_deserializer=handler.request_deserializer,
+                                                        response_serializer=handler.response_serializer)
+
+        # The service has no client streaming methods
+        return handler
+
+    def __unary__(self, method: str, behavior):
+        async def wrapper(request, context):
+            start = self.__begin__(method)
+            error = None
+            try:
+                return await behavior(request, context)
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                self.__end__(method, start, context, error, 1)
+
+        return wrapper
+
+    def __stream__(self, method: str, behavior):
+        async def wrapper(request, context):
+            start = self.__begin__(method)
+            error = None
+            messages = 0
+            try:
+                async for response in behavior(request, context):
+                    messages += 1
+                    yield response
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                self.__end__(method, start, context, error, messages)
+
+        return wrapper
+
+    def __begin__(self, method: str) -> float:
+        start = time.perf_counter()
+        self.metrics.adjust('rpc_in_flight', 1, method=method)
+
+        if self.profiler is not None and method not in MetricsInterceptor.PROFILER_EXCLUDE:
+            self.profiler.begin(start)
+
+        return start
+
+    def __end__(self, method: str, start: float, context, error: BaseException, messages: int):
+        elapsed = time.perf_counter() - start
+
+        if isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+            code = grpc.StatusCode.CANCELLED.name
+        else:
+            code = context.code()
+            if isinstance(code, grpc.StatusCode):
+                code = code.name
+            elif code is None or code == 0:
+                code = grpc.StatusCode.UNKNOWN.name if error is not None else grpc.StatusCode.OK.name
+            else:
+                code = next((status.name for status in grpc.StatusCode if status.value[0] == code), str(code))
+
+        self.metrics.adjust('rpc_in_flight', -1, method=method)
+        self.metrics.add('rpc_calls', method=method, code=code)
+        self.metrics.add('rpc_messages_sent', messages, method=method)
+        self.metrics.observe('rpc_latency_seconds', elapsed, method=method)
+
+        if self.profiler is not None and method not in MetricsInterceptor.PROFILER_EXCLUDE:
+            self.profiler.end(method, start, elapsed)
+
+
+class SamplingProfiler:
+    '''
+    Opt-in sampling profiler for slow requests.
+
+    While requests are in flight, a background thread records the stacks of all other
+    threads at a fixed interval. When a request takes at least the threshold, the
+    samples taken during it are written into the directory in the collapsed stack
+    format read by flame graph tools, one line per distinct stack with its number of
+    samples. The requests share the event loop and the worker threads, so a profile
+    also contains the work done for concurrent requests.
+    '''
+
+    def __init__(self, threshold: float, directory: str, interval: float = 0.005, max_samples: int = 20000,
+                 max_profiles: int = 100):
+        '''
+        Args:
+            threshold (float): Minimum duration of the requests which are profiled in seconds.
+            directory (str): Directory the profiles are written to, created if needed.
+            interval (float): Time between two samples in seconds.
+            max_samples (int): Maximum number of samples kept, which limits the length of
+                the profiles.
+            max_profiles (int): Number of profiles listed by get_profiles().
+        '''
+        self.threshold = threshold
+        self.directory = directory
+        self.interval = interval
+
+        self._samples = deque(maxlen=max_samples)  # (time, [(thread name, collapsed stack)])
+        self._starts = []  # Start times of the requests in flight
+        self._profiles = deque(maxlen=max_profiles)
+        self._thread = None
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def begin(self, start: float):
+        '''
+        Record the start of a request at the given time.perf_counter() value, which starts
+        sampling if needed.
+        '''
+        with self._condition:
+            self._starts.append(start)
+
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self.__run__, name='profiler', daemon=True)
+                self._thread.start()
+
+            self._condition.notify()
+
+    def end(self, method: str, start: float, elapsed: float):
+        '''
+        Record the end of a request started at the given time and write its profile if it
+        took at least the threshold.
+        '''
+        with self._condition:
+            self._starts.remove(start)
+
+            samples = [stacks for moment, stacks in self._samples if moment >= start] if elapsed >= self.threshold else None
+
+            # Samples older than all requests in flight are no longer needed
+            oldest = min(self._starts, default=math.inf)
+            while self._samples and self._samples[0][0] < oldest:
+                self._samples.popleft()
+
+        if samples:
+            self.__write__(method, elapsed, samples)
+
+    def get_profiles(self) -> list:
+        '''
+        Get the most recent profiles as dictionaries with the 'method', the duration in
+        'seconds', the number of 'samples' and the 'file' name.
+        '''
+        with self._condition:
+            return list(self._profiles)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+        if self._thread is not None:
+            self._thread.join()
+
+    def __run__(self):
+        own = threading.get_ident()
+
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._starts or self._closed)
+                if self._closed:
+                    return
+
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = [(names.get(ident, str(ident)), SamplingProfiler.__collapse__(frame))
+                      for ident, frame in sys._current_frames().items() if ident != own]
+
+            with self._condition:
+                self._samples.append((time.perf_counter(), stacks))
+
+            time.sleep(self.interval)
+
+    def __write__(self, method: str, elapsed: float, samples: list):
+        counts = {}
+        for stacks in samples:
+            for name, stack in stacks:
+                key = f'{name};{stack}'
+                counts[key] = counts.get(key, 0) + 1
+
+        os.makedirs(self.directory, exist_ok=True)
+        filename = os.path.join(self.directory, f'{method}-{time.strftime("%Y%m%d-%H%M%S")}-{time.perf_counter_ns() % 1000000:06d}.folded')
+
+        with open(filename, 'w') as f:
+            for stack, count in sorted(counts.items()):
+                f.write(f'{stack} {count}\n')
+
+        with self._condition:
+            self._profiles.append({'method': method, 'seconds': elapsed, 'samples': len(samples), 'file': filename})
+
+    @staticmethod
+    def __collapse__(frame) -> str:
+        '''
+        Get the stack of a frame from the outermost call as 'function (file:line)' entries
+        separated by semicolons.
+        '''
+        entries = []
+        while frame is not None:
+            code = frame.f_code
+            entries.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+            frame = frame.f_back
+
+        return ';'.join(reversed(entries))
+
+
+def serve_metrics(port: int, render) -> http.server.ThreadingHTTPServer:
+    '''
+    Serve the text returned by a function at /metrics over HTTP in a background thread,
+    so the metrics can be scraped by Prometheus. Returns the server, which is stopped by
+    calling its shutdown() method.
+    '''
+    class Handler(http.server.BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+
+            body = render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('', port), Handler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
@@ -0,0 +1,828 @@
+#
+# service.py - Implementation of the ZInspector service
+#
+# Imports the geometry and storage modules, so it is loaded by zinspector.py after the
+# server port has been bound.
+#
+
+import asyncio
+import grpc
+import h5py
+import json
+import logging
+import numpy as np
+import os
+import trimesh
+import zinspector_pb2
+import zinspector_pb2_grpc
+
+from cache import PayloadCache, iter_chunks, payload_tag
+from config import Configuration
+from encoding import ENCODINGS, encode_mesh
+from jobs import WorkerPool
+from metrics import Metrics, SamplingProfiler, flatten
+from elements.mesh import Mesh
+from elements.project import Project
+from elements.object import Object, ObjectIdDatabase
+from elements.preprocess import DEFAULT_STEPS, Pipeline
+from elements.tree import ObjectTree
+
+log = logging.getLogger(__name__)
+
+
+class Root (Object):
+    '''
+    The root object of the project database
+    '''
+
+    __slots__ = ('projects',)
+
+    def __init__(self):
+        super().__init__('Root')
+        self.projects = []
+
+    def get_children(self):
+        return self.projects
+
+    def add_project(self, project):
+        project.set_parent(self)
+        self.projects.append(project)
+        self.__notify__('add', project)
+
+    def remove_project(self, project):
+        self.projects.remove(project)
+        project.set_parent(None)
+        self.__notify__('remove', project)
+
+    def find_project(self, filename: str):
+        '''
+        Get the open project stored in the given file or None.
+        '''
+        for project in self.projects:
+            if project.filename is not None and os.path.exists(filename) and os.path.samefile(project.filename, filename):
+                return project
+
+        return None
+
+    def __load__(self, parent: h5py.Group):
+        super().__load__(parent)
+
+    def __save__(self, parent: h5py.Group):
+        super().__save__(parent)
+
+
+class ZInspector(zinspector_pb2_grpc.ZInspectorServicer):
+    '''
+    Implementation of the ZInspector service
+
+    The service runs on an asyncio event loop. Cheap metadata calls are answered
+    directly on the loop, while CPU heavy work like mesh encoding or spatial queries
+    is run in a bounded thread pool. Requests exceeding the pool size wait on the
+    loop for a free worker instead of queueing up in the pool. Streaming responses
+    are generated only as fast as the client consumes them, because each message is
+    produced after the previous one has been accepted by the transport.
+
+    Projects share one WorkerPool, unless they have been created or opened isolated.
+    An isolated project has its own worker processes and threads, which run all
+    imports, analyses and heavy requests of its meshes.
+    '''
+
+    # Top level object
+    root = Root()
+
+    # Index of the object tree with cached serializations and change deltas
+    tree = ObjectTree(root)
+
+    # Encoded mesh payloads, keyed by (mesh id, mesh version, encoding, faces). Large payloads
+    # are spilled into memory mapped temporary files.
+    cache = PayloadCache(Configuration.MESH_CACHE_SIZE,
+                         spill_size=Configuration.MESH_SPILL_SIZE,
+                         spill_budget=Configuration.MESH_SPILL_CACHE_SIZE)
+
+    def __init__(self, chunk_size=Configuration.MESH_DATA_CHUNK_SIZE, import_workers=None, compute_workers=None,
+                 preprocess=Configuration.PREPROCESS_STEPS, metrics: Metrics = None, profiler: SamplingProfiler = None):
+        super().__init__()
+        self.chunk_size = chunk_size
+        self.metrics = metrics if metrics is not None else Metrics()  # See metrics.py
+        self.profiler = profiler
+
+        steps = DEFAULT_STEPS if preprocess is None else preprocess
+        self.pipeline = Pipeline(steps, Configuration.MERGE_TOLERANCE, Configuration.MIN_COMPONENT_FACES) if steps else None
+        self.workers = WorkerPool(import_workers, compute_workers or Configuration.COMPUTE_WORKERS,
+                                  pipeline=self.pipeline, metrics=self.metrics)
+
+        # Project id -> WorkerPool of the isolated projects
+        self.project_workers = {}
+
+        # Cached payloads of replaced or removed geometry are dropped right away
+        Object.observers.append(self.__on_change__)
+
+    def warm_up(self):
+        '''
+        Prepare the import and export paths, so the first requests do not wait for modules
+        being loaded: the import worker processes are started and a small mesh is encoded
+        in each encoding.
+        '''
+        self.workers.warm_up()
+
+        box = trimesh.creation.box()
+        for encoding in ENCODINGS:
+            encode_mesh(box, encoding)
+
+    def shutdown(self):
+        '''
+        Stop the worker threads and processes.
+        '''
+        for workers in [self.workers, *self.project_workers.values()]:
+            workers.shutdown()
+
+        if self.__on_change__ in Object.observers:
+            Object.observers.remove(self.__on_change__)
+
+    async def GetObjectTree(self, request, context):
+        '''
+        Get the object tree for a project in a JSON format
+        beginning at a given object
+        '''
+
+        log.debug(f'GetObjectTree: {request.id}')
+
+        tree = '[]'
+
+        try:
+            if request.id:
+                tree = ZInspector.tree.get_json(ObjectIdDatabase.get(request.id))
+            else:
+                tree = ZInspector.tree.get_json()
+
+        except Exception as e:
+            self.__handle_exception__(e, context, grpc.StatusCode.NOT_FOUND)
+
+        return zinspector_pb2.JSONResponse(json=tree)
+
+    async def WatchObjectTree(self, request, context):
+        '''
+        Stream the changes of the object tree
+        '''
+
+        log.debug(f'WatchObjectTree: {request.revision}')
+
+        tree = ZInspector.tree
+        revision = request.revision
+
+        while True:
+            deltas = tree.get_deltas(revision) if revision > 0 else None
+
+            if deltas is None:
+                revision, snapshot = tree.get_snapshot()
+                yield zinspector_pb2.ObjectTreeDelta(revision=revision,
+                                                     action='reset',
+                                                     id=ZInspector.root.get_id(),
+                                                     label=ZInspector.root.get_name(),
+                                                     type=ZInspector.root.__type__(),
+                                                     json=snapshot)
+            else:
+                for delta in deltas:
+                    revision = delta['revision']
+                    yield zinspector_pb2.ObjectTreeDelta(**delta)
+
+            await self.__wait__(tree, revision)
+
+    async def GetObjects(self, request, context):
+        '''
+        Get a list of objects in the project database
+        '''
+
+        log.debug(f'GetObjects, parent={request.id}')
+
+        ids = []
+
+        try:
+
+            if request.id:
+                parent = ObjectIdDatabase.get(request.id)
+            else:
+                parent = ZInspector.root
+
+            ids = [child.get_id() for child in ObjectIdDatabase.find(parent_id=parent.get_id())]
+
+        except Exception as e:
+            self.__handle_exception__(e, context, grpc.StatusCode.NOT_FOUND)
+
+        log.debug(f'Result: {ids}')
+
+        return zinspector_pb2.IdResponse(ids=ids)
+
+    async def GetName(self, request, context):
+        '''
+        Get the name of an object
+        '''
+
+        log.debug(f'GetName: {request.id}')
+
+        name = ''
+
+        try:
+            obj = ObjectIdDatabase.get(request.id)
+            name = obj.get_name()
+        except Exception as e:
+            self.__handle_exception__(e, context, grpc.StatusCode.NOT_FOUND)
+
+        return zinspector_pb2.NameResponse(name=name)
+
+    async def GetObjectInfo(self, request, context):
+        '''
+        Get the metadata of many objects at once
+        '''
+
+        log.debug(f'GetObjectInfo: {len(request.ids)} ids, parent={request.parent}')
+
+        objects = []
+
+        try:
+            if request.parent:
+                parent = ObjectIdDatabase.get(request.parent)
+                ids = [child.get_id() for child in ObjectIdDatabase.find(parent_id=parent.get_id())]
+            else:
+                ids = list(request.ids)
+
+            # The statistics of meshes loaded from old project files may need their geometry,
+            # so the metadata is collected in the worker pools
+            found = ObjectIdDatabase.get_many(ids)
+            infos = await asyncio.gather(*(self.__run__(obj, obj.get_info) for obj in found if obj is not None))
+            infos = iter(infos)
+
+            for obj_id, obj in zip(ids, found):
+                if obj is None:
+                    objects.append(zinspector_pb2.ObjectInfo(id=obj_id, found=False))
+                else:
+                    info = next(infos)
+                    info['name'] = info['name'] or ''
+                    objects.append(zinspector_pb2.ObjectInfo(found=True, **info))
+
+        except Exception as e:
+            self.__handle_exception__(e, context, grpc.StatusCode.NOT_FOUND)
+
+        return zinspector_pb2.ObjectInfoResponse(objects=objects)
+
+    async def CreateProject(self, request, context):
+        '''
+        Create a new project
+        '''
+
+        log.info(f'Create project: {request.name}')
+
+        ids = []
+
+        try:
+            project = Project(request.name)
+            if request.isolated:
+                self.__isolate__(project)
+
+            ZInspector.root.add_project(project)
+            ids = [project.get_id()]
+
+        except Exception as e:
+            self.__handle_exception__(e, context, grpc.StatusCode.NOT_FOUND)
+
+        return zinspector_pb2.IdResponse(ids=ids)
+
+    async def OpenProject(self, request, context):
+        '''
+        Open a project file. If the file is already open, the id of its project is
+        returned.
+        '''
+
+        log.info(f'Open project: {request.path}')
+
+        ids = []
+
+        try:
+            project = ZInspector.root.find_project(request.path)
+
+            if project is None:
+                project = Project('')
+                workers = self.__isolate__(project) if request.isolated else self.workers
+
+                try:
+                    with self.metrics.timer('project_load_seconds', lazy=str(request.lazy).lower()):
+                        await workers.run(project.load, request.path, request.lazy)
+                except BaseException:
+                    self.__release__(project)
+                    raise
+
+                ZInspector.root.add_project(project)
+
+            ids = [project.get_id()]
+
+        except Exception as e:
+            self.__handle_exception__(e, context, grpc.StatusCode.NOT_FOUND)
+
+        return zinspector_pb2.IdResponse(ids=ids)
+
+    async def SaveProject(self, request, context):
+        '''
+        Save a project, by default incrementally into the file it was opened from or last
+        saved to
+        '''
+
+        log.info(f'Save project: {request.id} {request.path}')
+
+        try:
+            project = self.__get_project__(request.id)
+            path = request.path or project.filename
+            if not path:
+                raise ValueError(f'Project {request.id} has no file yet, a path is required')
+
+            with self.metrics.timer('project_save_seconds', incremental=str(not request.full).lower()):
+                await self.__run__(project, project.save, path, not request.full)
+
+        except ValueError as e:
+            self.__handle_exception__(e, context, grpc.StatusCode.INVALID_ARGUMENT)
+        except Exception as e:
+            self.__handle_exception__(e, context, grpc.StatusCode.NOT_FOUND)
+
+        return zinspector_pb2.EmptyResponse()
+
+    async def CloseProject(self, request, context):
+        '''
+        Close a project, discarding unsaved changes, and stop its workers if it is
+        isolated. Removing the project from the root discards the cached payloads of its
+        meshes, see __on_change__().
+        '''
+
+        log.info(f'Close project: {request.id}')
+
+        try:
+            project = self.__get_project__(request.id)
+            ZInspector.root.remove_project(project)
+            self.__release__(project)
+
+        except Exception as e:
+            self.__handle_exception__(e, context, grpc.StatusCode.NOT_FOUND)
+
+        return zinspector_pb2.EmptyResponse()
+
+    async def ImportMesh(self, request, context):
+        '''
+        Start the import of a mesh from a file into a project
+        '''
+
+        log.info(f'Import mesh: {request.project}/{request.path}')
+
+        return await self.__import_meshes__(request.project, [request.path], context)
+
+    async def ImportMeshes(self, request, context):
+        '''
+        Start the concurrent import of multiple meshes into a project
+        '''
+
+        log.info(f'Import meshes: {request.project}/{list(request.paths)}')
+
+        return await self.__import_meshes__(request.project, request.paths, context)
+
+    async def WatchJob(self, request, context):
+        '''
+        Stream the status of a job until it is finished
+        '''
+
+        log.debug(f'Watch job: {request.id}')
+
+        try:
+            job = self.__get_job__(request.id)
+            revision = -1
+
+            while True:
+                status = job.get_status()
+
+                if status['revision'] != revision:
+                    revision = status['revision']
+                    yield zinspector_pb2.JobStatus(id=status['id'],
+                                                   state=status['state'],
+                                                   progress=status['progress'],
+                                                   ids=status['ids'],
+                                                   message=status['message'],
+                                                   timings=status['timings'])
+
+                if job.is_finished():
+                    break
+
+                await self.__wait__(job, revision, timeout=Configuration.JOB_STATUS_INTERVAL)
+
+        except Exception as e:
+            self.__handle_exception__(e, context, grpc.StatusCode.NOT_FOUND)
+
+    async def GetMeshData(self, request, context):
+        '''
+        Get the data of a mesh in the requested encoding, or a byte range of it
+        '''
+
+        log.debug(f'Get mesh data: {request.id}')
+
+        try:
+            encoding = request.encoding or Configuration.MESH_ENCODING
+            if encoding not in ENCODINGS:
+                raise ValueError(f'Unknown mesh encoding "{encoding}", expected one of {", ".join(ENCODINGS)}')
+            if request.offset < 0 or request.length < 0:
+                raise ValueError('Offset and length of the mesh data range must not be negative')
+
+            mesh = self.__get_mesh__(request.id)
+            faces, etag, data = await self.__run__(mesh, self.__encode_mesh__, mesh, request.max_faces, encoding)
+
+            size = len(data)
+            if request.offset > size:
+                raise ValueError(f'Offset {request.offset} exceeds the mesh data size {size}')
+
+            # The client already has this payload
+            if request.etag == etag:
+                self.metrics.add('mesh_data_not_modified', encoding=encoding)
+                yield zinspector_pb2.MeshChunk(format=encoding, index=0, faces=faces, offset=request.offset,
+                                               size=size, etag=etag, not_modified=True)
+                return
+
+            stop = request.offset + request.length if request.length else size
+
+            step = -1
+            for step, chunk in enumerate(iter_chunks(data, self.chunk_size, request.offset, stop)):
+                self.metrics.add('mesh_data_bytes', len(chunk), encoding=encoding)
+                yield zinspector_pb2.MeshChunk(format=encoding,
+                                               index=step,
+                                               data=chunk,
+                                               faces=faces,
+                                               offset=request.offset + step * self.chunk_size,
+                                               size=size,
+                                               etag=etag if step == 0 else '')
+
+            # Even an empty range reports the size and the tag of the payload
+            if step < 0:
+                yield zinspector_pb2.MeshChunk(format=encoding, index=0, faces=faces, offset=request.offset,
+                                               size=size, etag=etag)
+
+        except ValueError as e:
+            self.__handle_exception__(e, context, grpc.StatusCode.INVALID_ARGUMENT)
+        except Exception as e:
+            self.__handle_exception__(e, context, grpc.StatusCode.NOT_FOUND)
+
+    async def GetMemoryStats(self, request, context):
+        '''
+        Get the residency statistics of the mesh geometry and of the encoded mesh cache
+        in a JSON format
+        '''
+        log.debug('GetMemoryStats')
+
+        return zinspector_pb2.JSONResponse(json=json.dumps(self.__memory_stats__()))
+
+    async def GetServerStats(self, request, context):
+        '''
+        Get the metrics of the server together with the memory statistics and the recent
+        profiles of slow requests, either in a JSON format or in the Prometheus text format
+        '''
+        log.debug(f'GetServerStats: {request.format}')
+
+        data = ''
+
+        try:
+            if request.format in ('', 'json'):
+                data = json.dumps({
+                    'metrics': self.metrics.snapshot(),
+                    'memory': self.__memory_stats__(),
+                    'profiles': self.profiler.get_profiles() if self.profiler is not None else []
+                })
+            elif request.format == 'prometheus':
+                data = self.__prometheus__()
+            else:
+                raise ValueError(f'Unknown stats format "{request.format}", expected json or prometheus')
+
+        except Exception as e:
+            self.__handle_exception__(e, context, grpc.StatusCode.INVALID_ARGUMENT)
+
+        return zinspector_pb2.ServerStatsResponse(format=request.format or 'json', data=data)
+
+    async def GetMeshLevels(self, request, context):
+        '''
+        Get the face counts of the levels of detail of a mesh
+        '''
+
+        log.debug(f'Get mesh levels: {request.id}')
+
+        faces = []
+
+        try:
+            mesh = self.__get_mesh__(request.id)
+            faces = await self.__run__(mesh, mesh.get_levels)
+        except ValueError as e:
+            self.__handle_exception__(e, context, grpc.StatusCode.INVALID_ARGUMENT)
+        except Exception as e:
+            self.__handle_exception__(e, context, grpc.StatusCode.NOT_FOUND)
+
+        return zinspector_pb2.MeshLevelsResponse(faces=faces)
+
+    async def RayCast(self, request, context):
+        '''
+        Intersect a batch of rays with a mesh
+        '''
+
+        log.debug(f'Ray cast: {request.id}')
+
+        response = zinspector_pb2.RayCastResponse()
+
+        try:
+            mesh = self.__get_mesh__(request.id)
+            origins = self.__unpack_vectors__(request.origins)
+            directions = self.__unpack_vectors__(request.directions)
+
+            if len(origins) != len(directions):
+                raise ValueError(f'Number of ray origins ({len(origins)}) and directions ({len(directions)}) differ')
+
+            distances, faces = await self.__run__(mesh, mesh.ray_cast, origins, directions)
+            points = origins + directions * np.where(np.isfinite(distances), distances, np.nan)[:, None]
+
+            response = zinspector_pb2.RayCastResponse(distances=distances.astype('<f4').tobytes(),
+                                                      faces=faces.astype('<i4').tobytes(),
+                                                      points=points.astype('<f4').tobytes())
+
+        except ValueError as e:
+            self.__handle_exception__(e, context, grpc.StatusCode.INVALID_ARGUMENT)
+        except Exception as e:
+            self.__handle_exception__(e, context, grpc.StatusCode.NOT_FOUND)
+
+        return response
+
+    async def ClosestPoint(self, request, context):
+        '''
+        Find the closest points on the surface of a mesh for a batch of query points
+        '''
+
+        log.debug(f'Closest point: {request.id}')
+
+        response = zinspector_pb2.ClosestPointResponse()
+
+        try:
+            mesh = self.__get_mesh__(request.id)
+            points, distances, faces = await self.__run__(mesh, mesh.closest_point, self.__unpack_vectors__(request.points))
+
+            response = zinspector_pb2.ClosestPointResponse(points=points.astype('<f4').tobytes(),
+                                                           distances=distances.astype('<f4').tobytes(),
+                                                           faces=faces.astype('<i4').tobytes())
+
+        except ValueError as e:
+            self.__handle_exception__(e, context, grpc.StatusCode.INVALID_ARGUMENT)
+        except Exception as e:
+            self.__handle_exception__(e, context, grpc.StatusCode.NOT_FOUND)
+
+        return response
+
+    async def GetDeviation(self, request, context):
+        '''
+        Stream the signed distances of the vertices of a mesh to a reference mesh
+        '''
+
+        log.debug(f'Get deviation: {request.source} -> {request.reference}')
+
+        try:
+            source, reference = self.__get_mesh__(request.source), self.__get_mesh__(request.reference)
+            workers = self.__get_workers__(source)
+            vertices = len((await workers.run(source.get_arrays))[0])
+            values_per_chunk = max(self.chunk_size // 4, 1)
+            step = 0
+
+            # The chunks are computed one after another in the worker pool of the source mesh
+            chunks = workers.iterate(workers.jobs.compute_deviation(source, reference))
+
+            try:
+                async for start, values in chunks:
+                    for offset in range(0, len(values), values_per_chunk):
+                        yield zinspector_pb2.DeviationChunk(index=step,
+                                                            offset=start + offset,
+                                                            vertices=vertices,
+                                                            data=values[offset:offset + values_per_chunk].astype('<f4').tobytes())
+                        step += 1
+            finally:
+                await chunks.aclose()
+
+        except ValueError as e:
+            self.__handle_exception__(e, context, grpc.StatusCode.INVALID_ARGUMENT)
+        except Exception as e:
+            self.__handle_exception__(e, context, grpc.StatusCode.NOT_FOUND)
+
+    async def GetSlices(self, request, context):
+        '''
+        Stream the cross sections of a mesh with parallel planes
+        '''
+
+        log.debug(f'Get slices: {request.id}')
+
+        try:
+            if request.offsets:
+                offsets = np.array(request.offsets, dtype=np.float64)
+            else:
+                offsets = request.start + request.step * np.arange(max(request.count, 0), dtype=np.float64)
+
+            if len(request.normal) != 3:
+                raise ValueError('The plane normal must have 3 components')
+            if not 0 < len(offsets) <= Configuration.SLICE_MAX_PLANES:
+                raise ValueError(f'Number of planes must be between 1 and {Configuration.SLICE_MAX_PLANES}')
+
+            mesh = self.__get_mesh__(request.id)
+            workers = self.__get_workers__(mesh)
+            self.metrics.add('slice_planes', len(offsets))
+
+            # The chunks of planes are computed one after another in the worker pool
+            chunks = workers.iterate(workers.jobs.slice_mesh(mesh, np.array(request.normal, dtype=np.float64), offsets))
+
+            try:
+                async for start, planes in chunks:
+                    for index, (points, lengths, closed) in enumerate(planes, start):
+                        for data in self.__pack_polylines__(points, lengths, closed):
+                            yield zinspector_pb2.SliceChunk(index=index, offset=offsets[index], planes=len(offsets), **data)
+            finally:
+                await chunks.aclose()
+
+        except ValueError as e:
+            self.__handle_exception__(e, context, grpc.StatusCode.INVALID_ARGUMENT)
+        except Exception as e:
+            self.__handle_exception__(e, context, grpc.StatusCode.NOT_FOUND)
+
+    def __pack_polylines__(self, points: np.ndarray, lengths: np.ndarray, closed: np.ndarray):
+        '''
+        Pack the polylines of a plane into chunks of whole polylines of at most the chunk
+        size, unless a single polyline exceeds it. Yields the fields of each chunk.
+        '''
+        bounds = np.concatenate([[0], np.cumsum(lengths)])
+
+        def pack(first, stop):
+            return {'points': points[bounds[first]:bounds[stop]].astype('<f4').tobytes(),
+                    'lengths': lengths[first:stop].astype('<i4').tobytes(),
+                    'closed': closed[first:stop].astype(np.uint8).tobytes()}
+
+        first, size = 0, 0
+        for polyline, length in enumerate(lengths):
+            polyline_size = int(length) * 12 + 5
+            if polyline > first and size + polyline_size > self.chunk_size:
+                yield pack(first, polyline)
+                first, size = polyline, 0
+            size += polyline_size
+
+        yield pack(first, len(lengths))
+
+    def __encode_mesh__(self, mesh: Mesh, max_faces: int, encoding: str):
+        '''
+        Get the encoded level of detail of a mesh with at most the given number of faces
+        from the cache or encode it. Returns the face count, the content hash and the
+        payload.
+        '''
+        level = mesh.get_level(max_faces)
+        faces = len(level.faces)
+        key = (mesh.get_id(), mesh.get_version(), encoding, faces)
+
+        def encode():
+            with self.metrics.timer('mesh_encode_seconds', encoding=encoding):
+                return encode_mesh(level, encoding)
+
+        data = ZInspector.cache.get_or_create(key, encode)
+
+        # Payloads exceeding the cache budget are not cached, so their hash is not either
+        etag = ZInspector.cache.get_tag(key) or payload_tag(data)
+
+        return faces, etag, data
+
+    def __on_change__(self, obj: Object, change: str, child: Object = None):
+        '''
+        Discard the cached payloads of meshes whose geometry has been replaced and of all
+        meshes in removed subtrees.
+        '''
+        if change == 'geometry':
+            ZInspector.cache.discard(obj.get_id())
+        elif change == 'remove':
+            stack = [child]
+            while stack:
+                obj = stack.pop()
+                ZInspector.cache.discard(obj.get_id())
+                stack.extend(obj.get_children())
+
+    def __memory_stats__(self) -> dict:
+        '''
+        Get the residency statistics of the mesh geometry and of the encoded mesh cache.
+        '''
+        manager = Mesh.geometry_manager
+        return {
+            'geometry': manager.stats() if manager is not None else None,
+            'cache': ZInspector.cache.stats()
+        }
+
+    def __prometheus__(self) -> str:
+        '''
+        Get the metrics and the memory statistics in the Prometheus text format.
+        '''
+        return self.metrics.prometheus(flatten(self.__memory_stats__()))
+
+    async def __run__(self, obj: Object, function, *args):
+        '''
+        Run a CPU heavy function on behalf of an object in the worker pool of its project
+        without blocking the event loop.
+        '''
+        return await self.__get_workers__(obj).run(function, *args)
+
+    def __get_workers__(self, obj: Object) -> WorkerPool:
+        '''
+        Get the worker pool of the project containing the given object.
+        '''
+        while obj is not None and not isinstance(obj, Project):
+            obj = obj.get_parent()
+
+        return self.project_workers.get(obj.get_id(), self.workers) if obj is not None else self.workers
+
+    def __get_mesh__(self, mesh_id: str) -> Mesh:
+        obj = ObjectIdDatabase.get(mesh_id)
+        if not isinstance(obj, Mesh):
+            raise ValueError(f'Object with UUID {mesh_id} is a {obj.__type__()}, not a mesh.')
+
+        return obj
+
+    def __get_project__(self, project_id: str) -> Project:
+        project = ObjectIdDatabase.get(project_id)
+        if not isinstance(project, Project) or project not in ZInspector.root.projects:
+            raise KeyError(f'Project with UUID {project_id} is not open.')
+
+        return project
+
+    def __get_job__(self, job_id: str):
+        '''
+        Find a job in the shared worker pool or in the pools of the isolated projects.
+        '''
+        for workers in [self.workers, *self.project_workers.values()]:
+            try:
+                return workers.jobs.get(job_id)
+            except KeyError:
+                pass
+
+        raise KeyError(f'Job with UUID {job_id} not found.')
+
+    def __isolate__(self, project: Project) -> WorkerPool:
+        '''
+        Create the worker pool of an isolated project.
+        '''
+        workers = WorkerPool(Configuration.PROJECT_IMPORT_WORKERS, Configuration.PROJECT_COMPUTE_WORKERS,
+                             pipeline=self.pipeline, metrics=self.metrics, name=f'project-{project.get_id()[:8]}')
+        self.project_workers[project.get_id()] = workers
+        self.metrics.adjust('isolated_projects', 1)
+
+        return workers
+
+    def __release__(self, project: Project):
+        '''
+        Stop the worker pool of a project if it is isolated.
+        '''
+        workers = self.project_workers.pop(project.get_id(), None)
+        if workers is not None:
+            workers.shutdown(wait=False)
+            self.metrics.adjust('isolated_projects', -1)
+
+    async def __wait__(self, source, revision: int, timeout: float = None):
+        '''
+        Wait until the revision of a job or of the object tree exceeds the given one or
+        the timeout expires, without blocking the event loop.
+        '''
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+
+        def listener():
+            loop.call_soon_threadsafe(changed.set)
+
+        source.add_listener(listener)
+
+        try:
+            if source.revision <= revision:
+                await asyncio.wait_for(changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            source.remove_listener(listener)
+
+    def __unpack_vectors__(self, data: bytes) -> np.ndarray:
+        '''
+        Unpack a packed little endian float32 array of 3D vectors.
+        '''
+        if len(data) % 12 != 0:
+            raise ValueError('Packed vector arrays must contain 3 float32 values per vector')
+
+        return np.frombuffer(data, dtype='<f4').reshape(-1, 3).astype(np.float64)
+
+    async def __import_meshes__(self, project_id, paths, context):
+        ids = []
+
+        try:
+            project = self.__get_project__(project_id)
+            workers = self.__get_workers__(project)
+            job = await workers.run(workers.jobs.import_meshes, project, list(paths))
+            ids = [job.get_id()]
+
+        except Exception as e:
+            self.__handle_exception__(e, context, grpc.StatusCode.NOT_FOUND)
+
+        return zinspector_pb2.IdResponse(ids=ids)
+
+    def __handle_exception__(self, e, context, status=grpc.StatusCode.UNKNOWN):
+        log.error(f'{e}')
+        context.set_details(str(e))
+        context.set_code(status)
@@ -0,0 +1,99 @@
+import unittest
+import tempfile
+import shutil
+import os
+import h5py
+import numpy as np
+import trimesh
+
+from elements.bvh import BVH, closest_point_on_triangles
+
+
+class TestBVH(unittest.TestCase):
+
+    def setUp(self):
+        self.mesh = trimesh.creation.icosphere(3)
+        self.bvh = BVH.build(self.mesh.vertices, self.mesh.faces)
+        self.rng = np.random.default_rng(0)
+
+        # Create a temporary directory for writing/reading the test data
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        # Remove the temporary directory
+        shutil.rmtree(self.temp_dir)
+
+    def test_build(self):
+        self.assertEqual(sorted(self.bvh.order), list(range(len(self.mesh.faces))))
+        self.assertTrue(np.all(self.bvh.count[self.bvh.left < 0] <= BVH.LEAF_SIZE))
+
+        # The root box is the bounding box of the mesh
+        np.testing.assert_allclose(self.bvh.lower[0], self.mesh.bounds[0])
+        np.testing.assert_allclose(self.bvh.upper[0], self.mesh.bounds[1])
+
+        # The geometry is shared with the mesh instead of being copied
+        self.assertTrue(np.shares_memory(self.bvh.vertices, self.mesh.vertices))
+        self.assertTrue(np.shares_memory(self.bvh.faces, self.mesh.faces))
+
+    def test_ray_cast(self):
+        origins = self.rng.normal(size=(200, 3)) * 3
+        directions = -origins + self.rng.normal(size=(200, 3))
+
+        distances, faces = self.bvh.ray_cast(origins, directions)
+
+        # Compare with testing every ray against every triangle
+        rays = np.repeat(np.arange(len(origins)), len(self.mesh.faces))
+        triangles = np.tile(self.mesh.triangles, (len(origins), 1, 1))
+        expected = BVH.__intersect__(origins[rays], directions[rays], triangles).reshape(len(origins), -1).min(axis=1)
+
+        np.testing.assert_allclose(distances, expected)
+        self.assertTrue(np.all((faces >= 0) == np.isfinite(distances)))
+        self.assertGreater(np.isfinite(distances).sum(), 0)
+
+        # Rays pointing away from the sphere miss it
+        distances, faces = self.bvh.ray_cast([[0, 0, 2]], [[0, 0, 1]])
+        self.assertTrue(np.isinf(distances[0]))
+        self.assertEqual(faces[0], -1)
+
+        # A ray from the center hits the surface at distance 1
+        distances, faces = self.bvh.ray_cast([[0, 0, 0]], [[1, 0, 0]])
+        self.assertAlmostEqual(distances[0], 1.0, places=2)
+
+    def test_closest_point(self):
+        points = self.rng.normal(size=(200, 3))
+        closest, distances, faces = self.bvh.closest_point(points)
+
+        # Compare with testing every point against every triangle
+        pairs = np.repeat(np.arange(len(points)), len(self.mesh.faces))
+        triangles = np.tile(self.mesh.triangles, (len(points), 1, 1))
+        candidates = closest_point_on_triangles(points[pairs], triangles)
+        expected = np.linalg.norm(candidates - points[pairs], axis=1).reshape(len(points), -1).min(axis=1)
+
+        np.testing.assert_allclose(distances, expected)
+        np.testing.assert_allclose(np.linalg.norm(closest - points, axis=1), distances)
+
+        # The closest points lie on the reported faces
+        reported = closest_point_on_triangles(points, self.mesh.triangles[faces])
+        np.testing.assert_allclose(reported, closest, atol=1e-12)
+
+    def test_closest_point_on_triangles(self):
+        triangles = np.array([[[0, 0, 0], [1, 0, 0], [0, 1, 0]]] * 4, dtype=np.float64)
+        points = np.array([[0.2, 0.2, 1], [-1, -1, 0], [1, 1, 0], [0.5, -1, 0]], dtype=np.float64)
+
+        np.testing.assert_allclose(closest_point_on_triangles(points, triangles),
+                                   [[0.2, 0.2, 0], [0, 0, 0], [0.5, 0.5, 0], [0.5, 0, 0]])
+
+    def test_save_and_load(self):
+        temp_file = os.path.join(self.temp_dir, 'test_bvh.h5')
+        with h5py.File(temp_file, 'w') as f:
+            self.bvh.save(f.create_group('bvh'))
+
+        with h5py.File(temp_file, 'r') as f:
+            loaded = BVH.load(f['bvh'], self.mesh.vertices, self.mesh.faces)
+
+        points = self.rng.normal(size=(50, 3))
+        np.testing.assert_array_equal(loaded.closest_point(points)[1], self.bvh.closest_point(points)[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import threading
+import unittest
+
+from cache import PayloadCache, SpilledPayload, iter_chunks, payload_tag
+
+
+class TestPayloadCache(unittest.TestCase):
+
+    def test_get_and_put(self):
+        cache = PayloadCache(100)
+        self.assertIsNone(cache.get(('a', 0)))
+
+        cache.put(('a', 0), b'12345')
+        self.assertEqual(cache.get(('a', 0)), b'12345')
+        self.assertEqual(cache.size, 5)
+
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_lru_eviction(self):
+        cache = PayloadCache(10)
+        cache.put(('a', 0), b'1234')
+        cache.put(('b', 0), b'1234')
+
+        # Touch 'a' so 'b' becomes the least recently used entry
+        cache.get(('a', 0))
+        cache.put(('c', 0), b'1234')
+
+        self.assertIsNotNone(cache.get(('a', 0)))
+        self.assertIsNone(cache.get(('b', 0)))
+        self.assertIsNotNone(cache.get(('c', 0)))
+        self.assertEqual(cache.evictions, 1)
+        self.assertLessEqual(cache.size, cache.budget)
+
+    def test_oversized_payload(self):
+        cache = PayloadCache(4)
+        cache.put(('a', 0), b'12345')
+        self.assertIsNone(cache.get(('a', 0)))
+        self.assertEqual(cache.size, 0)
+
+    def test_discard(self):
+        cache = PayloadCache(100)
+        cache.put(('a', 0, 'glb'), b'12')
+        cache.put(('a', 1, 'glb'), b'34')
+        cache.put(('b', 0, 'glb'), b'56')
+
+        cache.discard('a')
+        self.assertIsNone(cache.get(('a', 0, 'glb')))
+        self.assertIsNone(cache.get(('a', 1, 'glb')))
+        self.assertEqual(cache.get(('b', 0, 'glb')), b'56')
+        self.assertEqual(cache.size, 2)
+
+    def test_get_or_create(self):
+        cache = PayloadCache(100)
+        calls = []
+
+        def create():
+            calls.append(1)
+            return b'payload'
+
+        threads = [threading.Thread(target=cache.get_or_create, args=(('a', 0), create)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(cache.get_or_create(('a', 0), create), b'payload')
+        self.assertEqual(len(calls), 1)
+
+    def test_spill(self):
+        cache = PayloadCache(100, spill_size=10, spill_budget=1000)
+        cache.put(('a', 0), b'small')
+        cache.put(('b', 0), b'x' * 50)
+
+        # Only the small payload is held in memory
+        self.assertEqual(cache.size, 5)
+        self.assertIsInstance(cache.get(('b', 0)), SpilledPayload)
+        self.assertEqual(b''.join(iter_chunks(cache.get(('b', 0)), 16)), b'x' * 50)
+        self.assertEqual(cache.stats()['spill']['size'], 50)
+
+        cache.discard('b')
+        self.assertIsNone(cache.get(('b', 0)))
+
+
+class TestIterChunks(unittest.TestCase):
+
+    def test_chunks(self):
+        payload = bytes(range(100))
+        chunks = list(iter_chunks(payload, 30))
+        self.assertEqual([len(chunk) for chunk in chunks], [30, 30, 30, 10])
+        self.assertEqual(b''.join(chunks), payload)
+
+    def test_empty_payload(self):
+        self.assertEqual(list(iter_chunks(b'', 30)), [])
+        self.assertEqual(list(iter_chunks(SpilledPayload(b''), 30)), [])
+
+    def test_chunk_range(self):
+        payload = bytes(range(100))
+        for source in (payload, SpilledPayload(payload)):
+            self.assertEqual(b''.join(iter_chunks(source, 30, 10, 75)), payload[10:75])
+            self.assertEqual([len(chunk) for chunk in iter_chunks(source, 30, 10, 75)], [30, 30, 5])
+            self.assertEqual(b''.join(iter_chunks(source, 30, 90)), payload[90:])
+            self.assertEqual(b''.join(iter_chunks(source, 30, 90, 1000)), payload[90:])
+            self.assertEqual(list(iter_chunks(source, 30, 100)), [])
+
+    def test_tags(self):
+        cache = PayloadCache(10, spill_size=8, spill_budget=100)
+        cache.put(('a', 0), b'1234')
+        cache.put(('b', 0), b'123456789')
+
+        self.assertEqual(cache.get_tag(('a', 0)), payload_tag(b'1234'))
+        self.assertEqual(cache.get_tag(('b', 0)), payload_tag(SpilledPayload(b'123456789')))
+        self.assertNotEqual(cache.get_tag(('a', 0)), cache.get_tag(('b', 0)))
+
+        # Tags are dropped with their payloads
+        cache.put(('c', 0), b'1234567')
+        self.assertIsNone(cache.get_tag(('a', 0)))
+        cache.discard('b')
+        self.assertIsNone(cache.get_tag(('b', 0)))
+        self.assertIsNone(cache.get_tag(('d', 0)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import multiprocessing
+import unittest
+import numpy as np
+import trimesh
+
+from concurrent import futures
+
+from elements.bvh import BVH
+from elements.deviation import compute_deviation, signed_distances
+
+
+class TestDeviation(unittest.TestCase):
+
+    def setUp(self):
+        self.reference = trimesh.creation.icosphere(4)
+        self.bvh = BVH.build(self.reference.vertices, self.reference.faces)
+
+    def test_signed_distances(self):
+        outside = signed_distances(self.reference.vertices * 1.1, self.bvh, self.reference.face_normals)
+        inside = signed_distances(self.reference.vertices * 0.9, self.bvh, self.reference.face_normals)
+
+        np.testing.assert_allclose(outside, 0.1, atol=1e-3)
+        np.testing.assert_allclose(inside, -0.1, atol=1e-3)
+        self.assertEqual(outside.dtype, np.float32)
+
+    def test_compute_deviation(self):
+        points = trimesh.creation.icosphere(3).vertices * 1.05
+        expected = signed_distances(points, self.bvh, self.reference.face_normals)
+
+        chunks = list(compute_deviation(points, self.bvh, self.reference.face_normals, chunk_size=100))
+        self.assertEqual([start for start, _ in chunks], list(range(0, len(points), 100)))
+        np.testing.assert_array_equal(np.concatenate([values for _, values in chunks]), expected)
+
+        # Computing the chunks in worker processes gives the same result
+        with futures.ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context('spawn')) as executor:
+            chunks = list(compute_deviation(points, self.bvh, self.reference.face_normals,
+                                            executor=executor, chunk_size=100))
+
+        np.testing.assert_array_equal(np.concatenate([values for _, values in chunks]), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
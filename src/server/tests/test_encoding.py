@@ -0,0 +1,74 @@
+import unittest
+
+import numpy as np
+import trimesh
+
+from encoding import ENCODINGS, HEADER, decode_buffers, encode_buffers, encode_mesh
+
+
+class TestEncoding(unittest.TestCase):
+
+    def setUp(self):
+        self.mesh = trimesh.creation.icosphere(subdivisions=3, radius=10.0)
+
+    def test_raw(self):
+        payload = encode_mesh(self.mesh, 'raw')
+        self.assertEqual(payload[:4], b'ZMSH')
+        self.assertEqual(len(payload), HEADER.size + len(self.mesh.vertices) * 12 + len(self.mesh.faces) * 6)
+
+        vertices, faces = decode_buffers(payload)
+        np.testing.assert_allclose(vertices, self.mesh.vertices, atol=1e-5)
+        np.testing.assert_array_equal(faces, self.mesh.faces)
+        self.assertEqual(faces.dtype, np.uint16)
+
+    def test_quantized(self):
+        vertices, faces = decode_buffers(encode_mesh(self.mesh, 'quantized'))
+
+        # The quantization error is at most half a step of the 16 bit grid
+        step = np.ptp(self.mesh.vertices, axis=0) / 65535
+        self.assertTrue(np.all(np.abs(vertices - self.mesh.vertices) <= step * 0.5 + 1e-5))
+        np.testing.assert_array_equal(faces, self.mesh.faces)
+
+    def test_compressed(self):
+        payload = encode_mesh(self.mesh, 'compressed')
+        self.assertLess(len(payload), len(encode_mesh(self.mesh, 'quantized')))
+
+        vertices, faces = decode_buffers(payload)
+        np.testing.assert_array_equal(vertices, decode_buffers(encode_mesh(self.mesh, 'quantized'))[0])
+        np.testing.assert_array_equal(faces, self.mesh.faces)
+
+    def test_large_indices(self):
+        # More than 65536 vertices need 32 bit indices, which wrap around when delta coded
+        vertices = np.random.default_rng(0).uniform(-1.0, 1.0, (70000, 3))
+        faces = np.random.default_rng(1).integers(0, len(vertices), (1000, 3))
+
+        for compress in (False, True):
+            decoded_vertices, decoded_faces = decode_buffers(encode_buffers(vertices, faces, quantize=True, compress=compress))
+            self.assertEqual(decoded_faces.dtype, np.uint32)
+            np.testing.assert_array_equal(decoded_faces, faces)
+            np.testing.assert_allclose(decoded_vertices, vertices, atol=2.0 / 65535)
+
+    def test_empty_mesh(self):
+        for compress in (False, True):
+            vertices, faces = decode_buffers(encode_buffers(np.empty((0, 3)), np.empty((0, 3), dtype=np.int64),
+                                                            quantize=True, compress=compress))
+            self.assertEqual(vertices.shape, (0, 3))
+            self.assertEqual(faces.shape, (0, 3))
+
+    def test_flat_mesh(self):
+        # Extents of zero must not break the quantization
+        vertices = np.array([[0.0, 0.0, 1.0], [1.0, 0.0, 1.0], [0.0, 1.0, 1.0]])
+        decoded, _ = decode_buffers(encode_buffers(vertices, np.array([[0, 1, 2]]), quantize=True, compress=True))
+        np.testing.assert_allclose(decoded, vertices, atol=1e-5)
+
+    def test_glb(self):
+        self.assertEqual(encode_mesh(self.mesh, 'glb')[:4], b'glTF')
+
+    def test_unknown_encoding(self):
+        self.assertNotIn('draco', ENCODINGS)
+        with self.assertRaises(ValueError):
+            encode_mesh(self.mesh, 'draco')
+
+
+if __name__ == '__main__':
+    unittest.main()
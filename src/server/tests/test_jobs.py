@@ -0,0 +1,271 @@
+import asyncio
+import numpy as np
+import os
+import shutil
+import tempfile
+import threading
+import time
+import trimesh
+import unittest
+
+from elements.mesh import Mesh
+from elements.preprocess import STEPS, Pipeline
+from elements.project import Project
+from jobs import Job, JobManager, WorkerPool
+
+
+class TestJobManager(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.manager = JobManager(max_workers=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.manager.shutdown()
+
+    def setUp(self):
+        # Create a temporary directory for the mesh files to import
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def wait_for(self, job):
+        revision = -1
+        while not job.is_finished():
+            self.assertTrue(job.wait(revision, timeout=60))
+            revision = job.get_status()['revision']
+
+    def test_import_meshes(self):
+        paths = []
+        for i, data in enumerate([trimesh.creation.box(), trimesh.creation.icosphere(3)]):
+            paths.append(os.path.join(self.dir, f'mesh_{i}.stl'))
+            data.export(paths[-1])
+
+        project = Project('Test project')
+        job = self.manager.import_meshes(project, paths)
+        self.assertIs(self.manager.get(job.get_id()), job)
+
+        self.wait_for(job)
+
+        status = job.get_status()
+        self.assertEqual(status['state'], Job.DONE)
+        self.assertEqual(status['progress'], 1.0)
+        self.assertEqual(len(status['ids']), 2)
+        self.assertEqual(sorted(mesh.get_name() for mesh in project.meshes), ['mesh_0.stl', 'mesh_1.stl'])
+
+        box = next(mesh for mesh in project.meshes if mesh.get_name() == 'mesh_0.stl')
+        self.assertEqual(len(box.data.faces), 12)
+        self.assertTrue(box.data.is_volume)
+
+    def test_import_with_preprocessing(self):
+        # Two separate spheres, one of them with inverted faces and duplicated vertices
+        first = trimesh.creation.icosphere(3)
+        second = trimesh.creation.icosphere(3)
+        second.apply_translation([5.0, 0.0, 0.0])
+        second.invert()
+
+        path = os.path.join(self.dir, 'spheres.stl')
+        trimesh.util.concatenate([first, second]).export(path)
+
+        manager = JobManager(max_workers=1, pipeline=Pipeline(STEPS, min_component_faces=10))
+        try:
+            project = Project('Test project')
+            job = manager.import_meshes(project, [path])
+            self.wait_for(job)
+        finally:
+            manager.shutdown()
+
+        status = job.get_status()
+        self.assertEqual(status['state'], Job.DONE)
+        self.assertEqual(set(status['timings']), {'read', 'merge', 'degenerate', 'duplicate', 'winding', 'split', 'stats', 'add'})
+
+        mesh = project.meshes[0]
+        self.assertEqual(mesh.get_preprocessing()['steps'], ['merge', 'degenerate', 'duplicate', 'winding', 'split'])
+        self.assertEqual(mesh.get_preprocessing()['components'], 2)
+
+        self.assertEqual(mesh.get_face_count(), 2560)
+        self.assertEqual([child.get_face_count() for child in mesh.get_children()], [1280, 1280])
+        for child in mesh.get_children():
+            # The components refer to ranges of the mesh instead of copies of its geometry
+            vertex_start, vertex_stop, face_start, face_stop = child.get_range()
+            np.testing.assert_array_equal(child.data.vertices, mesh.data.vertices[vertex_start:vertex_stop])
+            np.testing.assert_array_equal(child.data.faces, mesh.data.faces[face_start:face_stop] - vertex_start)
+
+            self.assertTrue(child.data.is_volume)
+            self.assertGreater(child.data.volume, 0.0)
+
+            # The statistics have been computed by the import worker
+            info = child.get_info()
+            self.assertTrue(info['watertight'])
+            self.assertAlmostEqual(info['volume'], child.data.volume)
+            self.assertAlmostEqual(info['area'], child.data.area)
+
+    def test_import_failure(self):
+        project = Project('Test project')
+        job = self.manager.import_meshes(project, [os.path.join(self.dir, 'does_not_exist.stl')])
+
+        self.wait_for(job)
+
+        status = job.get_status()
+        self.assertEqual(status['state'], Job.FAILED)
+        self.assertIn('does_not_exist.stl', status['message'])
+        self.assertEqual(project.meshes, [])
+
+    def test_empty_import(self):
+        job = self.manager.import_meshes(Project('Test project'), [])
+        self.assertTrue(job.is_finished())
+
+    def test_compute_deviation(self):
+        source = Mesh('Scan', trimesh.creation.icosphere(3, radius=1.1))
+        reference = Mesh('Nominal', trimesh.creation.icosphere(4))
+
+        manager = JobManager(max_workers=2)
+        old_chunk_size = JobManager.DEVIATION_CHUNK_SIZE
+        JobManager.DEVIATION_CHUNK_SIZE = 200
+
+        try:
+            chunks = list(manager.compute_deviation(source, reference))
+        finally:
+            JobManager.DEVIATION_CHUNK_SIZE = old_chunk_size
+            manager.shutdown()
+
+        self.assertGreater(len(chunks), 1)
+        values = np.concatenate([values for _, values in chunks])
+        self.assertEqual(len(values), len(source.data.vertices))
+        np.testing.assert_allclose(values, 0.1, atol=1e-2)
+
+        # The result is stored with the source mesh and served from there
+        np.testing.assert_array_equal(source.get_deviation(reference), values)
+        chunks = list(self.manager.compute_deviation(source, reference))
+        self.assertEqual(len(chunks), 1)
+
+    def test_slice_mesh(self):
+        mesh = Mesh('Sphere', trimesh.creation.icosphere(4))
+        offsets = np.linspace(-0.95, 0.95, 10)
+
+        old_chunk_size, old_min_faces = JobManager.SLICE_CHUNK_SIZE, JobManager.SLICE_MIN_FACES
+        JobManager.SLICE_CHUNK_SIZE, JobManager.SLICE_MIN_FACES = 3, 0
+
+        try:
+            chunks = list(self.manager.slice_mesh(mesh, [0, 0, 1], offsets))
+        finally:
+            JobManager.SLICE_CHUNK_SIZE, JobManager.SLICE_MIN_FACES = old_chunk_size, old_min_faces
+
+        self.assertEqual([start for start, _ in chunks], [0, 3, 6, 9])
+
+        results = [result for _, planes in chunks for result in planes]
+        for (points, lengths, closed), expected in zip(results, mesh.slice([0, 0, 1], offsets)):
+            np.testing.assert_array_equal(points, expected[0])
+            np.testing.assert_array_equal(lengths, expected[1])
+            self.assertEqual(lengths.tolist(), [len(points)])
+
+    def test_warm_up(self):
+        self.manager.warm_up()
+        job = self.manager.import_meshes(Project('Test project'), [])
+        self.assertTrue(job.is_finished())
+
+    def test_unknown_job(self):
+        with self.assertRaises(KeyError):
+            self.manager.get('unknown')
+
+    def test_job_listeners(self):
+        job = Job(2)
+        states = []
+        job.add_listener(lambda: states.append(job.state))
+
+        job.start()
+        job.update(ids=['a'])
+        job.update(error='failed')
+
+        self.assertEqual(states, [Job.RUNNING, Job.RUNNING, Job.FAILED])
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def test_run(self):
+        pool = WorkerPool(import_workers=1, compute_workers=2, name='test')
+        active = []
+
+        def work(value):
+            active.append(value)
+            peak = len(active)
+            time.sleep(0.05)
+            active.remove(value)
+            return value * 2, peak
+
+        async def run():
+            return await asyncio.gather(*[pool.run(work, value) for value in range(6)])
+
+        try:
+            values = asyncio.run(run())
+        finally:
+            pool.shutdown()
+
+        self.assertEqual([value for value, _ in values], [0, 2, 4, 6, 8, 10])
+        self.assertLessEqual(max(peak for _, peak in values), 2)
+
+    def test_iterate(self):
+        pool = WorkerPool(import_workers=1, compute_workers=2, name='test')
+        events = []
+
+        def generate():
+            try:
+                for value in range(10):
+                    events.append(('next', threading.current_thread().name))
+                    time.sleep(0.05)
+                    yield value
+            finally:
+                events.append(('close', threading.current_thread().name))
+
+        async def consume(count):
+            items = []
+            chunks = pool.iterate(generate())
+            try:
+                async for item in chunks:
+                    items.append(item)
+                    if len(items) == count:
+                        break
+            finally:
+                await chunks.aclose()
+            return items
+
+        async def cancel():
+            task = asyncio.create_task(consume(10))
+            await asyncio.sleep(0.075)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        try:
+            self.assertEqual(asyncio.run(consume(3)), [0, 1, 2])
+            self.assertEqual(events[-1][0], 'close')
+
+            # A cancelled iteration closes the generator once the running item is done
+            events.clear()
+            asyncio.run(cancel())
+        finally:
+            pool.shutdown()
+
+        self.assertEqual([event for event, _ in events], ['next', 'next', 'close'])
+        self.assertTrue(all(name.startswith('test') for _, name in events))
+
+    def test_shutdown_cancels_imports(self):
+        pool = WorkerPool(import_workers=1, compute_workers=1)
+
+        with tempfile.TemporaryDirectory() as directory:
+            paths = []
+            for index in range(4):
+                paths.append(os.path.join(directory, f'mesh_{index}.stl'))
+                trimesh.creation.icosphere(4).export(paths[-1])
+
+            job = pool.jobs.import_meshes(Project('Test project'), paths)
+            pool.shutdown()
+
+        self.assertTrue(job.is_finished())
+        self.assertEqual(job.completed, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+import numpy as np
+import trimesh
+
+from elements.lod import decimate, build_levels
+
+
+class TestLod(unittest.TestCase):
+
+    def test_decimate(self):
+        mesh = trimesh.creation.icosphere(5)
+        vertices, faces = decimate(mesh.vertices, mesh.faces, 16)
+
+        self.assertLess(len(faces), len(mesh.faces))
+        self.assertGreater(len(faces), 0)
+        self.assertEqual(faces.max(), len(vertices) - 1)
+
+        # No degenerate or duplicate faces are left
+        self.assertTrue(np.all(faces[:, 0] != faces[:, 1]))
+        self.assertTrue(np.all(faces[:, 1] != faces[:, 2]))
+        self.assertTrue(np.all(faces[:, 0] != faces[:, 2]))
+        self.assertEqual(len(np.unique(np.sort(faces, axis=1), axis=0)), len(faces))
+
+        # The decimated vertices stay within the original bounds
+        self.assertTrue(np.all(vertices.min(axis=0) >= mesh.vertices.min(axis=0) - 1e-9))
+        self.assertTrue(np.all(vertices.max(axis=0) <= mesh.vertices.max(axis=0) + 1e-9))
+
+    def test_build_levels(self):
+        mesh = trimesh.creation.icosphere(6)
+        levels = build_levels(mesh.vertices, mesh.faces, reduction=4, min_faces=500, max_levels=3)
+
+        counts = [len(faces) for _, faces in levels]
+        self.assertGreater(len(levels), 0)
+        self.assertLessEqual(len(levels), 3)
+        self.assertEqual(counts, sorted(counts))
+        self.assertLess(counts[-1], len(mesh.faces))
+        self.assertGreaterEqual(counts[0], 500 // 4)
+
+    def test_build_levels_small_mesh(self):
+        mesh = trimesh.creation.box()
+        self.assertEqual(build_levels(mesh.vertices, mesh.faces, reduction=4, min_faces=100, max_levels=3), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
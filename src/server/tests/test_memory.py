@@ -0,0 +1,177 @@
+import gc
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import trimesh
+
+from elements.memory import GeometryManager
+from elements.mesh import Mesh
+from elements.project import Project
+
+
+class TestGeometryManager(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.spill_dir = os.path.join(self.temp_dir, 'spill')
+        os.mkdir(self.spill_dir)
+
+        # Each box has 8 vertices and 12 faces, which are 480 bytes of geometry
+        self.size = 8 * 3 * 8 + 12 * 3 * 8
+        self.manager = GeometryManager(3 * self.size, spill_dir=self.spill_dir)
+        Mesh.geometry_manager = self.manager
+
+    def tearDown(self):
+        Mesh.geometry_manager = None
+        self.manager.close()
+        shutil.rmtree(self.temp_dir)
+
+    def create_meshes(self, count):
+        box = trimesh.creation.box()
+        meshes = []
+        for index in range(count):
+            mesh = Mesh(f'mesh {index}', None)
+            mesh.set_arrays(np.array(box.vertices) + index, np.array(box.faces))
+            meshes.append(mesh)
+        return meshes
+
+    def test_evicts_least_recently_used(self):
+        meshes = self.create_meshes(3)
+
+        # Touch the first mesh, so the second one is the least recently used
+        meshes[0].get_arrays()
+        meshes.extend(self.create_meshes(1))
+
+        self.assertEqual([mesh.is_loaded() for mesh in meshes], [True, False, True, True])
+
+        stats = self.manager.stats()
+        self.assertEqual(stats['meshes'], 3)
+        self.assertEqual(stats['size'], 3 * self.size)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['spills'], 1)
+        self.assertEqual(stats['spilled'], 1)
+
+    def test_reload_from_spill_file(self):
+        meshes = self.create_meshes(4)
+        evicted = meshes[0]
+        self.assertFalse(evicted.is_loaded())
+        self.assertEqual(len(os.listdir(self.spill_dir)), 1)
+
+        # Metadata is available without reloading the geometry
+        info = evicted.get_info()
+        self.assertEqual(info['faces'], 12)
+        self.assertEqual(info['bounds'], [-0.5, -0.5, -0.5, 0.5, 0.5, 0.5])
+        self.assertFalse(evicted.is_loaded())
+
+        vertices, faces = evicted.get_arrays()
+        self.assertTrue(evicted.is_loaded())
+        np.testing.assert_array_equal(vertices, trimesh.creation.box().vertices)
+        self.assertEqual(faces.dtype, np.int64)
+
+        # The spill file is removed once the geometry is resident again, while the reload
+        # spilled the next least recently used mesh
+        stats = self.manager.stats()
+        self.assertEqual(stats['reloads'], 1)
+        self.assertEqual(stats['evictions'], 2)
+        self.assertFalse(meshes[1].is_loaded())
+        self.assertEqual(len(os.listdir(self.spill_dir)), 1)
+
+    def test_reload_from_project_file(self):
+        project = Project('project')
+        for mesh in self.create_meshes(3):
+            project.add_mesh(mesh)
+
+        filename = os.path.join(self.temp_dir, 'project.h5')
+        project.save(filename)
+
+        # Saved meshes are evicted without spilling
+        self.create_meshes(1)
+        self.assertFalse(project.meshes[0].is_loaded())
+        self.assertEqual(self.manager.stats()['spills'], 0)
+        self.assertEqual(os.listdir(self.spill_dir), [])
+
+        np.testing.assert_array_equal(project.meshes[0].get_arrays()[0], trimesh.creation.box().vertices)
+        self.assertFalse(project.meshes[0].is_modified())
+
+    def test_replace_evicted_geometry(self):
+        meshes = self.create_meshes(4)
+        self.assertEqual(len(os.listdir(self.spill_dir)), 1)
+
+        # The spilled geometry is not needed anymore
+        meshes[0].set_arrays(np.zeros((3, 3)), np.array([[0, 1, 2]]))
+        self.assertEqual(self.manager.stats()['spilled'], 1)
+        np.testing.assert_array_equal(meshes[0].get_arrays()[0], np.zeros((3, 3)))
+
+    def test_spatial_indices(self):
+        meshes = self.create_meshes(2)
+
+        # The indices count against the budget, so the first mesh is evicted to make room for them
+        bvh = meshes[1].get_bvh()
+        edges = meshes[1].get_edge_index()
+        size = self.size + sum(getattr(bvh, name).nbytes for name in bvh.ARRAYS) + \
+            sum(getattr(edges, name).nbytes for name in edges.ARRAYS)
+
+        self.assertFalse(meshes[0].is_loaded())
+        self.assertEqual(self.manager.stats()['size'], size)
+
+        self.create_meshes(2)
+        self.assertFalse(meshes[1].is_loaded())
+        self.assertIsNone(meshes[1]._bvh)
+        self.assertIsNone(meshes[1]._edges)
+
+        # They are rebuilt on the reloaded geometry
+        self.assertEqual(meshes[1].closest_point([[1, 1, 3]])[1].tolist(), [1.5])
+        self.assertTrue(np.shares_memory(meshes[1].get_bvh().vertices, meshes[1].get_arrays()[0]))
+
+    def test_evict_component_range(self):
+        box = trimesh.creation.box()
+        mesh = Mesh('Assembly', None)
+        mesh.set_arrays(np.vstack([box.vertices, np.array(box.vertices) + 2.0]), np.vstack([box.faces, box.faces + 8]))
+        component = Mesh('Component 2', None)
+        component.set_range((8, 16, 12, 24))
+        mesh.add_child(component)
+
+        component.get_arrays()
+        mesh.get_arrays()
+        self.create_meshes(1)
+
+        # The component is sliced out of its parent again instead of being spilled
+        self.assertFalse(component.is_loaded())
+        self.assertTrue(mesh.is_loaded())
+        self.assertEqual(self.manager.stats()['spills'], 0)
+
+        vertices, faces = component.get_arrays()
+        np.testing.assert_array_equal(vertices, np.array(box.vertices) + 2.0)
+        np.testing.assert_array_equal(faces, box.faces)
+
+    def test_skip_meshes_in_use(self):
+        meshes = self.create_meshes(1)
+        data = meshes[0].data
+
+        self.create_meshes(3)
+        self.assertTrue(meshes[0].is_loaded())
+        self.assertIs(meshes[0].data, data)
+
+    def test_collected_meshes(self):
+        meshes = self.create_meshes(2)
+        del meshes
+        gc.collect()
+
+        stats = self.manager.stats()
+        self.assertEqual(stats['meshes'], 0)
+        self.assertEqual(stats['size'], 0)
+
+    def test_spill_file_removed_with_mesh(self):
+        meshes = self.create_meshes(4)
+        self.assertEqual(len(os.listdir(self.spill_dir)), 1)
+
+        del meshes
+        gc.collect()
+        self.assertEqual(os.listdir(self.spill_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
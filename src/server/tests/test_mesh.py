@@ -1,7 +1,9 @@
+import gc
 import unittest
 import tempfile
 import shutil
 import os
+import weakref
 import h5py
 import trimesh
 import numpy as np
@@ -46,6 +48,230 @@ class TestMesh(unittest.TestCase):
         # Verify that the loaded mesh id is different from the original mesh id
         self.assertNotEqual(id(mesh), id(loaded_mesh))
 
+    def test_native_layout(self):
+        mesh = Mesh('test_mesh', trimesh.creation.box())
+
+        temp_file = os.path.join(self.temp_dir, 'test_mesh.h5')
+        with h5py.File(temp_file, 'w') as f:
+            mesh.__save__(f.create_group('mesh'))
+
+        with h5py.File(temp_file, 'r') as f:
+            mesh_group = f['mesh']
+
+            # The geometry is stored as deduplicated arrays instead of an STL blob
+            self.assertNotIn('data', mesh_group)
+            self.assertEqual(mesh_group.attrs['layout'], Mesh.LAYOUT)
+            self.assertEqual(mesh_group['vertices'].shape, (len(mesh.data.vertices), 3))
+            self.assertEqual(mesh_group['faces'].shape, (len(mesh.data.faces), 3))
+            self.assertEqual(mesh_group['faces'].dtype, np.int32)
+            self.assertEqual(mesh_group['vertices'].compression, Mesh.COMPRESSION)
+            self.assertIsNotNone(mesh_group['vertices'].chunks)
+
+            loaded_mesh = Mesh('loaded_mesh', None)
+            loaded_mesh.__load__(mesh_group)
+
+        np.testing.assert_array_equal(mesh.data.vertices, loaded_mesh.data.vertices)
+        np.testing.assert_array_equal(mesh.data.faces, loaded_mesh.data.faces)
+
+    def test_load_legacy_stl_layout(self):
+        mesh_data = trimesh.creation.box()
+
+        # Write a mesh group the way earlier versions did
+        temp_file = os.path.join(self.temp_dir, 'test_mesh.h5')
+        with h5py.File(temp_file, 'w') as f:
+            mesh_group = f.create_group('mesh')
+            mesh_group.attrs['id'] = 'legacy'
+            mesh_group.attrs['name'] = 'legacy_mesh'
+            data = np.frombuffer(trimesh.exchange.export.export_stl(mesh_data), dtype=np.uint8)
+            dset = mesh_group.create_dataset('data', data=data)
+            dset.attrs['file_type'] = 'stl'
+
+        loaded_mesh = Mesh('loaded_mesh', None)
+        with h5py.File(temp_file, 'r') as f:
+            loaded_mesh.__load__(f['mesh'])
+
+        self.assertEqual(loaded_mesh.name, 'legacy_mesh')
+        self.assertEqual(len(mesh_data.vertices), len(loaded_mesh.data.vertices))
+        self.assertEqual(len(mesh_data.faces), len(loaded_mesh.data.faces))
+
+    def test_info(self):
+        mesh = Mesh('test_mesh', trimesh.creation.box())
+
+        info = mesh.get_info()
+        self.assertEqual(info['name'], 'test_mesh')
+        self.assertEqual(info['type'], 'Mesh')
+        self.assertEqual(info['vertices'], 8)
+        self.assertEqual(info['faces'], 12)
+        self.assertEqual(info['bounds'], [-0.5, -0.5, -0.5, 0.5, 0.5, 0.5])
+        self.assertEqual(info['size'], mesh.data.vertices.nbytes + mesh.data.faces.nbytes)
+        self.assertAlmostEqual(info['area'], 6.0)
+        self.assertAlmostEqual(info['volume'], 1.0)
+        self.assertTrue(info['watertight'])
+
+        temp_file = os.path.join(self.temp_dir, 'test_mesh.h5')
+        with h5py.File(temp_file, 'w') as f:
+            mesh.__save__(f.create_group('mesh'))
+
+        # The info of lazily loaded meshes is available without reading the geometry
+        loaded_mesh = Mesh('loaded_mesh', None)
+        with h5py.File(temp_file, 'r') as f:
+            loaded_mesh.__load__(f['mesh'], lazy=True)
+
+        loaded_info = loaded_mesh.get_info()
+        self.assertFalse(loaded_mesh.is_loaded())
+
+        for key in ['name', 'type', 'children', 'vertices', 'faces', 'bounds', 'size', 'area', 'volume', 'watertight']:
+            self.assertEqual(info[key], loaded_info[key])
+
+    def test_stats_of_earlier_files(self):
+        mesh = Mesh('test_mesh', trimesh.creation.box())
+
+        temp_file = os.path.join(self.temp_dir, 'test_mesh.h5')
+        with h5py.File(temp_file, 'w') as f:
+            mesh.__save__(f.create_group('mesh'))
+            for key in Mesh.STATS_ATTRIBUTES:
+                del f['mesh'].attrs[key]
+
+        loaded_mesh = Mesh('loaded_mesh', None)
+        with h5py.File(temp_file, 'r') as f:
+            loaded_mesh.__load__(f['mesh'], lazy=True)
+
+        # Only the statistics which do not need the geometry are reported
+        info = loaded_mesh.get_info()
+        self.assertEqual(info['faces'], 12)
+        self.assertNotIn('area', info)
+        self.assertFalse(loaded_mesh.is_loaded())
+
+        self.assertAlmostEqual(loaded_mesh.get_stats()['area'], 6.0)
+
+        # The missing statistics are added to the file when the project is saved again
+        with h5py.File(temp_file, 'a') as f:
+            loaded_mesh.__save_derived__(f['mesh'])
+            self.assertAlmostEqual(f['mesh'].attrs['volume'], 1.0)
+
+    def test_geometry_arrays(self):
+        mesh = Mesh('test_mesh', trimesh.creation.box())
+        self.assertFalse(hasattr(mesh, '__dict__'))
+
+        vertices, faces = mesh.get_arrays()
+        self.assertIs(type(vertices), np.ndarray)
+        self.assertEqual((vertices.dtype, faces.dtype), (np.float64, np.int64))
+
+        # The trimesh object wraps the arrays and is only kept while it is in use
+        data = mesh.data
+        self.assertIs(mesh.data, data)
+        self.assertTrue(np.shares_memory(data.vertices, vertices))
+
+        wrapper = weakref.ref(data)
+        del data
+        gc.collect()
+        self.assertIsNone(wrapper())
+        self.assertAlmostEqual(mesh.data.volume, 1.0)
+
+        mesh.set_arrays(vertices * 2, faces)
+        self.assertAlmostEqual(mesh.data.volume, 8.0)
+        self.assertTrue(mesh.is_modified())
+
+    def test_levels_of_detail(self):
+        mesh = Mesh('test_mesh', trimesh.creation.icosphere(6))
+        n_faces = len(mesh.data.faces)
+
+        levels = mesh.get_levels()
+        self.assertGreater(len(levels), 1)
+        self.assertEqual(levels, sorted(levels))
+        self.assertEqual(levels[-1], n_faces)
+
+        self.assertLessEqual(len(mesh.get_level(levels[-2]).faces), levels[-2])
+        self.assertEqual(len(mesh.get_level(1).faces), levels[0])
+        self.assertIs(mesh.get_level(0), mesh.data)
+
+        # The levels are stored in the file and available without reading the geometry
+        temp_file = os.path.join(self.temp_dir, 'test_mesh.h5')
+        with h5py.File(temp_file, 'w') as f:
+            mesh.__save__(f.create_group('mesh'))
+
+        loaded_mesh = Mesh('loaded_mesh', None)
+        with h5py.File(temp_file, 'r') as f:
+            loaded_mesh.__load__(f['mesh'], lazy=True)
+
+        self.assertEqual(loaded_mesh.get_levels(), levels)
+        self.assertEqual(len(loaded_mesh.get_level(levels[0]).faces), levels[0])
+        self.assertFalse(loaded_mesh.is_loaded())
+
+        # Changing the geometry invalidates the levels
+        loaded_mesh.data = trimesh.creation.box()
+        self.assertEqual(loaded_mesh.get_levels(), [12])
+
+    def test_spatial_queries(self):
+        mesh = Mesh('test_mesh', trimesh.creation.icosphere(3))
+
+        distances, faces = mesh.ray_cast([[0, 0, 5]], [[0, 0, -1]])
+        self.assertAlmostEqual(distances[0], 4.0, places=2)
+
+        _, distances, _ = mesh.closest_point([[0, 0, 2]])
+        self.assertAlmostEqual(distances[0], 1.0, places=2)
+
+        # The hierarchy is stored in the file and loaded instead of being rebuilt
+        temp_file = os.path.join(self.temp_dir, 'test_mesh.h5')
+        with h5py.File(temp_file, 'w') as f:
+            mesh.__save__(f.create_group('mesh'))
+            self.assertIn('bvh', f['mesh'])
+
+        loaded_mesh = Mesh('loaded_mesh', None)
+        with h5py.File(temp_file, 'r') as f:
+            loaded_mesh.__load__(f['mesh'], lazy=True)
+
+        np.testing.assert_array_equal(loaded_mesh.get_bvh().order, mesh.get_bvh().order)
+
+        # Changing the geometry invalidates the hierarchy
+        loaded_mesh.data = trimesh.creation.box()
+        self.assertEqual(len(loaded_mesh.get_bvh().order), 12)
+
+    def test_slice(self):
+        mesh = Mesh('test_mesh', trimesh.creation.icosphere(3))
+
+        (points, lengths, closed), = mesh.slice([0, 0, 1], [0.0])
+        self.assertEqual(len(lengths), 1)
+        self.assertTrue(closed[0])
+        np.testing.assert_allclose(np.linalg.norm(points, axis=1), 1.0, atol=1e-2)
+
+        # The edge index is kept until the geometry changes
+        index = mesh.get_edge_index()
+        self.assertIs(mesh.get_edge_index(), index)
+
+        mesh.data = trimesh.creation.box()
+        self.assertEqual(len(mesh.get_edge_index()), 18)
+        self.assertEqual(mesh.slice([0, 0, 1], [2.0])[0][1].tolist(), [])
+
+    def test_deviations(self):
+        mesh = Mesh('test_mesh', trimesh.creation.icosphere(2))
+        reference = Mesh('reference', trimesh.creation.box())
+        values = np.linspace(-1, 1, len(mesh.data.vertices), dtype=np.float32)
+
+        self.assertIsNone(mesh.get_deviation(reference))
+        mesh.set_deviation(reference, values)
+        np.testing.assert_array_equal(mesh.get_deviation(reference), values)
+
+        # The deviations are stored in the file, keyed by the reference geometry
+        temp_file = os.path.join(self.temp_dir, 'test_mesh.h5')
+        with h5py.File(temp_file, 'w') as f:
+            mesh.__save__(f.create_group('mesh'))
+
+        loaded_mesh = Mesh('loaded_mesh', None)
+        with h5py.File(temp_file, 'r') as f:
+            loaded_mesh.__load__(f['mesh'], lazy=True)
+
+        self.assertEqual(loaded_mesh.get_digest(), mesh.get_digest())
+        np.testing.assert_array_equal(loaded_mesh.get_deviation(Mesh('copy', trimesh.creation.box())), values)
+        self.assertFalse(loaded_mesh.is_loaded())
+
+        # Changing the geometry of either mesh invalidates the deviations
+        reference.data = trimesh.creation.box((2, 2, 2))
+        self.assertIsNone(mesh.get_deviation(reference))
+
+        loaded_mesh.data = trimesh.creation.icosphere(2)
+        self.assertIsNone(loaded_mesh.get_deviation(Mesh('copy', trimesh.creation.box())))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,162 @@
+import asyncio
+import grpc
+import os
+import tempfile
+import time
+import unittest
+
+from metrics import Histogram, Metrics, MetricsInterceptor, SamplingProfiler, flatten
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_histogram(self):
+        histogram = Histogram([1.0, 2.0, 4.0])
+        for value in [0.5, 1.5, 1.5, 3.0, 10.0]:
+            histogram.observe(value)
+
+        self.assertEqual(histogram.counts, [1, 2, 1, 1])
+        self.assertEqual(histogram.count, 5)
+        self.assertAlmostEqual(histogram.sum, 16.5)
+
+        self.assertAlmostEqual(histogram.quantile(0.5), 1.75)
+        self.assertEqual(histogram.quantile(1.0), 4.0)
+        self.assertEqual(Histogram().quantile(0.5), 0.0)
+
+    def test_snapshot(self):
+        metrics = Metrics()
+        metrics.add('calls', method='a')
+        metrics.add('calls', 2, method='a')
+        metrics.adjust('in_flight', 1)
+        with metrics.timer('latency', method='a'):
+            pass
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['counters']['calls'], [{'labels': {'method': 'a'}, 'value': 3}])
+        self.assertEqual(snapshot['gauges']['in_flight'], [{'labels': {}, 'value': 1}])
+        self.assertEqual(snapshot['histograms']['latency'][0]['value']['count'], 1)
+
+    def test_prometheus(self):
+        metrics = Metrics()
+        metrics.add('calls', method='say "hi"')
+        metrics.observe('latency', 0.003)
+
+        lines = metrics.prometheus({'cache_size': 12}).splitlines()
+        self.assertIn('# TYPE zinspector_calls_total counter', lines)
+        self.assertIn('zinspector_calls_total{method="say \\"hi\\""} 1', lines)
+        self.assertIn('zinspector_latency_bucket{le="0.0025"} 0', lines)
+        self.assertIn('zinspector_latency_bucket{le="0.005"} 1', lines)
+        self.assertIn('zinspector_latency_bucket{le="+Inf"} 1', lines)
+        self.assertIn('zinspector_latency_count 1', lines)
+        self.assertIn('zinspector_cache_size 12', lines)
+
+    def test_flatten(self):
+        stats = {'geometry': None, 'cache': {'size': 3, 'spill': {'entries': 1}, 'name': 'x'}}
+        self.assertEqual(flatten(stats), {'cache_size': 3.0, 'cache_spill_entries': 1.0})
+
+
+class TestMetricsInterceptor(unittest.TestCase):
+
+    def call(self, interceptor, handlers, calls):
+        '''
+        Serve the handlers with the interceptor and make the calls, given as (method,
+        streaming) tuples. Returns the status code of each call.
+        '''
+        async def run():
+            server = grpc.aio.server(interceptors=[interceptor])
+            server.add_generic_rpc_handlers([grpc.method_handlers_generic_handler('Test', handlers)])
+            port = server.add_insecure_port('localhost:0')
+            await server.start()
+
+            codes = []
+            try:
+                async with grpc.aio.insecure_channel(f'localhost:{port}') as channel:
+                    for method, streaming in calls:
+                        try:
+                            if streaming:
+                                [response async for response in channel.unary_stream(f'/Test/{method}')(b'')]
+                            else:
+                                await channel.unary_unary(f'/Test/{method}')(b'')
+                            codes.append(grpc.StatusCode.OK)
+                        except grpc.RpcError as e:
+                            codes.append(e.code())
+            finally:
+                await server.stop(None)
+
+            return codes
+
+        return asyncio.run(run())
+
+    def test_calls(self):
+        async def echo(request, context):
+            return request
+
+        async def missing(request, context):
+            context.set_code(grpc.StatusCode.NOT_FOUND)
+            return b''
+
+        async def invalid(request, context):
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, 'invalid')
+
+        async def stream(request, context):
+            for index in range(3):
+                yield bytes([index])
+
+        handlers = {
+            'Echo': grpc.unary_unary_rpc_method_handler(echo),
+            'Missing': grpc.unary_unary_rpc_method_handler(missing),
+            'Invalid': grpc.unary_unary_rpc_method_handler(invalid),
+            'Stream': grpc.unary_stream_rpc_method_handler(stream)
+        }
+
+        metrics = Metrics()
+        codes = self.call(MetricsInterceptor(metrics), handlers,
+                          [('Echo', False), ('Echo', False), ('Missing', False), ('Invalid', False), ('Stream', True)])
+        self.assertEqual(codes[2:4], [grpc.StatusCode.NOT_FOUND, grpc.StatusCode.INVALID_ARGUMENT])
+
+        snapshot = metrics.snapshot()
+        calls = {(value['labels']['method'], value['labels']['code']): value['value'] for value in snapshot['counters']['rpc_calls']}
+        self.assertEqual(calls, {('Echo', 'OK'): 2, ('Missing', 'NOT_FOUND'): 1, ('Invalid', 'INVALID_ARGUMENT'): 1, ('Stream', 'OK'): 1})
+
+        messages = {value['labels']['method']: value['value'] for value in snapshot['counters']['rpc_messages_sent']}
+        self.assertEqual(messages['Stream'], 3)
+
+        self.assertTrue(all(value['value'] == 0 for value in snapshot['gauges']['rpc_in_flight']))
+        self.assertEqual(sum(value['value']['count'] for value in snapshot['histograms']['rpc_latency_seconds']), 5)
+
+    def test_slow_request_profile(self):
+        def work(duration):
+            end = time.perf_counter() + duration
+            while time.perf_counter() < end:
+                pass
+
+        async def slow(request, context):
+            await asyncio.get_running_loop().run_in_executor(None, work, 0.2)
+            return b''
+
+        async def fast(request, context):
+            return b''
+
+        handlers = {'Slow': grpc.unary_unary_rpc_method_handler(slow), 'Fast': grpc.unary_unary_rpc_method_handler(fast)}
+
+        with tempfile.TemporaryDirectory() as directory:
+            profiler = SamplingProfiler(0.1, directory, interval=0.001)
+            try:
+                self.call(MetricsInterceptor(Metrics(), profiler), handlers, [('Fast', False), ('Slow', False)])
+            finally:
+                profiler.close()
+
+            profiles = profiler.get_profiles()
+            self.assertEqual([profile['method'] for profile in profiles], ['Slow'])
+            self.assertGreater(profiles[0]['samples'], 0)
+
+            with open(profiles[0]['file']) as f:
+                lines = f.read().splitlines()
+
+            self.assertTrue(any('work (test_metrics.py:' in line for line in lines))
+            self.assertTrue(all(line.rsplit(' ', 1)[1].isdigit() for line in lines))
+            self.assertEqual(os.listdir(directory), [os.path.basename(profiles[0]['file'])])
+
+
+if __name__ == '__main__':
+    unittest.main()
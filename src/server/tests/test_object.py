@@ -1,5 +1,8 @@
+import gc
 import h5py
+import threading
 import unittest
+import uuid
 
 from elements.object import Object, ObjectIdDatabase
 
@@ -43,6 +46,12 @@ class TestObjectIdDatabase(unittest.TestCase):
         self.assertEqual(objects[obj1.get_id()].name, 'test 1')
         self.assertEqual(objects[obj2.get_id()].name, 'test 2')
 
+    def test_get_many(self):
+        obj1 = MockObject('test 1')
+        obj2 = MockObject('test 2')
+        objects = self.db.get_many([obj2.get_id(), 'unknown', obj1.get_id()])
+        self.assertEqual(objects, [obj2, None, obj1])
+
     def test_garbage_collected_object(self):
         obj = MockObject('test')
         obj_id = obj.get_id()
@@ -50,6 +59,53 @@ class TestObjectIdDatabase(unittest.TestCase):
         with self.assertRaises(KeyError):
             self.db.get(obj_id)
 
+    def test_malformed_id(self):
+        with self.assertRaises(KeyError):
+            self.db.get('not a uuid')
+        self.assertEqual(self.db.get_many(['not a uuid']), [None])
+
+    def test_find(self):
+        parent = MockObject('parent')
+        children = [MockObject(f'child {i}') for i in range(3)]
+        children[1].set_parent(parent)
+        children[0].set_parent(parent)
+
+        # Children are found in the order they have been added
+        self.assertEqual([obj.name for obj in self.db.find(parent_id=parent.get_id())], ['child 1', 'child 0'])
+        self.assertEqual(self.db.find(type_name='MockObject', parent_id=parent.get_id()), [children[1], children[0]])
+        self.assertEqual(self.db.find(type_name='Mesh', parent_id=parent.get_id()), [])
+        self.assertTrue(set(children) <= set(self.db.find(type_name='MockObject')))
+
+        # The index follows parent changes and removals
+        children[0].set_parent(None)
+        children[2].set_parent(parent)
+        del children[1]
+        gc.collect()
+
+        self.assertEqual([obj.name for obj in self.db.find(parent_id=parent.get_id())], ['child 2'])
+
+    def test_concurrent_access(self):
+        errors = []
+
+        def worker():
+            try:
+                for _ in range(500):
+                    objs = [MockObject('test') for _ in range(10)]
+                    for obj in objs:
+                        self.assertIs(self.db.get(obj.get_id()), obj)
+                    self.db.list_objects()
+                    self.db.find(type_name='MockObject')
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+
 
 class TestObject(unittest.TestCase):
 
@@ -58,6 +114,15 @@ class TestObject(unittest.TestCase):
         self.assertIsNotNone(obj.get_id())
         self.assertEqual(obj.name, 'test')
 
+    def test_handle(self):
+        obj = MockObject('test')
+        self.assertEqual(uuid.UUID(obj.get_id()).int, obj.get_handle())
+        self.assertEqual(obj.id, obj.get_id())
+
+    def test_object_info(self):
+        obj = MockObject('test')
+        self.assertEqual(obj.get_info(), {'id': obj.get_id(), 'name': 'test', 'type': 'MockObject', 'children': 0})
+
     def test_object_destruction(self):
         obj = MockObject('test')
         obj_id = obj.get_id()
@@ -0,0 +1,143 @@
+import numpy as np
+import trimesh
+import unittest
+
+from elements.preprocess import STEPS, Pipeline, connected_components, fix_winding, merge_vertices, \
+    remove_degenerate_faces, remove_duplicate_faces, remove_unreferenced_vertices, split_components
+
+
+class TestPreprocess(unittest.TestCase):
+
+    def setUp(self):
+        self.sphere = trimesh.creation.icosphere(3)
+        self.vertices = np.asarray(self.sphere.vertices)
+        self.faces = np.asarray(self.sphere.faces)
+
+    def test_merge_vertices(self):
+        # Unshared corners, slightly displaced
+        soup = self.vertices[self.faces].reshape(-1, 3) + np.random.default_rng(0).uniform(0.0, 1e-9, (len(self.faces) * 3, 3))
+        vertices, faces = merge_vertices(soup, np.arange(len(soup)).reshape(-1, 3), 1e-6)
+
+        self.assertLessEqual(len(vertices), len(self.vertices) * 1.1)
+        np.testing.assert_allclose(vertices[faces], self.vertices[self.faces], atol=1e-6)
+
+    def test_merge_without_tolerance(self):
+        vertices = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 0.0, 0.0], [1.0, 0.0, 1e-12]])
+        merged, faces = merge_vertices(vertices, np.array([[0, 1, 2], [2, 3, 1]]), 0.0)
+
+        np.testing.assert_array_equal(merged, vertices[[0, 1, 3]])
+        np.testing.assert_array_equal(faces, [[0, 1, 0], [0, 2, 1]])
+
+    def test_remove_degenerate_faces(self):
+        vertices = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [2.0, 0.0, 0.0]])
+        faces = np.array([[0, 1, 2], [0, 0, 1], [0, 1, 3]])
+
+        np.testing.assert_array_equal(remove_degenerate_faces(vertices, faces), [[0, 1, 2]])
+
+    def test_remove_duplicate_faces(self):
+        faces = np.array([[0, 1, 2], [2, 1, 0], [1, 2, 0], [1, 2, 3]])
+        np.testing.assert_array_equal(remove_duplicate_faces(faces), [[0, 1, 2], [1, 2, 3]])
+
+    def test_remove_unreferenced_vertices(self):
+        vertices = np.arange(15, dtype=np.float64).reshape(5, 3)
+        compacted, faces = remove_unreferenced_vertices(vertices, np.array([[4, 2, 0]]))
+
+        np.testing.assert_array_equal(compacted, vertices[[0, 2, 4]])
+        np.testing.assert_array_equal(faces, [[2, 1, 0]])
+
+    def test_connected_components(self):
+        labels = connected_components(7, np.array([[5, 1], [1, 3], [6, 2], [2, 0]]))
+        np.testing.assert_array_equal(labels, [0, 1, 0, 1, 2, 1, 0])
+
+        # A long chain needs many hooking rounds without pointer jumping
+        chain = np.column_stack([np.arange(9999, 0, -1), np.arange(9998, -1, -1)])
+        self.assertTrue(np.all(connected_components(10000, chain) == 0))
+
+    def test_fix_winding(self):
+        faces = self.faces.copy()
+        flipped = np.random.default_rng(0).random(len(faces)) < 0.4
+        faces[flipped] = faces[flipped][:, ::-1]
+
+        np.testing.assert_array_equal(fix_winding(self.vertices, faces), self.faces)
+
+        # Closed meshes are oriented outwards
+        np.testing.assert_array_equal(fix_winding(self.vertices, self.faces[:, ::-1]), self.faces)
+
+    def test_fix_winding_open_patch(self):
+        # A 3 x 3 grid of quads, of which the faces of two quads are flipped
+        x, y = np.meshgrid(np.arange(4.0), np.arange(4.0), indexing='ij')
+        vertices = np.column_stack([x.ravel(), y.ravel(), np.zeros(16)])
+        index = np.arange(16).reshape(4, 4)
+        a, b, c, d = index[:-1, :-1].ravel(), index[1:, :-1].ravel(), index[1:, 1:].ravel(), index[:-1, 1:].ravel()
+        grid = np.concatenate([np.column_stack([a, b, c]), np.column_stack([a, c, d])])
+
+        faces = grid.copy()
+        faces[[0, 4, 9, 13]] = faces[[0, 4, 9, 13]][:, ::-1]
+
+        # The majority of the faces of an open patch keeps its orientation
+        np.testing.assert_array_equal(fix_winding(vertices, faces), grid)
+
+    def test_split_components(self):
+        other = self.vertices + [5.0, 0.0, 0.0]
+        box = trimesh.creation.box()
+        vertices = np.vstack([np.asarray(box.vertices) + 10.0, self.vertices, other])
+        faces = np.vstack([np.asarray(box.faces), self.faces + 8, self.faces + 8 + len(self.vertices)])
+
+        split_vertices, split_faces, ranges = split_components(vertices, faces)
+        self.assertEqual([face_stop - face_start for _, _, face_start, face_stop in ranges], [1280, 1280, 12])
+        self.assertEqual(ranges[-1][1::2], (len(vertices), len(faces)))
+
+        # Each component is a range of the vertices and the faces referring to them
+        vertex_start, vertex_stop, face_start, face_stop = ranges[1]
+        np.testing.assert_array_equal(split_vertices[vertex_start:vertex_stop], other)
+        np.testing.assert_array_equal(split_faces[face_start:face_stop] - vertex_start, self.faces)
+
+        # The reordered mesh has the same triangles
+        self.assertEqual(sorted(map(tuple, split_vertices[split_faces].reshape(-1, 9))),
+                         sorted(map(tuple, vertices[faces].reshape(-1, 9))))
+
+    def test_pipeline(self):
+        # A triangle soup of two spheres with duplicated and degenerate faces
+        vertices = np.vstack([self.vertices, self.vertices + [3.0, 0.0, 0.0]])
+        faces = np.vstack([self.faces, self.faces[:, ::-1] + len(self.vertices), self.faces[:10], [[0, 0, 1]]])
+        soup = vertices[faces].reshape(-1, 3)
+
+        vertices, faces, components, report = Pipeline(STEPS).run(soup, np.arange(len(soup)).reshape(-1, 3))
+
+        self.assertEqual(report['vertices'], [len(soup), 2 * len(self.vertices)])
+        self.assertEqual(report['faces'], [2 * len(self.faces) + 11, 2 * len(self.faces)])
+        self.assertEqual(report['components'], 2)
+        self.assertEqual(list(report['timings']), ['merge', 'degenerate', 'duplicate', 'winding', 'split'])
+
+        for vertex_start, vertex_stop, face_start, face_stop in components:
+            mesh = trimesh.Trimesh(vertices[vertex_start:vertex_stop], faces[face_start:face_stop] - vertex_start, process=False)
+            self.assertTrue(mesh.is_volume)
+            self.assertGreater(mesh.volume, 0.0)
+
+    def test_small_components(self):
+        box = trimesh.creation.box()
+        vertices = np.vstack([self.vertices, self.vertices + [3.0, 0.0, 0.0], np.asarray(box.vertices) + 6.0])
+        faces = np.vstack([self.faces, self.faces + len(self.vertices), np.asarray(box.faces) + 2 * len(self.vertices)])
+
+        # Components below the minimum face count are kept in the mesh and reported
+        vertices, faces, components, report = Pipeline(['split']).run(vertices, faces)
+        self.assertEqual([face_stop - face_start for _, _, face_start, face_stop in components], [1280, 1280])
+        self.assertEqual(len(faces), 2572)
+        self.assertEqual((report['components'], report['small_components'], report['small_component_faces']), (2, 1, 12))
+
+    def test_pipeline_steps(self):
+        self.assertNotIn('split', Pipeline().steps)
+
+        pipeline = Pipeline(steps=['split', 'merge'])
+        self.assertEqual(pipeline.steps, ['merge', 'split'])
+
+        _, _, components, report = pipeline.run(self.vertices, self.faces)
+        self.assertEqual(components, [])
+        self.assertEqual(report['components'], 1)
+
+        with self.assertRaises(ValueError):
+            Pipeline(steps=['smooth'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,15 @@
 
+import h5py
 import unittest
 import os
 import shutil
 import tempfile
+import threading
 import trimesh
 
+from concurrent import futures
+
+from elements.files import open_file
 from elements.project import Project
 from elements.mesh import Mesh
 
@@ -117,6 +122,329 @@ class TestProject(unittest.TestCase):
             children = loaded_project.get_children()
             self.assertIn(mesh.name, [child.name for child in children])
 
+    def test_lazy_load(self):
+
+        test_file = self.dir + '/test_lazy.zinspector'
+        saved_project = Project('Test project')
+        saved_project.add_mesh(Mesh('Mesh 1', trimesh.creation.box()))
+        saved_project.add_mesh(Mesh('Mesh 2', trimesh.creation.cylinder(100, 200)))
+        saved_project.save(test_file)
+
+        loaded_project = Project(None)
+        loaded_project.load(test_file, lazy=True)
+
+        # Only the metadata is available before the geometry is accessed
+        self.assertEqual(loaded_project.get_name(), 'Test project')
+        self.assertEqual(['Mesh 1', 'Mesh 2'], sorted(mesh.get_name() for mesh in loaded_project.meshes))
+        self.assertFalse(any(mesh.is_loaded() for mesh in loaded_project.meshes))
+
+        loaded_mesh = next(mesh for mesh in loaded_project.meshes if mesh.name == 'Mesh 2')
+        other_mesh = next(mesh for mesh in loaded_project.meshes if mesh.name == 'Mesh 1')
+        self.assertEqual(len(saved_project.meshes[1].data.faces), len(loaded_mesh.data.faces))
+        self.assertTrue(loaded_mesh.is_loaded())
+        self.assertFalse(other_mesh.is_loaded())
+
+        # Saving over the source file must not lose the geometry of unloaded meshes
+        loaded_project.save(test_file)
+
+        reloaded_project = Project(None)
+        reloaded_project.load(test_file)
+        for saved_mesh in saved_project.meshes:
+            reloaded_mesh = next(mesh for mesh in reloaded_project.meshes if mesh.name == saved_mesh.name)
+            self.assertEqual(len(saved_mesh.data.faces), len(reloaded_mesh.data.faces))
+
+    def test_incremental_save(self):
+
+        test_file = self.dir + '/test_incremental.zinspector'
+        project = Project('Test project')
+        project.add_mesh(Mesh('Mesh 1', trimesh.creation.box()))
+        project.add_mesh(Mesh('Mesh 2', trimesh.creation.cylinder(100, 200)))
+        project.save(test_file)
+
+        self.assertFalse(project.is_modified())
+        self.assertFalse(any(mesh.is_modified() for mesh in project.meshes))
+
+        with h5py.File(test_file, 'r') as f:
+            groups = set(f['meshes'].keys())
+
+        # Add, change and remove meshes and save incrementally
+        added = Mesh('Mesh 3', trimesh.creation.icosphere(2))
+        project.add_mesh(added)
+        project.meshes[0].data = trimesh.creation.box((2, 2, 2))
+        project.remove_mesh(project.meshes[1])
+
+        self.assertTrue(project.is_modified())
+        self.assertTrue(project.meshes[0].is_modified())
+
+        project.save(test_file, incremental=True)
+
+        self.assertFalse(os.path.exists(test_file + '.tmp'))
+        self.assertFalse(any(mesh.is_modified() for mesh in project.meshes))
+
+        with h5py.File(test_file, 'r') as f:
+            new_groups = set(f['meshes'].keys())
+            names = sorted(group.attrs['name'] for group in f['meshes'].values())
+
+        self.assertEqual(names, ['Mesh 1', 'Mesh 3'])
+        self.assertEqual(len(groups - new_groups), 1)
+
+        loaded_project = Project(None)
+        loaded_project.load(test_file)
+        self.assertEqual(sorted(mesh.name for mesh in loaded_project.meshes), ['Mesh 1', 'Mesh 3'])
+
+        loaded_mesh = next(mesh for mesh in loaded_project.meshes if mesh.name == 'Mesh 1')
+        self.assertAlmostEqual(loaded_mesh.data.volume, 8.0)
+
+        # Unchanged meshes are neither rewritten nor loaded by an incremental save
+        lazy_project = Project(None)
+        lazy_project.load(test_file, lazy=True)
+        lazy_project.add_mesh(Mesh('Mesh 4', trimesh.creation.box()))
+        lazy_project.save(test_file, incremental=True)
+
+        with h5py.File(test_file, 'r') as f:
+            self.assertTrue(new_groups < set(f['meshes'].keys()))
+
+        self.assertFalse(any(mesh.is_loaded() for mesh in lazy_project.meshes if mesh.name != 'Mesh 4'))
+        self.assertAlmostEqual(next(mesh for mesh in lazy_project.meshes if mesh.name == 'Mesh 1').data.volume, 8.0)
+
+    def test_save_spatial_index(self):
+
+        test_file = self.dir + '/test_bvh.zinspector'
+        project = Project('Test project')
+        project.add_mesh(Mesh('Mesh 1', trimesh.creation.icosphere(2)))
+        project.save(test_file)
+
+        # A hierarchy built for an unchanged mesh is added by the next incremental save
+        loaded_project = Project(None)
+        loaded_project.load(test_file, lazy=True)
+        loaded_project.meshes[0].get_bvh()
+        loaded_project.save(test_file, incremental=True)
+
+        with h5py.File(test_file, 'r') as f:
+            self.assertTrue(all('bvh' in group for group in f['meshes'].values()))
+
+    def test_child_meshes(self):
+
+        test_file = self.dir + '/test_children.zinspector'
+        project = Project('Test project')
+        mesh = Mesh('Assembly', trimesh.creation.box())
+        mesh.add_child(Mesh('Component 1', trimesh.creation.icosphere(2)))
+        mesh.add_child(Mesh('Component 2', trimesh.creation.box((2, 2, 2))))
+        mesh.set_preprocessing({'steps': ['split'], 'components': 2})
+        project.add_mesh(mesh)
+        project.save(test_file)
+
+        loaded_project = Project(None)
+        loaded_project.load(test_file, lazy=True)
+        loaded_mesh = loaded_project.meshes[0]
+
+        self.assertEqual([child.get_name() for child in loaded_mesh.get_children()], ['Component 1', 'Component 2'])
+        self.assertIs(loaded_mesh.get_children()[0].get_parent(), loaded_mesh)
+        self.assertEqual(loaded_mesh.get_preprocessing(), {'steps': ['split'], 'components': 2})
+        self.assertFalse(loaded_mesh.is_modified())
+
+        # Changing a child marks its mesh as changed, the geometry of the mesh itself is
+        # copied over by the next save
+        loaded_mesh.get_children()[1].set_name('Renamed')
+        self.assertTrue(loaded_mesh.is_modified())
+        loaded_project.save(test_file, incremental=True)
+
+        self.assertFalse(loaded_mesh.is_loaded())
+        self.assertFalse(loaded_mesh.is_modified())
+        self.assertAlmostEqual(loaded_mesh.get_children()[1].data.volume, 8.0)
+
+        reloaded_project = Project(None)
+        reloaded_project.load(test_file)
+        reloaded_mesh = reloaded_project.meshes[0]
+        self.assertEqual([child.get_name() for child in reloaded_mesh.get_children()], ['Component 1', 'Renamed'])
+        self.assertEqual(len(reloaded_mesh.data.faces), 12)
+        self.assertEqual(reloaded_mesh.get_preprocessing()['components'], 2)
+
+    def test_component_ranges(self):
+
+        test_file = self.dir + '/test_ranges.zinspector'
+        project = Project('Test project')
+        data = trimesh.util.concatenate([trimesh.creation.icosphere(2), trimesh.creation.box()])
+        mesh = Mesh('Assembly', data)
+        for index, part in enumerate([(0, 162, 0, 320), (162, 170, 320, 332)]):
+            child = Mesh(f'Component {index + 1}', None)
+            child.set_range(part)
+            mesh.add_child(child)
+        project.add_mesh(mesh)
+        project.save(test_file)
+
+        # Only the ranges of the components are stored
+        with h5py.File(test_file, 'r') as f:
+            group = f[mesh.get_children()[1].get_location()[1]]
+            self.assertNotIn('vertices', group)
+            self.assertEqual(group.attrs['range'].tolist(), [162, 170, 320, 332])
+
+        loaded_project = Project(None)
+        loaded_project.load(test_file, lazy=True)
+        loaded_mesh = loaded_project.meshes[0]
+        box = loaded_mesh.get_children()[1]
+
+        self.assertEqual(box.get_face_count(), 12)
+        self.assertEqual(box.get_info()['vertices'], 8)
+        self.assertFalse(box.is_loaded())
+        self.assertAlmostEqual(box.data.volume, 1.0)
+        self.assertTrue(box.is_loaded())
+
+        # Replacing the geometry of the mesh gives the components a copy of their range
+        sphere = trimesh.creation.icosphere(1)
+        loaded_mesh.set_arrays(sphere.vertices, sphere.faces)
+        self.assertIsNone(box.get_range())
+        self.assertEqual(box.get_face_count(), 12)
+        loaded_project.save(test_file, incremental=True)
+
+        reloaded_project = Project(None)
+        reloaded_project.load(test_file)
+        reloaded_mesh = reloaded_project.meshes[0]
+        self.assertEqual(len(reloaded_mesh.data.faces), 80)
+        self.assertEqual([len(child.data.faces) for child in reloaded_mesh.get_children()], [320, 12])
+        self.assertAlmostEqual(reloaded_mesh.get_children()[1].data.volume, 1.0)
+
+    def test_full_save_keeps_lazy_meshes(self):
+
+        test_file = self.dir + '/test_full.zinspector'
+        project = Project('Test project')
+        project.add_mesh(Mesh('Mesh 1', trimesh.creation.icosphere(3)))
+        project.save(test_file)
+
+        lazy_project = Project(None)
+        lazy_project.load(test_file, lazy=True)
+        lazy_project.save(test_file)
+
+        self.assertFalse(os.path.exists(test_file + '.tmp'))
+        self.assertFalse(lazy_project.meshes[0].is_loaded())
+        self.assertEqual(len(lazy_project.meshes[0].data.faces), len(project.meshes[0].data.faces))
+
+    def test_repack(self):
+
+        test_file = self.dir + '/test_repack.zinspector'
+        project = Project('Test project')
+        project.add_mesh(Mesh('Mesh 1', trimesh.creation.icosphere(4)))
+        project.save(test_file)
+
+        size = os.path.getsize(test_file)
+
+        # Replacing the only mesh leaves mostly unused space in the file
+        project.meshes[0].data = trimesh.creation.icosphere(4)
+        project.save(test_file, incremental=True)
+        self.assertGreater(os.path.getsize(test_file), size)
+
+        # The file is repacked as soon as the unused space exceeds the limits
+        ratio, min_size = Project.REPACK_RATIO, Project.REPACK_MIN_SIZE
+        try:
+            Project.REPACK_RATIO, Project.REPACK_MIN_SIZE = 0.1, 0
+            project.meshes[0].data = trimesh.creation.icosphere(4)
+            project.save(test_file, incremental=True)
+        finally:
+            Project.REPACK_RATIO, Project.REPACK_MIN_SIZE = ratio, min_size
+
+        self.assertLessEqual(os.path.getsize(test_file), size)
+
+        with h5py.File(test_file, 'r') as f:
+            self.assertEqual(len(f['meshes']), 1)
+
+    def test_interrupted_incremental_save(self):
+
+        test_file = self.dir + '/test_interrupted.zinspector'
+        project = Project('Test project')
+        project.add_mesh(Mesh('Mesh 1', trimesh.creation.box()))
+        project.save(test_file)
+
+        # Simulate a crash while a new mesh was written
+        class FailingMesh(Mesh):
+            __slots__ = ()
+
+            def __save__(self, parent):
+                super().__save__(parent)
+                raise OSError('Disk full')
+
+        project.add_mesh(FailingMesh('Mesh 2', trimesh.creation.box()))
+        with self.assertRaises(OSError):
+            project.save(test_file, incremental=True)
+
+        # The project file is left as it was
+        loaded_project = Project(None)
+        loaded_project.load(test_file)
+        self.assertEqual([mesh.name for mesh in loaded_project.meshes], ['Mesh 1'])
+
+    def test_incremental_save_in_place(self):
+
+        test_file = self.dir + '/test_in_place.zinspector'
+        project = Project('Test project')
+        project.add_mesh(Mesh('Sphere', trimesh.creation.icosphere(5)))
+        project.save(test_file)
+
+        def offsets():
+            # File offsets of the data of all datasets
+            with h5py.File(test_file, 'r') as f:
+                return {dset.name: dset.id.get_offset() if dset.chunks is None else dset.id.get_chunk_info(0).byte_offset
+                        for dset in Project.__datasets__(f) if dset.size}
+
+        before, stat = offsets(), os.stat(test_file)
+
+        project.add_mesh(Mesh('Box', trimesh.creation.box()))
+        project.save(test_file, incremental=True)
+
+        # The new mesh is written into the file, which is neither copied nor replaced and
+        # where the data of the unchanged mesh stays in place
+        after = offsets()
+        self.assertEqual(os.stat(test_file).st_ino, stat.st_ino)
+        self.assertEqual({name: after[name] for name in before}, before)
+        self.assertGreater(len(after), len(before))
+        self.assertLess(os.path.getsize(test_file) - stat.st_size, stat.st_size / 10)
+
+        loaded_project = Project(None)
+        loaded_project.load(test_file)
+        self.assertEqual(sorted(mesh.name for mesh in loaded_project.meshes), ['Box', 'Sphere'])
+
+    def test_incremental_save_while_reading(self):
+
+        test_file = self.dir + '/test_reading.zinspector'
+        project = Project('Test project')
+        project.add_mesh(Mesh('Mesh 1', trimesh.creation.box()))
+        project.save(test_file)
+
+        lazy_project = Project(None)
+        lazy_project.load(test_file, lazy=True)
+        lazy_mesh = lazy_project.meshes[0]
+
+        # Another thread keeps the project file open for reading the geometry of a mesh
+        opened, release = threading.Event(), threading.Event()
+
+        def read():
+            with open_file(test_file) as f:
+                opened.set()
+                release.wait(timeout=60)
+                return len(f[lazy_mesh.get_location()[1]]['faces'])
+
+        lazy_project.add_mesh(Mesh('Mesh 2', trimesh.creation.icosphere(2)))
+
+        with futures.ThreadPoolExecutor(max_workers=2) as executor:
+            reader = executor.submit(read)
+            self.assertTrue(opened.wait(timeout=60))
+
+            # The save waits until the reader has closed the file
+            try:
+                saving = executor.submit(lazy_project.save, test_file, True)
+                with self.assertRaises(futures.TimeoutError):
+                    saving.result(timeout=0.2)
+            finally:
+                release.set()
+
+            self.assertEqual(reader.result(), 12)
+            saving.result(timeout=60)
+
+        self.assertFalse(lazy_mesh.is_loaded())
+        self.assertEqual(len(lazy_mesh.data.faces), 12)
+
+        loaded_project = Project(None)
+        loaded_project.load(test_file)
+        self.assertEqual(sorted(mesh.name for mesh in loaded_project.meshes), ['Mesh 1', 'Mesh 2'])
+
 
 if __name__ == '__main__':
     unittest.main()
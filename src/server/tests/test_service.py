@@ -0,0 +1,477 @@
+import asyncio
+import gc
+import grpc
+import os
+import sys
+import tempfile
+import threading
+import trimesh
+import unittest
+
+from grpc_tools import protoc
+
+from elements.memory import GeometryManager
+from elements.mesh import Mesh
+from elements.project import Project
+
+
+def setUpModule():
+    '''
+    Compile the service definition like setup.py does, unless the generated modules are
+    available already, and import the service.
+    '''
+    global service, zinspector, zinspector_pb2, zinspector_pb2_grpc, directory
+
+    directory = tempfile.TemporaryDirectory()
+    try:
+        import zinspector_pb2  # noqa: F401
+    except ImportError:
+        proto_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        if protoc.main(['grpc_tools.protoc', f'--proto_path={proto_path}', f'--python_out={directory.name}',
+                        f'--grpc_python_out={directory.name}', os.path.join(proto_path, 'zinspector.proto')]) != 0:
+            raise RuntimeError('Failed to compile zinspector.proto')
+        sys.path.insert(0, directory.name)
+
+    import service
+    import zinspector
+    import zinspector_pb2
+    import zinspector_pb2_grpc
+
+
+def tearDownModule():
+    if directory.name in sys.path:
+        sys.path.remove(directory.name)
+    directory.cleanup()
+
+
+class Context:
+    '''
+    Servicer context recording the status set by a call.
+    '''
+
+    def __init__(self):
+        self.code = None
+        self.details = None
+
+    def set_code(self, code):
+        self.code = code
+
+    def set_details(self, details):
+        self.details = details
+
+
+class TestZInspector(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.service = service.ZInspector(chunk_size=1000, import_workers=1, compute_workers=2, preprocess=[])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.service.shutdown()
+
+    def setUp(self):
+        self.project = Project('Test project')
+        service.ZInspector.root.add_project(self.project)
+
+    def tearDown(self):
+        for project in list(service.ZInspector.root.projects):
+            service.ZInspector.root.remove_project(project)
+            self.service.__release__(project)
+
+    def add_mesh(self, name='Box'):
+        mesh = Mesh(name, trimesh.creation.box())
+        self.project.add_mesh(mesh)
+        return mesh
+
+    def call(self, method, request):
+        '''
+        Call a unary method of the service with a new context. Returns the response and
+        the context.
+        '''
+        context = Context()
+        return asyncio.run(getattr(self.service, method)(request, context)), context
+
+    def stream(self, method, request):
+        '''
+        Call a streaming method of the service with a new context. Returns the list of
+        responses and the context.
+        '''
+        context = Context()
+
+        async def collect():
+            return [response async for response in getattr(self.service, method)(request, context)]
+
+        return asyncio.run(collect()), context
+
+    def cached(self, mesh):
+        return [key for key in service.ZInspector.cache._entries if key[0] == mesh.get_id()]
+
+    def test_cache_discarded_with_geometry(self):
+        mesh, other = self.add_mesh(), self.add_mesh('Other')
+        for obj in [mesh, other]:
+            self.service.__encode_mesh__(obj, 0, 'raw')
+
+        self.assertEqual(len(self.cached(mesh)), 1)
+
+        # Replacing the geometry drops the payloads of the previous version only
+        box = trimesh.creation.box(extents=[2, 2, 2])
+        mesh.set_arrays(box.vertices, box.faces)
+        self.assertEqual(self.cached(mesh), [])
+        self.assertEqual(len(self.cached(other)), 1)
+
+        self.service.__encode_mesh__(mesh, 0, 'raw')
+        self.project.remove_mesh(mesh)
+        self.assertEqual(self.cached(mesh), [])
+
+        # Closing the project drops the payloads of all of its meshes
+        service.ZInspector.root.remove_project(self.project)
+        self.assertEqual(self.cached(other), [])
+
+    def save(self, directory):
+        '''
+        Save the test project with two meshes into a new file. Returns its path.
+        '''
+        self.add_mesh()
+        self.project.add_mesh(Mesh('Sphere', trimesh.creation.icosphere(2)))
+
+        path = os.path.join(directory, 'test.zinspector')
+        _, context = self.call('SaveProject', zinspector_pb2.SaveProjectRequest(id=self.project.get_id(), path=path))
+        self.assertIsNone(context.code)
+        return path
+
+    def test_open_project(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.save(directory)
+
+            # Opening the file of an open project returns the open project
+            response, _ = self.call('OpenProject', zinspector_pb2.OpenProjectRequest(path=path))
+            self.assertEqual(list(response.ids), [self.project.get_id()])
+
+            _, context = self.call('CloseProject', zinspector_pb2.IdRequest(id=self.project.get_id()))
+            self.assertIsNone(context.code)
+            self.assertNotIn(self.project, service.ZInspector.root.projects)
+
+            response, _ = self.call('OpenProject', zinspector_pb2.OpenProjectRequest(path=path, lazy=True))
+            project, = service.ZInspector.root.projects
+            self.assertEqual(list(response.ids), [project.get_id()])
+            self.assertNotEqual(project.get_id(), self.project.get_id())
+            self.assertEqual(sorted(mesh.get_name() for mesh in project.meshes), ['Box', 'Sphere'])
+            self.assertFalse(any(mesh.is_loaded() for mesh in project.meshes))
+            self.assertNotIn(project.get_id(), self.service.project_workers)
+
+            response, _ = self.call('OpenProject', zinspector_pb2.OpenProjectRequest(path=path, isolated=True))
+            self.assertEqual(list(response.ids), [project.get_id()])
+
+            # Changes are saved incrementally into the file the project has been opened from
+            next(mesh for mesh in project.meshes if mesh.get_name() == 'Box').set_name('Renamed')
+            _, context = self.call('SaveProject', zinspector_pb2.SaveProjectRequest(id=project.get_id()))
+            self.assertIsNone(context.code)
+
+            reloaded = Project(None)
+            reloaded.load(path)
+            self.assertEqual(sorted(mesh.get_name() for mesh in reloaded.meshes), ['Renamed', 'Sphere'])
+
+    def test_close_project(self):
+        old_manager = Mesh.geometry_manager
+        manager = Mesh.geometry_manager = GeometryManager(1 << 30)
+
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                path = self.save(directory)
+                service.ZInspector.root.remove_project(self.project)
+                self.project = None
+
+                response, _ = self.call('OpenProject', zinspector_pb2.OpenProjectRequest(path=path, isolated=True))
+                project_id, = response.ids
+                project = service.ZInspector.root.projects[0]
+                workers = self.service.project_workers[project_id]
+
+                meshes = project.meshes
+                mesh_id = meshes[0].get_id()
+                self.stream('GetMeshData', zinspector_pb2.MeshDataRequest(id=mesh_id, encoding='raw'))
+                self.assertEqual(len(self.cached(meshes[0])), 1)
+                self.assertEqual(manager.stats()['meshes'], 2)
+
+                _, context = self.call('CloseProject', zinspector_pb2.IdRequest(id=project_id))
+                self.assertIsNone(context.code)
+
+                # The payloads, the resident geometry and the workers of the project are released
+                self.assertEqual(self.cached(meshes[0]), [])
+                # The finished calls may still refer to the meshes from reference cycles
+                del project, meshes
+                gc.collect()
+                self.assertEqual(manager.stats()['meshes'], 0)
+
+                self.assertEqual(self.service.project_workers, {})
+                with self.assertRaises(RuntimeError):
+                    asyncio.run(workers.run(len, []))
+
+                chunks, context = self.stream('GetMeshData', zinspector_pb2.MeshDataRequest(id=mesh_id))
+                self.assertEqual(context.code, grpc.StatusCode.NOT_FOUND)
+
+                _, context = self.call('CloseProject', zinspector_pb2.IdRequest(id=project_id))
+                self.assertEqual(context.code, grpc.StatusCode.NOT_FOUND)
+        finally:
+            Mesh.geometry_manager = old_manager
+            manager.close()
+
+    def test_project_errors(self):
+        _, context = self.call('SaveProject', zinspector_pb2.SaveProjectRequest(id=self.project.get_id()))
+        self.assertEqual(context.code, grpc.StatusCode.INVALID_ARGUMENT)
+
+        _, context = self.call('SaveProject', zinspector_pb2.SaveProjectRequest(id='unknown', path='unknown.zinspector'))
+        self.assertEqual(context.code, grpc.StatusCode.NOT_FOUND)
+
+        with tempfile.TemporaryDirectory() as directory:
+            request = zinspector_pb2.OpenProjectRequest(path=os.path.join(directory, 'missing.zinspector'), isolated=True)
+            response, context = self.call('OpenProject', request)
+
+        self.assertEqual(list(response.ids), [])
+        self.assertEqual(context.code, grpc.StatusCode.NOT_FOUND)
+        self.assertEqual(service.ZInspector.root.projects, [self.project])
+        self.assertEqual(self.service.project_workers, {})
+
+    def test_get_objects(self):
+        meshes = [self.add_mesh(f'Mesh {index}') for index in range(3)]
+        self.project.remove_mesh(meshes[1])
+        meshes[0].add_child(Mesh('Component', trimesh.creation.box()))
+
+        response, _ = self.call('GetObjects', zinspector_pb2.IdRequest(id=self.project.get_id()))
+        self.assertEqual(list(response.ids), [meshes[0].get_id(), meshes[2].get_id()])
+
+        response, _ = self.call('GetObjectInfo', zinspector_pb2.ObjectInfoRequest(parent=self.project.get_id()))
+        self.assertEqual([info.name for info in response.objects], ['Mesh 0', 'Mesh 2'])
+        self.assertEqual(response.objects[0].children, 1)
+
+        # The metadata is collected outside of the event loop, as it may need the geometry
+        threads = []
+        get_info = Mesh.get_info
+
+        def record(mesh):
+            threads.append(threading.current_thread())
+            return get_info(mesh)
+
+        Mesh.get_info = record
+        try:
+            ids = [meshes[2].get_id(), 'unknown', meshes[0].get_id()]
+            response, _ = self.call('GetObjectInfo', zinspector_pb2.ObjectInfoRequest(ids=ids))
+        finally:
+            Mesh.get_info = get_info
+
+        self.assertEqual([info.found for info in response.objects], [True, False, True])
+        self.assertEqual([info.name for info in response.objects], ['Mesh 2', '', 'Mesh 0'])
+        self.assertEqual(response.objects[1].id, 'unknown')
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.current_thread(), threads)
+
+        response, _ = self.call('GetObjects', zinspector_pb2.IdRequest())
+        self.assertIn(self.project.get_id(), response.ids)
+
+        response, context = self.call('GetObjects', zinspector_pb2.IdRequest(id='unknown'))
+        self.assertEqual(list(response.ids), [])
+        self.assertEqual(context.code, grpc.StatusCode.NOT_FOUND)
+
+    def test_get_mesh_data(self):
+        mesh = Mesh('Sphere', trimesh.creation.icosphere(2))
+        self.project.add_mesh(mesh)
+
+        chunks, context = self.stream('GetMeshData', zinspector_pb2.MeshDataRequest(id=mesh.get_id(), encoding='raw'))
+        data = b''.join(chunk.data for chunk in chunks)
+        size, etag = chunks[0].size, chunks[0].etag
+
+        self.assertIsNone(context.code)
+        self.assertGreater(len(chunks), 2)
+        self.assertEqual(len(data), size)
+        self.assertEqual([chunk.offset for chunk in chunks], list(range(0, size, 1000)))
+        self.assertTrue(all(chunk.size == size and chunk.faces == 320 for chunk in chunks))
+
+        # Only the first chunk carries the entity tag
+        self.assertTrue(etag)
+        self.assertEqual([chunk.etag for chunk in chunks[1:]], [''] * (len(chunks) - 1))
+
+        # Ranges are clamped to the end of the payload
+        for offset, length in [(100, 1500), (size - 10, 1000), (0, size + 1)]:
+            request = zinspector_pb2.MeshDataRequest(id=mesh.get_id(), encoding='raw', offset=offset, length=length)
+            chunks, _ = self.stream('GetMeshData', request)
+            self.assertEqual(b''.join(chunk.data for chunk in chunks), data[offset:offset + length])
+            self.assertEqual(chunks[0].offset, offset)
+            self.assertEqual(chunks[0].etag, etag)
+
+        # A range at the end yields a single empty chunk with the size and the tag
+        chunks, _ = self.stream('GetMeshData', zinspector_pb2.MeshDataRequest(id=mesh.get_id(), encoding='raw', offset=size))
+        self.assertEqual([(chunk.data, chunk.offset, chunk.size, chunk.etag) for chunk in chunks], [(b'', size, size, etag)])
+
+        # The payload is not sent again if the client has it
+        chunks, _ = self.stream('GetMeshData', zinspector_pb2.MeshDataRequest(id=mesh.get_id(), encoding='raw', etag=etag))
+        self.assertEqual(len(chunks), 1)
+        self.assertTrue(chunks[0].not_modified)
+        self.assertEqual(chunks[0].data, b'')
+
+    def test_get_mesh_data_errors(self):
+        mesh = self.add_mesh()
+
+        for request, code in [
+                (zinspector_pb2.MeshDataRequest(id=mesh.get_id(), encoding='bogus'), grpc.StatusCode.INVALID_ARGUMENT),
+                (zinspector_pb2.MeshDataRequest(id=mesh.get_id(), offset=-1), grpc.StatusCode.INVALID_ARGUMENT),
+                (zinspector_pb2.MeshDataRequest(id=mesh.get_id(), offset=1 << 30), grpc.StatusCode.INVALID_ARGUMENT),
+                (zinspector_pb2.MeshDataRequest(id=self.project.get_id()), grpc.StatusCode.INVALID_ARGUMENT),
+                (zinspector_pb2.MeshDataRequest(id='unknown'), grpc.StatusCode.NOT_FOUND)]:
+            chunks, context = self.stream('GetMeshData', request)
+            self.assertEqual(chunks, [])
+            self.assertEqual(context.code, code)
+
+
+class TestServer(unittest.TestCase):
+    '''
+    Calls through a gRPC server running in the same process.
+    '''
+
+    OPTIONS = {'chunk_size': 1000, 'import_workers': 1, 'compute_workers': 2, 'preprocess': []}
+
+    def tearDown(self):
+        for project in list(service.ZInspector.root.projects):
+            service.ZInspector.root.remove_project(project)
+
+    def serve(self, test):
+        '''
+        Serve a new Frontend and run the test coroutine function with the frontend and a
+        client stub. The service is not started. Returns the result of the test.
+        '''
+        async def run():
+            frontend = zinspector.Frontend()
+            server = grpc.aio.server()
+            zinspector_pb2_grpc.add_ZInspectorServicer_to_server(frontend, server)
+            port = server.add_insecure_port('localhost:0')
+            await server.start()
+
+            try:
+                async with grpc.aio.insecure_channel(f'localhost:{port}') as channel:
+                    return await test(frontend, zinspector_pb2_grpc.ZInspectorStub(channel))
+            finally:
+                await server.stop(None)
+                frontend.close()
+
+        return asyncio.run(run())
+
+    def add_mesh(self, data):
+        project = Project('Test project')
+        service.ZInspector.root.add_project(project)
+        mesh = Mesh('Mesh', data)
+        project.add_mesh(mesh)
+        return mesh
+
+    def test_forwarding(self):
+        async def test(frontend, stub):
+            # Calls wait until the service has been loaded, while Health is answered
+            pending = asyncio.ensure_future(stub.CreateProject(zinspector_pb2.CreateProjectRequest(name='Test project')))
+            response = await stub.Health(zinspector_pb2.HealthRequest())
+            self.assertEqual(response.state, zinspector.Frontend.STARTING)
+            self.assertFalse(pending.done())
+
+            await frontend.start(**self.OPTIONS)
+            response = await asyncio.wait_for(pending, 10)
+            self.assertEqual((await stub.GetName(zinspector_pb2.IdRequest(id=response.ids[0]))).name, 'Test project')
+
+            response = await stub.Health(zinspector_pb2.HealthRequest(wait=True))
+            self.assertTrue(response.ready)
+
+            # Errors of the service are passed on
+            with self.assertRaises(grpc.aio.AioRpcError) as error:
+                await stub.GetObjects(zinspector_pb2.IdRequest(id='unknown'))
+            self.assertEqual(error.exception.code(), grpc.StatusCode.NOT_FOUND)
+
+        self.serve(test)
+
+    def test_failed_start(self):
+        async def test(frontend, stub):
+            await frontend.start(unknown=True)
+
+            response = await stub.Health(zinspector_pb2.HealthRequest(wait=True))
+            self.assertEqual(response.state, zinspector.Frontend.FAILED)
+            self.assertIn('unknown', response.message)
+
+            for call in [stub.GetObjects(zinspector_pb2.IdRequest()),
+                         stub.GetMeshData(zinspector_pb2.MeshDataRequest(id='unknown')).read()]:
+                with self.assertRaises(grpc.aio.AioRpcError) as error:
+                    await call
+                self.assertEqual(error.exception.code(), grpc.StatusCode.UNAVAILABLE)
+
+        self.serve(test)
+
+    def test_cancel_stream(self):
+        mesh = self.add_mesh(trimesh.creation.icosphere(6))
+        events = []
+
+        async def test(frontend, stub):
+            await frontend.start(**self.OPTIONS)
+
+            # Record how far the service streams the payload
+            stream = frontend.service.GetMeshData
+
+            async def record(request, context):
+                try:
+                    async for chunk in stream(request, context):
+                        events.append('chunk')
+                        yield chunk
+                    events.append('done')
+                finally:
+                    events.append('closed')
+
+            frontend.service.GetMeshData = record
+
+            call = stub.GetMeshData(zinspector_pb2.MeshDataRequest(id=mesh.get_id(), encoding='raw'))
+            chunk = await call.read()
+            call.cancel()
+
+            with self.assertRaises(asyncio.CancelledError):
+                await call.read()
+            self.assertEqual(await call.code(), grpc.StatusCode.CANCELLED)
+
+            while 'closed' not in events:
+                await asyncio.sleep(0.01)
+
+            return chunk.size
+
+        size = self.serve(test)
+
+        # The service stops streaming once the client has cancelled the call
+        self.assertNotIn('done', events)
+        self.assertLess(events.count('chunk'), size // 1000)
+
+    def test_worker_limits(self):
+        mesh = self.add_mesh(trimesh.creation.icosphere(3))
+        release = threading.Event()
+
+        async def test(frontend, stub):
+            await frontend.start(**self.OPTIONS)
+            workers = frontend.service.workers
+
+            try:
+                # Occupy all compute threads, further CPU heavy calls wait for a free one
+                blocked = [asyncio.ensure_future(workers.run(release.wait)) for _ in range(workers.compute_workers)]
+                await asyncio.sleep(0.1)
+
+                request = zinspector_pb2.MeshDataRequest(id=mesh.get_id(), encoding='raw')
+                data = asyncio.ensure_future(collect(stub.GetMeshData(request)))
+
+                # Metadata calls are answered on the event loop meanwhile
+                response = await asyncio.wait_for(stub.GetName(zinspector_pb2.IdRequest(id=mesh.get_id())), 5)
+                self.assertEqual(response.name, 'Mesh')
+                await asyncio.sleep(0.1)
+                self.assertFalse(data.done())
+            finally:
+                release.set()
+
+            await asyncio.gather(*blocked)
+            return await asyncio.wait_for(data, 10)
+
+        async def collect(call):
+            return [chunk async for chunk in call]
+
+        chunks = self.serve(test)
+        self.assertEqual(sum(len(chunk.data) for chunk in chunks), chunks[0].size)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import multiprocessing
+import time
+import unittest
+import numpy as np
+
+from concurrent import futures
+
+from elements.shared import SharedArrays, map_ranges
+
+
+def fill_range(description, start, stop, value):
+    with SharedArrays(description=description) as shared:
+        time.sleep(0.05)
+        shared['data'][start:stop] = value
+        return stop - start
+
+
+class TestShared(unittest.TestCase):
+
+    def test_shared_arrays(self):
+        data = np.arange(12, dtype=np.float64).reshape(4, 3)
+
+        with SharedArrays({'data': data}) as shared:
+            attached = SharedArrays(description=shared.description)
+            np.testing.assert_array_equal(attached['data'], data)
+
+            attached['data'][0, 0] = -1
+            self.assertEqual(shared['data'][0, 0], -1)
+            attached.close()
+
+    def test_map_ranges(self):
+        ranges = [(0, 4), (4, 8), (8, 10)]
+
+        with futures.ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context('spawn')) as executor:
+            results = [(shared['data'][start:stop].copy(), count) for (start, stop), (shared, count)
+                       in zip(ranges, map_ranges(executor, fill_range, {'data': np.zeros(10)}, ranges, 1.0))]
+
+            self.assertEqual([count for _, count in results], [4, 4, 2])
+            self.assertTrue(all(np.all(values == 1.0) for values, _ in results))
+
+            # Closing the generator cancels the pending ranges and releases the shared memory
+            ranges = [(start, start + 1) for start in range(10)]
+            chunks = map_ranges(executor, fill_range, {'data': np.zeros(10)}, ranges, 1.0)
+            shared, _ = next(chunks)
+            description = shared.description
+            chunks.close()
+
+            with self.assertRaises(FileNotFoundError):
+                SharedArrays(description=description)
+
+
+if __name__ == '__main__':
+    unittest.main()
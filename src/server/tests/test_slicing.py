@@ -0,0 +1,150 @@
+import multiprocessing
+import unittest
+import numpy as np
+import trimesh
+
+from concurrent import futures
+
+from elements.slicing import EdgeIndex, chain_segments, link_segments, slice_mesh, slice_planes
+
+
+def polylines(result):
+    '''
+    Split the packed points of a plane into a list of polylines.
+    '''
+    points, lengths, _ = result
+    return np.split(points, np.cumsum(lengths)[:-1]) if len(lengths) else []
+
+
+def signed_area(points):
+    x, y = points[:, 0], points[:, 1]
+    return 0.5 * np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y)
+
+
+class TestSlicing(unittest.TestCase):
+
+    def slice(self, mesh, normal, offsets):
+        return slice_planes(mesh.vertices, mesh.faces, EdgeIndex.build(mesh.faces), normal, offsets)
+
+    def test_edge_index(self):
+        box = trimesh.creation.box()
+        index = EdgeIndex.build(box.faces)
+
+        self.assertEqual(len(index), 18)
+        self.assertTrue(np.all(index.edges[:, 0] < index.edges[:, 1]))
+
+        # Each face refers to its own edges
+        edges = np.sort(box.faces[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 3, 2), axis=2)
+        np.testing.assert_array_equal(index.edges[index.face_edges], edges)
+
+    def test_sphere(self):
+        sphere = trimesh.creation.icosphere(4)
+        offsets = [0.5, -2.0, 0.0]
+        results = self.slice(sphere, [0, 0, 2], offsets)
+
+        self.assertEqual(polylines(results[1]), [])
+
+        for offset, result in zip(offsets[::2], results[::2]):
+            section, = polylines(result)
+            self.assertTrue(result[2][0])
+
+            # The closed polyline lies in the plane on the circle of the section and runs
+            # counterclockwise around the sphere
+            np.testing.assert_allclose(section[:, 2], offset)
+            np.testing.assert_allclose(np.linalg.norm(section[:, :2], axis=1), np.sqrt(1 - offset ** 2), atol=1e-2)
+            self.assertGreater(signed_area(section), 0.0)
+            self.assertFalse(np.any(np.all(section == np.roll(section, 1, axis=0), axis=1)))
+
+    def test_hole(self):
+        # A tube around the z axis has an outer contour and a hole
+        tube = trimesh.creation.annulus(0.5, 1.0, 1.0)
+        sections = polylines(self.slice(tube, [0, 0, 1], [0.1])[0])
+
+        self.assertEqual(sorted(np.sign(signed_area(section)) for section in sections), [-1.0, 1.0])
+
+    def test_separate_parts(self):
+        sphere = trimesh.creation.icosphere(3)
+        parts = trimesh.util.concatenate([sphere, sphere.copy().apply_translation([3, 0, 0])])
+
+        points, lengths, closed = self.slice(parts, [0, 0, 1], [0.1])[0]
+        self.assertEqual(len(lengths), 2)
+        self.assertTrue(np.all(closed))
+        self.assertEqual(sorted(np.round(section[:, 0].mean()) for section in polylines((points, lengths, closed))), [0, 3])
+
+    def test_open_surface(self):
+        sphere = trimesh.creation.icosphere(3)
+        bowl = sphere.submesh([np.flatnonzero(sphere.triangles_center[:, 2] < 0)], append=True)
+
+        (points, lengths, closed), = self.slice(bowl, [1, 0, 0], [0.0])
+
+        # The open polyline ends on the rim of the bowl
+        self.assertEqual(len(lengths), 1)
+        self.assertFalse(closed[0])
+        self.assertEqual(lengths[0], len(points))
+        np.testing.assert_allclose(np.abs(points[[0, -1], 1]), 1.0, atol=1e-6)
+
+    def test_plane_through_vertices(self):
+        box = trimesh.creation.box()
+        (points, lengths, closed), = self.slice(box, [0, 0, 1], [0.5])
+
+        self.assertEqual(lengths.tolist(), [4])
+        self.assertTrue(closed[0])
+        np.testing.assert_allclose(np.abs(points), 0.5)
+
+    def test_plane_through_rounded_vertices(self):
+        # The vertices of the torus on the planes only lie there up to rounding
+        torus = trimesh.creation.torus(1.0, 0.3)
+        for normal in np.eye(3):
+            result, = self.slice(torus, normal, [0.0])
+            self.assertEqual(result[1].tolist(), [32, 32])
+
+            for points in polylines(result):
+                segments = np.diff(np.vstack([points, points[:1]]), axis=0)
+                self.assertGreater(np.linalg.norm(segments, axis=1).min(), 1e-3)
+
+    def test_invalid_normal(self):
+        box = trimesh.creation.box()
+        with self.assertRaises(ValueError):
+            self.slice(box, [0, 0, 0], [0.0])
+
+    def test_chain_segments(self):
+        # A cycle of three segments and a chain of two
+        start = np.array([10, 11, 12, 20, 21])
+        end = np.array([11, 12, 10, 21, 22])
+
+        following = link_segments(start, end)
+        np.testing.assert_array_equal(following, [1, 2, 0, 4, -1])
+
+        segments, lengths, closed = chain_segments(following)
+        np.testing.assert_array_equal(segments, [0, 1, 2, 3, 4])
+        self.assertEqual(lengths.tolist(), [3, 2])
+        self.assertEqual(closed.tolist(), [True, False])
+
+        # Nodes shared by more than two segments are not linked
+        following = link_segments(np.array([1, 1, 3]), np.array([2, 3, 1]))
+        np.testing.assert_array_equal(following, [-1, 2, -1])
+
+    def test_slice_mesh(self):
+        sphere = trimesh.creation.icosphere(4)
+        index = EdgeIndex.build(sphere.faces)
+        offsets = np.linspace(-0.9, 0.9, 7)
+        expected = slice_planes(sphere.vertices, sphere.faces, index, [0, 1, 1], offsets)
+
+        chunks = list(slice_mesh(sphere.vertices, sphere.faces, index, [0, 1, 1], offsets, chunk_size=3))
+        self.assertEqual([start for start, _ in chunks], [0, 3, 6])
+
+        # Slicing the chunks in worker processes gives the same result
+        with futures.ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context('spawn')) as executor:
+            parallel = list(slice_mesh(sphere.vertices, sphere.faces, index, [0, 1, 1], offsets,
+                                       executor=executor, chunk_size=3))
+
+        for results in [chunks, parallel]:
+            results = [result for _, planes in results for result in planes]
+            self.assertEqual(len(results), len(offsets))
+            for result, reference in zip(results, expected):
+                for values, reference_values in zip(result, reference):
+                    np.testing.assert_array_equal(values, reference_values)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import numpy as np
+import trimesh
+import unittest
+
+from elements.stats import STATS, compute_stats
+
+
+class TestStats(unittest.TestCase):
+
+    def test_closed_mesh(self):
+        sphere = trimesh.creation.icosphere(3, radius=2.0)
+        stats = compute_stats(np.asarray(sphere.vertices), np.asarray(sphere.faces))
+
+        self.assertEqual(set(stats), STATS)
+        self.assertEqual(stats['vertices'], len(sphere.vertices))
+        self.assertEqual(stats['faces'], len(sphere.faces))
+        np.testing.assert_allclose(stats['bounds'], sphere.bounds.ravel())
+        self.assertAlmostEqual(stats['area'], sphere.area)
+        self.assertAlmostEqual(stats['volume'], sphere.volume)
+        self.assertTrue(stats['watertight'])
+
+    def test_open_mesh(self):
+        box = trimesh.creation.box()
+        stats = compute_stats(np.asarray(box.vertices), np.asarray(box.faces)[2:])
+
+        self.assertAlmostEqual(stats['area'], 5.0)
+        self.assertFalse(stats['watertight'])
+
+    def test_empty_mesh(self):
+        stats = compute_stats(np.empty((0, 3)), np.empty((0, 3), dtype=np.int64))
+
+        self.assertEqual(stats['bounds'], [])
+        self.assertEqual((stats['area'], stats['volume'], stats['watertight']), (0.0, 0.0, False))
+
+
+if __name__ == '__main__':
+    unittest.main()
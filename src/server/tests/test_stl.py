@@ -0,0 +1,101 @@
+import numpy as np
+import os
+import shutil
+import tempfile
+import trimesh
+import unittest
+
+from elements.stl import is_binary_stl, merge_vertices, read_stl
+
+
+class TestStl(unittest.TestCase):
+
+    def setUp(self):
+        # Create a temporary directory for the STL files
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def assertSameMesh(self, path, reference):
+        vertices, faces = read_stl(path)
+
+        self.assertEqual(len(vertices), len(reference.vertices))
+        self.assertEqual(len(faces), len(reference.faces))
+        np.testing.assert_allclose(vertices[faces], reference.vertices[reference.faces], atol=1e-6)
+
+    def test_binary(self):
+        reference = trimesh.creation.icosphere(3)
+        path = os.path.join(self.dir, 'binary.stl')
+        reference.export(path, file_type='stl')
+
+        self.assertTrue(is_binary_stl(path))
+        self.assertSameMesh(path, reference)
+
+    def test_ascii(self):
+        reference = trimesh.creation.icosphere(3)
+        path = os.path.join(self.dir, 'ascii.stl')
+        reference.export(path, file_type='stl_ascii')
+
+        self.assertFalse(is_binary_stl(path))
+        self.assertSameMesh(path, reference)
+
+    def test_trailing_bytes(self):
+        reference = trimesh.creation.icosphere(3)
+        path = os.path.join(self.dir, 'trailing.stl')
+        reference.export(path, file_type='stl')
+
+        with open(path, 'ab') as f:
+            f.write(b'\0' * 30)
+
+        self.assertSameMesh(path, reference)
+
+        # Even if the header starts like an ASCII file
+        with open(path, 'r+b') as f:
+            f.write(b'solid exported'.ljust(80))
+
+        self.assertFalse(is_binary_stl(path))
+        self.assertSameMesh(path, reference)
+
+    def test_wrong_count(self):
+        reference = trimesh.creation.icosphere(3)
+        path = os.path.join(self.dir, 'count.stl')
+        reference.export(path, file_type='stl')
+
+        # The count exceeds the triangles in the file, which are read nonetheless
+        with open(path, 'r+b') as f:
+            f.write(b'solid'.ljust(80))
+            f.write(np.uint32(len(reference.faces) + 100).tobytes())
+
+        self.assertSameMesh(path, reference)
+
+        # The count is smaller than the triangles in the file, which are ignored then
+        with open(path, 'r+b') as f:
+            f.seek(80)
+            f.write(np.uint32(8).tobytes())
+
+        vertices, faces = read_stl(path)
+        self.assertEqual(len(faces), 8)
+
+    def test_empty(self):
+        path = os.path.join(self.dir, 'empty.stl')
+        for data in [b'', b'\0' * 84, b'solid empty\nendsolid empty\n', b'not an STL file']:
+            with open(path, 'wb') as f:
+                f.write(data)
+
+            with self.assertRaises(ValueError):
+                read_stl(path)
+
+    def test_merge_vertices(self):
+        triangles = np.array([[[0, 0, 0], [1, 0, 0], [0, 1, 0]],
+                              [[1, 0, 0], [1, 1, 0], [-0.0, 1, 0]]], dtype=np.float32)
+
+        vertices, faces = merge_vertices(triangles)
+
+        # Vertices are ordered by first occurrence and -0.0 is merged with 0.0
+        np.testing.assert_array_equal(vertices, [[0, 0, 0], [1, 0, 0], [0, 1, 0], [1, 1, 0]])
+        np.testing.assert_array_equal(faces, [[0, 1, 2], [1, 3, 2]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import json
+import trimesh
+import unittest
+
+from elements.mesh import Mesh
+from elements.project import Project
+from elements.tree import ObjectTree
+
+
+class TestObjectTree(unittest.TestCase):
+
+    def setUp(self):
+        self.root = Project('Root')
+        self.tree = ObjectTree(self.root, history=10)
+
+    def tearDown(self):
+        self.tree.close()
+
+    def test_serialization(self):
+        mesh = Mesh('Mesh 1', trimesh.creation.box())
+        self.root.add_mesh(mesh)
+
+        tree = json.loads(self.tree.get_json())
+        self.assertEqual(tree, [{'id': mesh.get_id(), 'label': 'Mesh 1', 'type': 'Mesh', 'children': []}])
+        self.assertEqual(json.loads(self.tree.get_json(mesh)), [])
+
+    def test_cache_invalidation(self):
+        self.assertEqual(json.loads(self.tree.get_json()), [])
+
+        mesh = Mesh('Mesh 1', trimesh.creation.box())
+        self.root.add_mesh(mesh)
+        self.assertEqual(len(json.loads(self.tree.get_json())), 1)
+
+        mesh.set_name('Renamed')
+        self.assertEqual(json.loads(self.tree.get_json())[0]['label'], 'Renamed')
+
+        self.root.remove_mesh(mesh)
+        self.assertEqual(json.loads(self.tree.get_json()), [])
+
+    def test_deltas(self):
+        self.assertEqual(self.tree.get_deltas(0), [])
+
+        mesh = Mesh('Mesh 1', trimesh.creation.box())
+        self.root.add_mesh(mesh)
+        mesh.set_name('Renamed')
+        mesh.set_arrays(mesh.data.vertices * 2.0, mesh.data.faces)
+        self.root.remove_mesh(mesh)
+
+        deltas = self.tree.get_deltas(0)
+        self.assertEqual([delta['action'] for delta in deltas], ['add', 'rename', 'geometry', 'remove'])
+        self.assertEqual([delta['revision'] for delta in deltas], [1, 2, 3, 4])
+        self.assertTrue(all(delta['id'] == mesh.get_id() for delta in deltas))
+        self.assertTrue(all(delta['parent'] == self.root.get_id() for delta in deltas))
+        self.assertEqual(deltas[1]['label'], 'Renamed')
+
+        self.assertEqual(len(self.tree.get_deltas(2)), 2)
+        self.assertEqual(self.tree.get_deltas(4), [])
+        self.assertTrue(self.tree.wait(3, timeout=0))
+        self.assertFalse(self.tree.wait(4, timeout=0))
+
+    def test_listeners(self):
+        revisions = []
+        listener = lambda: revisions.append(self.tree.revision)
+
+        self.tree.add_listener(listener)
+        self.root.add_mesh(Mesh('Mesh 1', trimesh.creation.box()))
+        self.tree.remove_listener(listener)
+        self.root.add_mesh(Mesh('Mesh 2', trimesh.creation.box()))
+
+        self.assertEqual(revisions, [1])
+
+    def test_history_overflow(self):
+        for i in range(20):
+            self.root.add_mesh(Mesh(f'Mesh {i}', trimesh.creation.box()))
+
+        # Deltas beyond the history require a reset
+        self.assertIsNone(self.tree.get_deltas(1))
+        self.assertEqual(len(self.tree.get_deltas(15)), 5)
+
+    def test_unrelated_changes(self):
+        other = Project('Other')
+        other.add_mesh(Mesh('Mesh 1', trimesh.creation.box()))
+        self.assertEqual(self.tree.revision, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
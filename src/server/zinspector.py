@@ -1,216 +1,222 @@
+#
+# zinspector.py - ZInspector server
+#
+# Entry point of the server. Only gRPC and the standard library are imported before the
+# port is bound. The service, together with the geometry and storage modules it uses, is
+# loaded in the background afterwards. See Frontend.
+#
+
 import argparse
+import asyncio
 import grpc
-import h5py
-import json
 import logging
-import os
+import signal
 import sys
-import trimesh
+import time
 import zinspector_pb2
 import zinspector_pb2_grpc
 
-from concurrent import futures
-
-from elements.mesh import Mesh
-from elements.project import Project, Mesh
-from elements.object import Object, ObjectIdDatabase
+from config import Configuration
+from metrics import Metrics, MetricsInterceptor, SamplingProfiler, serve_metrics
 
 log = logging.getLogger(__name__)
-logging.basicConfig(level=logging.DEBUG, format='%(levelname)s: %(message)s', stream=sys.stdout)
 
 
-class Configuration:
+class Frontend (zinspector_pb2_grpc.ZInspectorServicer):
     '''
-    Constants user for configuration
+    Servicer registered with the server before the service has been loaded. It answers
+    Health itself and forwards all other calls to the service, waiting until it has been
+    loaded.
+
+    The startup state is 'starting' until the service has been loaded, 'serving' while
+    the import workers are started and the encoders are warmed up and 'ready'
+    afterwards. If the service cannot be loaded, the state is 'failed' and forwarded
+    calls fail with UNAVAILABLE.
     '''
-    MESH_DATA_CHUNK_SIZE = 1024 * 1024 * 2  # Default limit for grpc is 4MB
-    MESH_ENCODING = 'glb'
 
-
-class Root (Object):
-    '''
-    The root object of the project database
-    '''
+    STARTING = 'starting'
+    SERVING = 'serving'
+    READY = 'ready'
+    FAILED = 'failed'
 
     def __init__(self):
-        super().__init__('Root')
-        self.projects = []
-
-    def get_children(self):
-        return self.projects
-
-    def add_project(self, project):
-        self.projects.append(project)
-
-    def __load__(self, parent: h5py.Group):
-        super().__load__(parent)
+        super().__init__()
+        self.state = Frontend.STARTING
+        self.message = ''
+        self.timings = {}  # State -> seconds since the start
+        self.service = None
+        self.geometry_manager = None
 
-    def __save__(self, parent: h5py.Group):
-        super().__save__(parent)
+        self._start = time.perf_counter()
+        self._condition = asyncio.Condition()
 
+        for method in zinspector_pb2.DESCRIPTOR.services_by_name['ZInspector'].methods:
+            if method.name != 'Health':
+                setattr(self, method.name, self.__forward__(method.name, method.server_streaming))
 
-class ZInspector(zinspector_pb2_grpc.ZInspectorServicer):
-    '''
-    Implementation of the ZInspector service
-    '''
-
-    # Top level object
-    root = Root()
-
-    def GetObjectTree(self, request, context):
+    async def start(self, **options):
         '''
-        Get the object tree for a project in a JSON format
-        beginning at a given object
+        Load the service with the given ZInspector options and warm it up, without blocking
+        the event loop.
         '''
-
-        log.info(f'GetObjectTree: {request.id}')
-
-        # Local function which recursively builds the tree
-        def build_tree(obj):
-            objs = []
-            for child in obj.get_children():
-                objs.append({
-                    'id': child.get_id(),
-                    'label': child.get_name(),
-                    'type': child.__type__(),
-                    'children': build_tree(child)
-                })
-
-            return objs
-
-        tree = {}
+        loop = asyncio.get_running_loop()
 
         try:
-            if request.id:
-                tree = build_tree(ObjectIdDatabase.get(request.id))
-            else:
-                tree = build_tree(ZInspector.root)
-
+            self.service = await loop.run_in_executor(None, lambda: self.__load__(**options))
         except Exception as e:
-            self.__handle_exception__(e, context, grpc.StatusCode.NOT_FOUND)
-
-        return zinspector_pb2.JSONResponse(json=json.dumps(tree))
-
-    def GetObjects(self, request, context):
-        '''
-        Get a list of objects in the project database
-        '''
-
-        log.info(f'GetObjects, parent={request.id}')
+            log.exception('Loading the service failed')
+            await self.__set_state__(Frontend.FAILED, str(e))
+            return
 
-        ids = []
+        await self.__set_state__(Frontend.SERVING)
+        log.info(f'Service loaded after {self.timings[Frontend.SERVING]:.2f}s')
 
         try:
-
-            if request.id:
-                parent = ObjectIdDatabase.get(request.id)
-            else:
-                parent = ZInspector.root
-
-            ids = [child.get_id() for child in parent.get_children()]
-
+            await loop.run_in_executor(None, self.service.warm_up)
         except Exception as e:
-            self.__handle_exception__(e, context, grpc.StatusCode.NOT_FOUND)
-
-        log.debug(f'Result: {ids}')
+            log.warning(f'Warming up the service failed: {e}')
 
-        return zinspector_pb2.IdResponse(ids=ids)
+        await self.__set_state__(Frontend.READY)
+        log.info(f'Server ready after {self.timings[Frontend.READY]:.2f}s')
 
-    def GetName(self, request, context):
+    def close(self):
         '''
-        Get the name of an object
+        Shut down the service if it has been loaded.
         '''
+        if self.service is not None:
+            self.service.shutdown()
 
-        log.info(f'GetName: {request.id}')
-
-        name = ''
-
-        try:
-            obj = ObjectIdDatabase.get(request.id)
-            name = obj.get_name()
-        except Exception as e:
-            self.__handle_exception__(e, context, grpc.StatusCode.NOT_FOUND)
+        if self.geometry_manager is not None:
+            self.geometry_manager.close()
 
-        return zinspector_pb2.NameResponse(name=name)
-
-    def CreateProject(self, request, context):
+    def prometheus(self, metrics: Metrics) -> str:
         '''
-        Create a new project
+        Get the metrics in the Prometheus text format, including the memory statistics of
+        the service once it has been loaded.
         '''
+        return self.service.__prometheus__() if self.service is not None else metrics.prometheus()
 
-        log.info(f'Create project: {request.name}')
-
-        try:
-            project = Project(request.name)
-            ZInspector.root.add_project(project)
-        except Exception as e:
-            self.__handle_exception__(e, context, grpc.StatusCode.NOT_FOUND)
-
-        return zinspector_pb2.IdResponse(ids=[project.get_id()])
-
-    def ImportMesh(self, request, context):
+    async def Health(self, request, context):
         '''
-        Import a mesh from a file into a project
+        Get the startup state of the server, optionally waiting until it is ready
         '''
-
-        log.info(f'Import mesh: {request.project}/{request.path}')
-
-        ids = []
-
-        try:
-            project = ObjectIdDatabase.get(request.project)
-            data = trimesh.load(request.path, file_type='stl')
-            mesh = Mesh(os.path.basename(request.path), data)
-            project.add_mesh(mesh)
-            ids = [mesh.get_id()]
-
-        except Exception as e:
-            self.__handle_exception__(e, context, grpc.StatusCode.NOT_FOUND)
-
-        return zinspector_pb2.IdResponse(ids=ids)
-
-    def GetMeshData(self, request, context):
+        if request.wait:
+            try:
+                await asyncio.wait_for(self.__wait__(lambda: self.state in (Frontend.READY, Frontend.FAILED)),
+                                       request.timeout or None)
+            except asyncio.TimeoutError:
+                pass
+
+        return zinspector_pb2.HealthResponse(state=self.state,
+                                             ready=self.state == Frontend.READY,
+                                             message=self.message,
+                                             uptime=time.perf_counter() - self._start,
+                                             timings=self.timings)
+
+    def __load__(self, geometry_budget=None, **options):
+        # Runs in a worker thread
+        from elements.memory import GeometryManager
+        from elements.mesh import Mesh
+        from service import ZInspector
+
+        if geometry_budget is not None:
+            self.geometry_manager = Mesh.geometry_manager = GeometryManager(geometry_budget)
+
+        return ZInspector(**options)
+
+    def __forward__(self, name: str, streaming: bool):
         '''
-        Get the data of a mesh
+        Create a method forwarding the calls of the given RPC to the service.
         '''
+        if streaming:
+            async def forward(request, context):
+                service = await self.__get_service__(context)
+                async for response in getattr(service, name)(request, context):
+                    yield response
+        else:
+            async def forward(request, context):
+                service = await self.__get_service__(context)
+                return await getattr(service, name)(request, context)
+
+        return forward
+
+    async def __get_service__(self, context):
+        await self.__wait__(lambda: self.state != Frontend.STARTING)
+
+        if self.service is None:
+            await context.abort(grpc.StatusCode.UNAVAILABLE, f'The service failed to start: {self.message}')
+
+        return self.service
+
+    async def __wait__(self, predicate):
+        async with self._condition:
+            await self._condition.wait_for(predicate)
+
+    async def __set_state__(self, state: str, message: str = ''):
+        async with self._condition:
+            self.state = state
+            self.message = message
+            self.timings[state] = time.perf_counter() - self._start
+            self._condition.notify_all()
+
+
+async def serve(port, chunk_size=Configuration.MESH_DATA_CHUNK_SIZE, import_workers=None, compute_workers=None,
+                geometry_budget=Configuration.GEOMETRY_BUDGET, preprocess=Configuration.PREPROCESS_STEPS,
+                metrics_port=Configuration.METRICS_PORT, profile_threshold=Configuration.PROFILE_THRESHOLD,
+                profile_dir=Configuration.PROFILE_DIR):
+    '''
+    Start the gRPC server and run it until it is terminated.
+    '''
 
-        log.info(f'Get mesh data: {request.id}')
+    log.info("Starting server...")
 
-        data = bytes()
+    metrics = Metrics()
+    profiler = SamplingProfiler(profile_threshold, profile_dir) if profile_threshold is not None else None
 
-        try:
-            data = ObjectIdDatabase.get(request.id).data.export(file_type=Configuration.MESH_ENCODING)
+    server = grpc.aio.server(interceptors=[MetricsInterceptor(metrics, profiler)])
 
-            for step, i in enumerate (range(0, len(data), Configuration.MESH_DATA_CHUNK_SIZE)):
-                yield zinspector_pb2.MeshChunk(format=Configuration.MESH_ENCODING,
-                                               index=step,
-                                               data=data[i:i + Configuration.MESH_DATA_CHUNK_SIZE])
+    frontend = Frontend()
 
-        except Exception as e:
-            self.__handle_exception__(e, context, grpc.StatusCode.NOT_FOUND)
+    zinspector_pb2_grpc.add_ZInspectorServicer_to_server(frontend, server)
+    server.add_insecure_port(f'[::]:{port}')
+    await server.start()
 
-    def __handle_exception__(self, e, context, status=grpc.StatusCode.UNKNOWN):
-        log.error(f'{e}')
-        context.set_details(str(e))
-        context.set_code(status)
+    log.info(f'Server started on port {port}')
 
+    metrics_server = serve_metrics(metrics_port, lambda: frontend.prometheus(metrics)) if metrics_port is not None else None
+    if metrics_server is not None:
+        log.info(f'Metrics served on port {metrics_port}')
 
-def serve(port):
-    '''
-    Start the gRPC server and enter its main loop.
-    '''
+    startup = asyncio.create_task(frontend.start(chunk_size=chunk_size, import_workers=import_workers,
+                                                 compute_workers=compute_workers, geometry_budget=geometry_budget,
+                                                 preprocess=preprocess, metrics=metrics, profiler=profiler))
 
-    log.info("Starting server...")
+    # Terminating the server instead of the process, so the worker processes are shut down
+    loop = asyncio.get_running_loop()
+    stopping = []
+    for signum in [signal.SIGTERM, signal.SIGINT]:
+        try:
+            loop.add_signal_handler(signum, lambda: stopping.append(asyncio.create_task(server.stop(grace=None))))
+        except NotImplementedError:
+            pass  # Not supported on Windows, where the process is killed anyway
 
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    try:
+        await server.wait_for_termination()
+    finally:
+        for signum in [signal.SIGTERM, signal.SIGINT]:
+            try:
+                loop.remove_signal_handler(signum)
+            except NotImplementedError:
+                pass
 
-    zinspector_pb2_grpc.add_ZInspectorServicer_to_server(ZInspector(), server)
-    server.add_insecure_port(f'[::]:{port}')
-    server.start()
+        await server.stop(grace=None)
+        startup.cancel()
+        frontend.close()
 
-    log.info(f'Server started on port {port}')
-
-    server.wait_for_termination()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        if profiler is not None:
+            profiler.close()
 
 
 if __name__ == "__main__":
@@ -218,9 +224,52 @@ if __name__ == "__main__":
     # Parse command line arguments
     parser = argparse.ArgumentParser(description="ZInspector server")
     parser.add_argument("--port", type=int, help="Port to listen on")
+    parser.add_argument("--chunk-size", type=int, default=Configuration.MESH_DATA_CHUNK_SIZE,
+                        help="Size of the streamed mesh data chunks in bytes")
+    parser.add_argument("--import-workers", type=int, default=None,
+                        help="Number of worker processes used for mesh imports (default: number of CPUs)")
+    parser.add_argument("--compute-workers", type=int, default=None,
+                        help="Number of threads used for CPU heavy requests (default: number of CPUs)")
+    parser.add_argument("--geometry-budget", type=int, default=None,
+                        help="Memory budget of the resident mesh geometry in MB (default: unlimited)")
+    parser.add_argument("--preprocess", nargs='*', default=None, metavar='STEP',
+                        help="Preprocessing steps applied to imported meshes, see preprocess.py, "
+                             "none if given without steps (default: all but split)")
+    parser.add_argument("--metrics-port", type=int, default=Configuration.METRICS_PORT,
+                        help="HTTP port serving the metrics for Prometheus at /metrics (default: disabled)")
+    parser.add_argument("--profile-slow", type=float, default=Configuration.PROFILE_THRESHOLD, metavar='SECONDS',
+                        help="Capture a sampling profile of requests taking at least this long (default: disabled)")
+    parser.add_argument("--profile-dir", default=Configuration.PROFILE_DIR,
+                        help="Directory the profiles of slow requests are written to")
+    parser.add_argument("--log-level", default=Configuration.LOG_LEVEL, choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help=f"Level of the server log (default: {Configuration.LOG_LEVEL})")
 
     args = parser.parse_args()
 
-    serve(args.port)
+    if not 0 < args.chunk_size <= Configuration.MESH_DATA_MAX_CHUNK_SIZE:
+        parser.error(f'--chunk-size must be between 1 and {Configuration.MESH_DATA_MAX_CHUNK_SIZE}')
+
+    for name in ['import_workers', 'compute_workers', 'geometry_budget']:
+        if getattr(args, name) is not None and getattr(args, name) < 1:
+            parser.error(f'--{name.replace("_", "-")} must be at least 1')
+
+    # The preprocessing module is only loaded to validate explicitly given steps
+    if args.preprocess:
+        from elements.preprocess import STEPS
+
+        unknown = set(args.preprocess) - set(STEPS)
+        if unknown:
+            parser.error(f'--preprocess: unknown steps {", ".join(sorted(unknown))}, expected {", ".join(STEPS)}')
+
+    logging.basicConfig(level=args.log_level, format='%(levelname)s: %(message)s', stream=sys.stdout)
+
+    try:
+        asyncio.run(serve(args.port, chunk_size=args.chunk_size,
+                          import_workers=args.import_workers, compute_workers=args.compute_workers,
+                          geometry_budget=args.geometry_budget * 1024 * 1024 if args.geometry_budget else Configuration.GEOMETRY_BUDGET,
+                          preprocess=args.preprocess if args.preprocess is not None else Configuration.PREPROCESS_STEPS,
+                          metrics_port=args.metrics_port, profile_threshold=args.profile_slow, profile_dir=args.profile_dir))
+    except KeyboardInterrupt:
+        pass
 
     log.info('Service stopped')